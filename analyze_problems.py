@@ -1,13 +1,31 @@
 import json
-import pandas as pd
+import re
+import zlib
 from collections import Counter
-import nltk
-nltk.download('punkt_tab')
-from nltk.corpus import stopwords
-nltk.download('stopwords')
-nltk.download('punkt')
+from functools import lru_cache
+from itertools import islice, chain
+import numpy as np
 
-STOPWORDS = set(stopwords.words('english'))
+# Danh sách stopword tiếng Anh (giống nltk.corpus.stopwords.words('english')), đi kèm mã nguồn
+# để không phải tải dữ liệu NLTK qua mạng mỗi lần khởi động
+STOPWORDS = frozenset("""
+i me my myself we our ours ourselves you you're you've you'll you'd your yours yourself
+yourselves he him his himself she she's her hers herself it it's its itself they them their
+theirs themselves what which who whom this that that'll these those am is are was were be
+been being have has had having do does did doing a an the and but if or because as until
+while of at by for with about against between into through during before after above below
+to from up down in out on off over under again further then once here there when where why
+how all any both each few more most other some such no nor not only own same so than too
+very s t can will just don don't should should've now d ll m o re ve y ain aren aren't
+couldn couldn't didn didn't doesn doesn't hadn hadn't hasn hasn't haven haven't isn isn't ma
+mightn mightn't mustn mustn't needn needn't shan shan't shouldn shouldn't wasn wasn't weren
+weren't won won't wouldn wouldn't
+""".split())
+
+# Tách từ bằng regex đã biên dịch, xấp xỉ nltk.word_tokenize: tách theo khoảng trắng, ngoặc,
+# dấu nháy và dấu câu; số thập phân, từ có gạch nối hay "t+1" vẫn là một token và bị loại
+# ở bước lọc chữ/số giống như khi dùng NLTK
+_TOKEN_RE = re.compile(r"""[^\s,;:@#$%&?!()\[\]{}<>"“”'‘’`]+""")
 
 # Đọc dữ liệu từ file JSON đầu vào
 def load_data(file_path):
@@ -21,32 +39,220 @@ def check_duplicates(data):
     duplicates = {q: c for q, c in duplicate_counts.items() if c > 1}
     return duplicates
 
+# Phát hiện câu gần trùng lặp bằng shingling + MinHash + LSH
+_NON_ALNUM_RE = re.compile(r'[\W_]+')
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+def shingles(text, size=5):
+    """
+    Tập shingle ký tự của câu đã chuẩn hóa (chữ thường, bỏ khoảng trắng và dấu câu),
+    nên cùng một câu bị ngắt dòng hoặc gạch nối khác nhau vẫn cho cùng các shingle.
+    """
+    text = _NON_ALNUM_RE.sub('', text.lower())
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def lsh_params(threshold, num_perm):
+    """Chọn số band và số hàng mỗi band để giảm tổng xác suất báo nhầm và bỏ sót quanh ngưỡng"""
+    step = 0.001
+    s = np.arange(0, 1, step) + step / 2
+    below = s < threshold
+    best, best_error = (1, num_perm), float("inf")
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        probability = 1 - (1 - s ** rows) ** bands
+        # Tích phân số theo s: báo nhầm dưới ngưỡng, bỏ sót trên ngưỡng
+        error = (probability[below].sum() + (1 - probability[~below]).sum()) * step
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+class NearDuplicateIndex:
+    """
+    Chỉ mục LSH nhận từng câu một (streaming). Mỗi câu mới được so với đại diện
+    của các cụm đã có; chỉ đại diện được lưu nên bộ nhớ tăng theo số câu không trùng.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, shingle_size=5, seed=1):
+        """
+        :param threshold: Độ tương đồng Jaccard tối thiểu để coi là gần trùng.
+        :param num_perm: Số hàm băm MinHash (độ dài chữ ký).
+        :param shingle_size: Độ dài shingle ký tự.
+        """
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = {}  # đại diện cụm -> chữ ký MinHash
+        self.clusters = {}  # đại diện cụm -> danh sách khóa thành viên
+
+    def signature(self, text):
+        """Chữ ký MinHash (uint32) của tập shingle"""
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingles(text, self.shingle_size)), dtype=np.uint64
+        )
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(hashes, self.a) + self.b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def add(self, key, text):
+        """
+        Thêm một câu vào chỉ mục.
+        :return: Khóa đại diện cụm mà câu thuộc về (chính `key` nếu đây là câu mới).
+        """
+        signature = self.signature(text)
+        band_keys = [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+        candidates = set()
+        for bucket, band_key in zip(self.buckets, band_keys):
+            candidates.update(bucket.get(band_key, ()))
+        for candidate in candidates:
+            if np.mean(self.signatures[candidate] == signature) >= self.threshold:
+                self.clusters[candidate].append(key)
+                return candidate
+
+        self.signatures[key] = signature
+        self.clusters[key] = [key]
+        for bucket, band_key in zip(self.buckets, band_keys):
+            bucket.setdefault(band_key, []).append(key)
+        return key
+
+def qa_text(item):
+    """Văn bản dùng để so trùng: câu hỏi và câu trả lời"""
+    return f"{item['question']} {item['answer']}"
+
+def iter_unique(items, index=None, text_fn=qa_text):
+    """Trả về lần lượt các mục không gần trùng với mục nào trước đó (giữ mục đầu tiên của mỗi cụm)"""
+    index = index or NearDuplicateIndex()
+    for i, item in enumerate(items):
+        if index.add(i, text_fn(item)) == i:
+            yield item
+
+def remove_near_duplicates(data, threshold=0.8, num_perm=128, methods_per_question=2):
+    """
+    Gom các câu gần trùng thành cụm và chỉ giữ một đại diện cho mỗi cụm.
+    :param methods_per_question: Số prompt mỗi câu hỏi tạo ra khi đánh giá (standard + CoT).
+    :return: (danh sách mục đã lọc, báo cáo số cụm và số prompt tiết kiệm được).
+    """
+    index = NearDuplicateIndex(threshold=threshold, num_perm=num_perm)
+    unique = list(iter_unique(data, index))
+    removed = len(data) - len(unique)
+    report = {
+        "clusters": sum(1 for members in index.clusters.values() if len(members) > 1),
+        "removed": removed,
+        "prompts_saved": removed * methods_per_question,
+    }
+    return unique, report
+
 # Kiểm tra câu hỏi/lời giải bị thiếu hoặc quá ngắn
 def check_invalid_entries(data):
     invalid_entries = [item for item in data if len(item["question"]) < 10 or len(item["answer"]) < 5]
     return invalid_entries
 
 
+@lru_cache(maxsize=None)
+def _nltk_tokenizer():
+    """Nạp nltk và tải dữ liệu punkt_tab một lần cho mỗi process (chỉ tải khi máy chưa có)"""
+    import nltk
+    try:
+        nltk.data.find("tokenizers/punkt_tab")
+    except LookupError:
+        nltk.download('punkt_tab', quiet=True)
+    return nltk.word_tokenize
+
 # Phân tích số lượng câu hỏi và chủ đề phổ biến
-def extract_keywords(text):
-    words = nltk.word_tokenize(text.lower())
+def extract_keywords(text, tokenizer="regex"):
+    """
+    Lấy từ khóa (chữ/số, không phải stopword) của một câu.
+    :param tokenizer: "regex" (mặc định, không cần mạng) hoặc "nltk" (dùng nltk.word_tokenize).
+    """
+    if tokenizer == "nltk":
+        words = _nltk_tokenizer()(text.lower())
+    else:
+        words = [word.rstrip(".") for word in _TOKEN_RE.findall(text.lower())]
     words = [word for word in words if word.isalnum() and word not in STOPWORDS]
     return words
 
+def _count_chunk(args):
+    """Đếm từ khóa, n-gram và tần suất theo nguồn cho một khối câu hỏi"""
+    chunk, ngram_sizes, tokenizer = args
+    topics = Counter()
+    ngrams = Counter()
+    per_source = {}
+    for item in chunk:
+        words = extract_keywords(item["question"], tokenizer)
+        topics.update(words)
+        for n in ngram_sizes:
+            ngrams.update(" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+        per_source.setdefault(item.get("source", "unknown"), Counter()).update(words)
+    return len(chunk), topics, ngrams, per_source
+
+def keyword_stats(items, top_k=10, ngram_sizes=(2, 3), chunk_size=10000, workers=None, tokenizer="regex"):
+    """
+    Thống kê từ khóa theo từng khối `chunk_size` câu; nhiều khối thì đếm song song trên nhiều process.
+    :param items: Iterable các mục {"question", ..., "source"?}, có thể là generator.
+    :param workers: Số process (None = số CPU; 1 = đếm tuần tự).
+    :return: dict với "total", "topics", "ngrams" (top-k) và "per_source" (top-k theo từng nguồn).
+    """
+    if tokenizer == "nltk":
+        _nltk_tokenizer()  # Tải punkt_tab trước khi chia khối, để các worker không tải lại
+    items = iter(items)
+    chunks = iter(lambda: list(islice(items, chunk_size)), [])
+    first = next(chunks, None)
+    second = next(chunks, None)
+    tasks = ((chunk, ngram_sizes, tokenizer) for chunk in chain(filter(None, [first, second]), chunks))
+
+    if second is None or workers == 1:
+        # Dữ liệu nhỏ: đếm trong cùng process để khởi động nhanh
+        return _merge_counts(map(_count_chunk, tasks), top_k)
+
+    from multiprocessing import Pool
+    with Pool(workers) as pool:
+        return _merge_counts(pool.imap_unordered(_count_chunk, tasks), top_k)
+
+def _merge_counts(parts, top_k):
+    total = 0
+    topics = Counter()
+    ngrams = Counter()
+    per_source = {}
+    for count, part_topics, part_ngrams, part_sources in parts:
+        total += count
+        topics.update(part_topics)
+        ngrams.update(part_ngrams)
+        for source, counts in part_sources.items():
+            per_source.setdefault(source, Counter()).update(counts)
+    return {
+        "total": total,
+        "topics": topics.most_common(top_k),
+        "ngrams": ngrams.most_common(top_k),
+        "per_source": {source: counts.most_common(top_k) for source, counts in per_source.items()},
+    }
+
 def analyze_data(data):
     print(f"Tổng số câu hỏi: {len(data)}")
     
     # Lấy các từ khóa chính trong câu hỏi
-    all_keywords = []
-    for item in data:
-        all_keywords.extend(extract_keywords(item["question"]))
-    
-    common_topics = Counter(all_keywords).most_common(10)
+    stats = keyword_stats(data)
     
     print("Chủ đề phổ biến:")
-    for topic, count in common_topics:
+    for topic, count in stats["topics"]:
         print(f"- {topic}: {count} lần")
 
+    print("Cụm từ phổ biến:")
+    for ngram, count in stats["ngrams"]:
+        print(f"- {ngram}: {count} lần")
+
+    if len(stats["per_source"]) > 1:
+        print("Chủ đề phổ biến theo nguồn:")
+        for source, topics in stats["per_source"].items():
+            print(f"- {source}: {', '.join(topic for topic, _ in topics[:5])}")
+    return stats
+
 # Lọc dữ liệu để loại bỏ các câu không hợp lệ
 def clean_data(data):
     clean_data = [item for item in data if len(item["question"]) >= 10 and len(item["answer"]) >= 5]
@@ -58,10 +264,7 @@ def save_clean_data(data, output_file):
         json.dump(data, f, indent=2, ensure_ascii=False)
     print(f"✅ Đã lưu dữ liệu sạch vào {output_file}")
 
-if __name__ == "__main__":
-    input_file = "db/questions/cot_questions.json"
-    output_file = "db/questions/cot_questions_clean.json"
-    
+def main(input_file="db/questions/cot_questions.json", output_file="db/questions/cot_questions_clean.json"):
     print("🔍 Đang phân tích dữ liệu...")
     data = load_data(input_file)
     
@@ -77,6 +280,12 @@ if __name__ == "__main__":
     
     print("🛠 Đang làm sạch dữ liệu...")
     cleaned_data = clean_data(data)
+    cleaned_data, report = remove_near_duplicates(cleaned_data)
+    print(f"♻️ Loại {report['removed']} câu gần trùng lặp trong {report['clusters']} cụm, "
+          f"tiết kiệm {report['prompts_saved']} prompt khi đánh giá")
     
     save_clean_data(cleaned_data, output_file)
     print("✅ Hoàn thành!")
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,174 @@
+import os
+import csv
 import json
-import pandas as pd
+import numpy as np
 import re
-from fuzzywuzzy import fuzz  # Dùng Levenshtein distance để so sánh
+from collections import Counter
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from rapidfuzz import fuzz, process  # Dùng Levenshtein distance để so sánh, tính theo batch đa luồng
+from rapidfuzz.distance import Levenshtein
+from results_io import iter_results
 
-# Đọc kết quả từ file JSON
+METHODS = ("standard", "cot")
+METRICS = ("ratio", "token_f1", "exact_match", "edit_distance")
+
+# Ngưỡng mặc định để coi một câu trả lời là đúng, theo từng độ đo
+DEFAULT_THRESHOLDS = {"ratio": 80}
+
+# Biên dịch sẵn regex chuẩn hóa
+_PUNCTUATION_RE = re.compile(r'[^\w\s]+')
+
+# Dưới ngưỡng này tính token-F1 trong cùng process sẽ nhanh hơn chia cho nhiều process
+PARALLEL_MIN_PAIRS = 20000
+
+# Đọc kết quả lần lượt từng bản ghi (question, method)
 def load_results(file_path):
-    """Đọc dữ liệu câu hỏi từ file JSON"""
+    """
+    Đọc kết quả đánh giá dưới dạng generator, mỗi phần tử là một bản ghi (câu hỏi, phương pháp).
+    File JSONL được đọc lười từng dòng; file JSON cũ (standard_answer/cot_answer) được tách thành các bản ghi.
+    """
+    if file_path.endswith(".jsonl"):
+        yield from iter_results(file_path)  # Câu trả lời chạy lại sau lỗi thay thế bản ghi lỗi trước đó
+        return
+
     with open(file_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+        items = json.load(f)
+    for index, item in enumerate(items):
+        for method in METHODS:
+            yield {
+                "index": index,
+                "question": item["question"],
+                "ground_truth": item["ground_truth"],
+                "method": method,
+                "answer": item[f"{method}_answer"],
+            }
 
 # Chuẩn hóa câu (chuyển thành chữ thường và loại bỏ dấu câu, khoảng trắng thừa)
 def clean_text(text):
     text = text.lower()  # Chuyển về chữ thường
-    text = re.sub(r'\s+', ' ', text)  # Loại bỏ khoảng trắng dư thừa
-    text = re.sub(r'[^\w\s]', '', text)  # Loại bỏ dấu câu
+    text = ' '.join(text.split())  # Loại bỏ khoảng trắng dư thừa
+    text = _PUNCTUATION_RE.sub('', text)  # Loại bỏ dấu câu
     return text.strip()
 
+# F1 theo token giữa câu trả lời và đáp án (kiểu SQuAD)
+def token_f1(reference, prediction):
+    ref_tokens = reference.split()
+    pred_tokens = prediction.split()
+    if not ref_tokens or not pred_tokens:
+        return float(ref_tokens == pred_tokens)
+    common = sum((Counter(ref_tokens) & Counter(pred_tokens)).values())
+    # 2PR / (P + R) với P = common / |pred|, R = common / |ref|
+    return 2 * common / (len(pred_tokens) + len(ref_tokens))
+
+def _token_f1_chunk(pairs):
+    return [token_f1(r, p) for r, p in pairs]
+
+def token_f1_many(references, predictions, workers=-1):
+    """Token-F1 cho nhiều cặp, chia cho nhiều process khi số cặp đủ lớn"""
+    pairs = list(zip(references, predictions))
+    if workers == 1 or len(pairs) < PARALLEL_MIN_PAIRS:
+        return np.array(_token_f1_chunk(pairs), dtype=np.float32)
+    max_workers = None if workers < 0 else workers
+    size = -(-len(pairs) // (4 * (max_workers or os.cpu_count() or 1)))
+    chunks = [pairs[i:i + size] for i in range(0, len(pairs), size)]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return np.array([f1 for part in executor.map(_token_f1_chunk, chunks) for f1 in part], dtype=np.float32)
+
+# Chấm điểm một batch cặp (đáp án, câu trả lời) cùng lúc
+def score_pairs(references, predictions, metrics=METRICS, workers=-1):
+    """
+    Tính các độ đo cho từng cặp đã chuẩn hóa, dùng rapidfuzz.cpdist chạy đa luồng.
+    :param workers: Số luồng/process dùng để chấm điểm (-1 = tất cả CPU).
+    :return: dict tên độ đo -> mảng numpy, cùng thứ tự với đầu vào.
+    """
+    scores = {}
+    if "ratio" in metrics:
+        # Làm tròn như fuzzywuzzy.fuzz.ratio để ngưỡng > 80 giữ nguyên ý nghĩa
+        scores["ratio"] = np.rint(process.cpdist(references, predictions, scorer=fuzz.ratio, workers=workers))
+    if "edit_distance" in metrics:
+        scores["edit_distance"] = process.cpdist(
+            references, predictions, scorer=Levenshtein.normalized_distance, workers=workers
+        ).astype(np.float32)
+    if "exact_match" in metrics:
+        scores["exact_match"] = np.array(references, dtype=object) == np.array(predictions, dtype=object)
+    if "token_f1" in metrics:
+        scores["token_f1"] = token_f1_many(references, predictions, workers)
+    return scores
+
+# So sánh điểm với ngưỡng; edit_distance càng nhỏ càng tốt nên dùng <=
+def passes_thresholds(scores, thresholds):
+    passed = np.ones(len(next(iter(scores.values()))), dtype=bool)
+    for metric, threshold in thresholds.items():
+        if metric == "edit_distance":
+            passed &= scores[metric] <= threshold
+        elif metric == "exact_match":
+            passed &= scores[metric] >= bool(threshold)
+        else:
+            passed &= scores[metric] > threshold
+    return passed
+
 # Phân tích kết quả: tính độ chính xác (so sánh mềm)
-def analyze_results(results):
-    """Phân tích kết quả đánh giá"""
-    correct_standard = 0
-    correct_cot = 0
-    total = len(results)
-
-    for item in results:
-        gt_answer = clean_text(item["ground_truth"])
-        standard_answer = clean_text(item["standard_answer"])
-        cot_answer = clean_text(item["cot_answer"])
-
-        # Sử dụng Levenshtein distance để tính độ tương đồng
-        standard_similarity = fuzz.ratio(gt_answer, standard_answer)
-        cot_similarity = fuzz.ratio(gt_answer, cot_answer)
-
-        # So sánh và đánh giá
-        if standard_similarity > 80:  # Nếu tương đồng > 80%
-            correct_standard += 1
-        if cot_similarity > 80:  # Nếu tương đồng > 80%
-            correct_cot += 1
-
-        # Hiển thị ví dụ khi độ tương đồng thấp
-        if standard_similarity < 80 or cot_similarity < 80:
-            print(f"⚠️ Câu hỏi: {item['question']}")
-            print(f"✅ Ground Truth: {item['ground_truth']}")
-            print(f"🧠 Standard Answer: {item['standard_answer']} (Tương đồng: {standard_similarity}%)")
-            print(f"🧠 CoT Answer: {item['cot_answer']} (Tương đồng: {cot_similarity}%)")
-            print("-" * 100)
-
-    accuracy_standard = correct_standard / total * 100
-    accuracy_cot = correct_cot / total * 100
+def analyze_results(results, thresholds=None, scores_file=None, chunk_size=50000, workers=-1):
+    """
+    Phân tích kết quả đánh giá theo từng khối `chunk_size` bản ghi nên bộ nhớ không phụ thuộc số câu hỏi.
+    :param thresholds: dict độ đo -> ngưỡng để tính là đúng (mặc định: ratio > 80).
+    :param scores_file: File Parquet để ghi điểm của từng bản ghi (None = không ghi).
+    """
+    if scores_file:
+        import pyarrow as pa  # Chỉ cần khi ghi điểm ra Parquet
+        import pyarrow.parquet as pq
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+    metrics = tuple(dict.fromkeys(METRICS + tuple(thresholds)))
+    correct = Counter()
+    total = Counter()
+    sums = {}
+    writer = None
+    results = iter(results)
+
+    try:
+        while True:
+            chunk = list(islice(results, chunk_size))
+            if not chunk:
+                break
+            references = [clean_text(item["ground_truth"]) for item in chunk]
+            predictions = [clean_text(item["answer"]) for item in chunk]
+            scores = score_pairs(references, predictions, metrics, workers)
+            passed = passes_thresholds(scores, thresholds)
+            methods = np.array([item["method"] for item in chunk], dtype=object)
+
+            for method in set(methods):
+                mask = methods == method
+                total[method] += int(mask.sum())
+                correct[method] += int(passed[mask].sum())
+                for metric, values in scores.items():
+                    sums[(method, metric)] = sums.get((method, metric), 0.0) + float(values[mask].sum())
+
+            if scores_file:
+                table = pa.table({
+                    "index": [item.get("index") for item in chunk],
+                    "method": methods.tolist(),
+                    **{metric: values for metric, values in scores.items()},
+                    "correct": passed,
+                })
+                if writer is None:
+                    directory = os.path.dirname(scores_file)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    writer = pq.ParquetWriter(scores_file, table.schema)
+                writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    for method in sorted(total):
+        means = ", ".join(f"{metric}={sums[(method, metric)] / total[method]:.3f}" for metric in metrics)
+        print(f"📊 {method}: {correct[method]}/{total[method]} đúng ({means})")
+    if scores_file:
+        print(f"✅ Đã lưu điểm từng câu trả lời vào {scores_file}")
+
+    accuracy_standard = correct["standard"] / total["standard"] * 100 if total["standard"] else 0.0
+    accuracy_cot = correct["cot"] / total["cot"] * 100 if total["cot"] else 0.0
 
     print(f"✅ Độ chính xác của Standard Prompting: {accuracy_standard:.2f}%")
     print(f"✅ Độ chính xác của Chain of Thought (CoT): {accuracy_cot:.2f}%")
@@ -56,21 +177,26 @@ def analyze_results(results):
 
 # Lưu kết quả phân tích
 def save_analysis(accuracy_standard, accuracy_cot, output_file):
-    """Lưu kết quả phân tích vào file CSV"""
-    data = {
-        "Method": ["Standard Prompting", "Chain of Thought (CoT)"],
-        "Accuracy (%)": [accuracy_standard, accuracy_cot]
-    }
-    df = pd.DataFrame(data)
-    df.to_csv(output_file, index=False)
+    """Lưu kết quả phân tích vào file CSV (ghi bằng module csv, không cần tải pandas cho hai dòng)"""
+    rows = [
+        ("Standard Prompting", float(accuracy_standard)),
+        ("Chain of Thought (CoT)", float(accuracy_cot)),
+    ]
+    with open(output_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["Method", "Accuracy (%)"])
+        writer.writerows(rows)
     print(f"✅ Đã lưu kết quả phân tích vào {output_file}")
 
 if __name__ == "__main__":
-    input_file = "results/evaluated_results.json"
+    input_file = "results/evaluated_results.jsonl"
+    if not os.path.exists(input_file):
+        input_file = "results/evaluated_results.json"  # Kết quả cũ ở định dạng JSON
     output_file = "results/analysis_results.csv"
+    scores_file = "results/item_scores.parquet"
 
     print("🔍 Đang phân tích kết quả đánh giá...")
     results = load_results(input_file)
-    accuracy_standard, accuracy_cot = analyze_results(results)
+    accuracy_standard, accuracy_cot = analyze_results(results, scores_file=scores_file)
     save_analysis(accuracy_standard, accuracy_cot, output_file)
     print("✅ Hoàn thành phân tích!")
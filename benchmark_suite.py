@@ -0,0 +1,317 @@
+"""
+Offline, reproducible benchmarks for the pipeline stages:
+
+    extract   PDF text + Q&A extraction on data/raw/documents (cold and warm cache)
+    clean     validity filter, near-duplicate removal and keyword stats (analyze_problems)
+    evaluate  answering questions with a tiny randomly initialized GPT-2 (evaluate_models)
+    analyze   scoring evaluation results (analyze_results)
+    data_gen  synthetic materials data generation (data/raw/data_gen.py)
+
+Every stage runs in a fresh process so peak RSS is measured per stage.
+Synthetic inputs are generated from a fixed seed for each size in --sizes.
+
+    python benchmark_suite.py run --output benchmarks/before.json
+    python benchmark_suite.py compare benchmarks/before.json benchmarks/after.json --threshold 0.1
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PDF_DIR = os.path.join(ROOT, "data", "raw", "documents")
+STAGES = ("extract", "clean", "evaluate", "analyze", "data_gen")
+DEFAULT_SIZES = (1000, 10000)
+SEED = 0
+EVALUATE_MAX_QUESTIONS = 256
+
+MATERIALS = ["CuO", "Si", "Ge", "GaAs", "CuMnSnO", "ZnO", "IGZO", "SnO2"]
+PROPERTIES = ["band gap", "resistivity", "carrier mobility", "threshold voltage", "on/off ratio", "grain size"]
+PROCESSES = ["annealing", "sputtering", "sol-gel deposition", "doping", "oxygen plasma treatment"]
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def percentiles(latencies):
+    """p50/p95/p99 of a list of seconds, in milliseconds."""
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+def synthetic_questions(n, seed=SEED, duplicate_rate=0.1):
+    """Question/answer pairs about thin-film materials; `duplicate_rate` of them are near-duplicates."""
+    rng = random.Random(seed)
+    items = []
+    for i in range(n):
+        if items and rng.random() < duplicate_rate:
+            source = rng.choice(items)
+            items.append({"question": source["question"].replace("?", " ?"), "answer": source["answer"] + ".",
+                          "source": source["source"]})
+            continue
+        material, prop, process = rng.choice(MATERIALS), rng.choice(PROPERTIES), rng.choice(PROCESSES)
+        items.append({
+            "question": f"How does {process} change the {prop} of {material} films (sample {i})?",
+            "answer": f"{process.capitalize()} shifts the {prop} of {material} by {rng.uniform(0.1, 9.9):.2f} "
+                      f"percent because of {rng.choice(PROCESSES)} induced defects.",
+            "source": f"paper_{i % 7}.pdf",
+        })
+    return items
+
+def synthetic_results(questions, seed=SEED):
+    """Evaluation records (standard + cot) whose answers partly match the ground truth."""
+    rng = random.Random(seed)
+    records = []
+    for i, item in enumerate(questions):
+        for method in ("standard", "cot"):
+            words = item["answer"].split()
+            keep = rng.randint(len(words) // 2, len(words))
+            records.append({"index": i, "question": item["question"], "ground_truth": item["answer"],
+                            "method": method, "answer": " ".join(words[:keep])})
+    return records
+
+def tiny_generator(questions, seed=SEED):
+    """A text-generation pipeline around a 2-layer random GPT-2 with a BPE tokenizer trained on `questions`."""
+    import torch
+    from tokenizers import Tokenizer, models, trainers, pre_tokenizers, decoders
+    from transformers import PreTrainedTokenizerFast, GPT2Config, GPT2LMHeadModel, pipeline
+
+    texts = [item["question"] + " " + item["answer"] for item in questions]
+    tok = Tokenizer(models.BPE())
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tok.decoder = decoders.ByteLevel()
+    tok.train_from_iterator(texts, trainers.BpeTrainer(vocab_size=512, special_tokens=["<|endoftext|>"],
+                                                       initial_alphabet=pre_tokenizers.ByteLevel.alphabet()))
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tok, bos_token="<|endoftext|>",
+                                        eos_token="<|endoftext|>", pad_token="<|endoftext|>")
+    torch.manual_seed(seed)
+    config = GPT2Config(vocab_size=len(tokenizer), n_positions=512, n_embd=64, n_layer=2, n_head=4,
+                        bos_token_id=0, eos_token_id=0, pad_token_id=0)
+    model = GPT2LMHeadModel(config).eval()
+    return pipeline("text-generation", model=model, tokenizer=tokenizer, pad_token_id=0)
+
+def _write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+def bench_extract(size, workdir):
+    import extract_questions
+
+    pdfs = sorted(os.path.join(PDF_DIR, f) for f in os.listdir(PDF_DIR) if f.endswith(".pdf"))
+    latencies, pairs = [], 0
+    for path in pdfs:
+        start = time.perf_counter()
+        pairs += len(extract_questions.extract_from_pdf(path))
+        latencies.append(time.perf_counter() - start)
+
+    cache_dir = os.path.join(workdir, "pdf_cache")
+    output = os.path.join(workdir, "questions.json")
+    start = time.perf_counter()
+    extract_questions.main(PDF_DIR, output, cache_dir=cache_dir)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    extract_questions.main(PDF_DIR, output, cache_dir=cache_dir)
+    warm = time.perf_counter() - start
+    return {"items": len(pdfs), "unit": "pdfs/s", "throughput": len(pdfs) / sum(latencies),
+            "qa_pairs": pairs, "cold_run_s": cold, "warm_run_s": warm, **percentiles(latencies)}
+
+def bench_clean(size, workdir):
+    import analyze_problems
+
+    data = synthetic_questions(size)
+    start = time.perf_counter()
+    cleaned = analyze_problems.clean_data(data)
+    unique, report = analyze_problems.remove_near_duplicates(cleaned)
+    analyze_problems.keyword_stats(unique, workers=1)
+    elapsed = time.perf_counter() - start
+
+    # Latency of the per-item path: signature + LSH lookup for single questions
+    index = analyze_problems.NearDuplicateIndex()
+    latencies = []
+    for i, item in enumerate(data[:min(size, 2000)]):
+        start = time.perf_counter()
+        index.add(i, analyze_problems.qa_text(item))
+        latencies.append(time.perf_counter() - start)
+    return {"items": size, "unit": "questions/s", "throughput": size / elapsed, "removed": report["removed"],
+            **percentiles(latencies)}
+
+def bench_evaluate(size, workdir):
+    import evaluate_models
+
+    # Generation is ~1000x slower than the other stages, so it answers a proportional subset
+    questions = synthetic_questions(min(EVALUATE_MAX_QUESTIONS, max(8, size // 50)))
+    evaluate_models._generator = tiny_generator(questions)
+    input_file = os.path.join(workdir, "questions.json")
+    _write_json(input_file, questions)
+
+    stats = evaluate_models.evaluate_questions_batched(
+        input_file, os.path.join(workdir, "results.jsonl"), batch_size=16, max_length=96, use_cache=False
+    )
+    latencies = []
+    for item in questions[:16]:
+        start = time.perf_counter()
+        evaluate_models.generate_batch([evaluate_models.build_prompt(item["question"], "standard")], max_length=96)
+        latencies.append(time.perf_counter() - start)
+    return {"items": len(questions), "unit": "questions/s", "throughput": stats["questions_per_sec"],
+            "tokens_per_sec": stats["tokens_per_sec"], **percentiles(latencies)}
+
+def bench_analyze(size, workdir):
+    import analyze_results
+
+    records = synthetic_results(synthetic_questions(size))
+    start = time.perf_counter()
+    analyze_results.analyze_results(iter(records), workers=1)
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    for record in records[:min(len(records), 2000)]:
+        start = time.perf_counter()
+        analyze_results.score_pairs([analyze_results.clean_text(record["ground_truth"])],
+                                    [analyze_results.clean_text(record["answer"])], workers=1)
+        latencies.append(time.perf_counter() - start)
+    return {"items": len(records), "unit": "records/s", "throughput": len(records) / elapsed,
+            **percentiles(latencies)}
+
+def bench_data_gen(size, workdir):
+    sys.path.insert(0, os.path.join(ROOT, "data", "raw"))
+    import data_gen
+
+    rows = size * 100
+    start = time.perf_counter()
+    data_gen.write_dataset(rows, os.path.join(workdir, "materials.parquet"), chunk_size=max(1, rows // 10),
+                           workers=1, seed=SEED)
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    for i in range(20):
+        start = time.perf_counter()
+        data_gen.generate_chunk(10_000, i)
+        latencies.append(time.perf_counter() - start)
+    return {"items": rows, "unit": "rows/s", "throughput": rows / elapsed, **percentiles(latencies)}
+
+BENCHMARKS = {
+    "extract": bench_extract,
+    "clean": bench_clean,
+    "evaluate": bench_evaluate,
+    "analyze": bench_analyze,
+    "data_gen": bench_data_gen,
+}
+# Stages whose input does not depend on --sizes run once
+SIZE_INDEPENDENT = {"extract"}
+
+def _run_stage(stage, size):
+    """Child-process entry point: run one stage with stdout silenced and report its peak RSS."""
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    os.environ["GENERATION_CACHE"] = "0"
+    os.environ.setdefault("TRANSFORMERS_VERBOSITY", "error")
+    with tempfile.TemporaryDirectory() as workdir, open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            start = time.perf_counter()
+            result = BENCHMARKS[stage](size, workdir)
+            result["elapsed_s"] = time.perf_counter() - start
+        finally:
+            sys.stdout = stdout
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(stages=STAGES, sizes=DEFAULT_SIZES, output_file=None):
+    """
+    Run the selected stages (each size in its own process) and optionally save the results as JSON.
+    :return: Dict with "meta" and "results" keyed like "clean[n=1000]".
+    """
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for stage in stages:
+        for size in ([None] if stage in SIZE_INDEPENDENT else sizes):
+            key = stage if size is None else f"{stage}[n={size}]"
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results[key] = executor.submit(_run_stage, stage, size).result()
+            r = results[key]
+            print(f"⏱️ {key:<22} {r['throughput']:>12,.1f} {r['unit']:<12} p50 {r.get('p50_ms', 0):8.2f} ms  "
+                  f"p95 {r.get('p95_ms', 0):8.2f} ms  peak RSS {r['peak_rss_mb']:7.1f} MB")
+
+    report = {
+        "meta": {"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "sizes": list(sizes), "seed": SEED},
+        "results": results,
+    }
+    if output_file:
+        directory = os.path.dirname(output_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Saved benchmark results to {output_file}")
+    return report
+
+def compare(baseline, current, threshold=0.10):
+    """
+    Compare two saved runs. Throughput must not drop, and p95 latency / peak RSS must not grow,
+    by more than `threshold` (a fraction).
+    :return: List of regression descriptions (empty when there are none).
+    """
+    regressions = []
+    for key, new in current["results"].items():
+        old = baseline["results"].get(key)
+        if old is None:
+            continue
+        checks = [("throughput", -1), ("p95_ms", 1), ("peak_rss_mb", 1)]
+        for metric, direction in checks:
+            if metric not in old or metric not in new or not old[metric]:
+                continue
+            change = (new[metric] - old[metric]) / old[metric]
+            flag = change * direction > threshold
+            mark = "❌" if flag else "  "
+            print(f"{mark} {key:<22} {metric:<12} {old[metric]:>12.2f} -> {new[metric]:>12.2f} ({change:+.1%})")
+            if flag:
+                regressions.append(f"{key} {metric} {change:+.1%}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark suite for the extraction -> evaluation -> analysis pipeline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run = subparsers.add_parser("run", help="Run the benchmarks")
+    run.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES)
+    run.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES), help="Synthetic dataset sizes")
+    run.add_argument("--output", default=None, help="JSON file for the results (default: benchmarks/<commit>.json)")
+    cmp = subparsers.add_parser("compare", help="Compare two result files")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+    cmp.add_argument("--threshold", type=float, default=0.10, help="Allowed relative regression (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        output = args.output or os.path.join("benchmarks", f"{git_commit() or 'results'}.json")
+        run_suite(args.stages, args.sizes, output)
+    else:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.current, "r", encoding="utf-8") as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+        print("✅ No regressions")
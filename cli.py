@@ -0,0 +1,281 @@
+"""
+Command-line entry point for the whole pipeline:
+
+    python cli.py extract  --input_dir data/raw/documents --output_file db/questions/cot_questions.json
+    python cli.py clean    --input_file db/questions/cot_questions.json
+    python cli.py evaluate --batched
+    python cli.py analyze
+    python cli.py generate "Explain band gaps." --model_type gemini
+
+Each subcommand imports its module (and torch, transformers or the Gemini SDK)
+only when it runs, so `analyze` and `clean` never pay for loading a model.
+`--profile-startup` reports the import and initialization time of every module;
+`--telemetry` records per-request generation telemetry (see telemetry.py).
+"""
+
+import os
+import sys
+import time
+import argparse
+import importlib.abc
+from contextlib import contextmanager
+
+class _TimedLoader:
+    """Wraps a module loader to time `exec_module` (the module body, including nested imports)."""
+
+    def __init__(self, loader, profiler, name):
+        self._loader = loader
+        self._profiler = profiler
+        self._name = name
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        with self._profiler.timing(self._name):
+            self._loader.exec_module(module)
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+class StartupProfiler(importlib.abc.MetaPathFinder):
+    """
+    Records how long each module takes to import and each named initialization step takes.
+    Installed first on sys.meta_path; it only wraps the spec found by the regular finders.
+    """
+
+    def __init__(self, enabled=True):
+        """
+        :param enabled: False turns every method into a no-op.
+        """
+        self.enabled = enabled
+        self.imports = {}  # module -> [cumulative seconds, self seconds]
+        self.stages = []  # (name, seconds)
+        self._stack = []
+        self._import_total = 0.0  # Outermost imports only, so nested ones are not counted twice
+        self._start = time.perf_counter()
+
+    def install(self):
+        if self.enabled and self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self, name)
+        return spec
+
+    @contextmanager
+    def timing(self, name):
+        """Time one module body; time spent in nested imports is subtracted from its self time."""
+        self._stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            else:
+                self._import_total += elapsed
+            self.imports[name] = [elapsed, elapsed - children]
+
+    @contextmanager
+    def stage(self, name):
+        """Time a named initialization step, e.g. building a model."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - start))
+
+    def mark(self, name):
+        """Record the time elapsed since the profiler was created."""
+        if self.enabled:
+            self.stages.append((name, time.perf_counter() - self._start))
+
+    def report(self, top=20, file=sys.stderr):
+        """Print the slowest imports (cumulative and self time) and the timed steps."""
+        if not self.enabled:
+            return
+        print("\n⏱️ Startup profile", file=file)
+        print(f"{'cumulative ms':>14} {'self ms':>10}  module", file=file)
+        slowest = sorted(self.imports.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        for name, (cumulative, own) in slowest:
+            print(f"{cumulative * 1000:14.1f} {own * 1000:10.1f}  {name}", file=file)
+        print(f"{len(self.imports)} modules imported in {self._import_total * 1000:.1f} ms", file=file)
+        for name, seconds in self.stages:
+            print(f"{seconds * 1000:14.1f} ms  {name}", file=file)
+
+def cmd_extract(args, profiler):
+    from extract_questions import main, load_rules
+    profiler.mark("startup")
+    rules = load_rules(args.rules) if args.rules else None
+    main(args.input_dir, args.output_file, args.workers, args.pages_per_task, args.cache_dir, rules)
+
+def cmd_clean(args, profiler):
+    from analyze_problems import main
+    profiler.mark("startup")
+    main(args.input_file, args.output_file)
+
+def cmd_evaluate(args, profiler):
+    import evaluate_models
+    from streaming import condition_from_cli
+    with profiler.stage("init: text-generation pipeline"):
+        evaluate_models.get_generator()
+    profiler.mark("startup")
+
+    stop = condition_from_cli(args.stop, args.final_answer)
+    methods = ("standard", "cot") + ((evaluate_models.SELF_CONSISTENCY_METHOD,) if args.self_consistency else ())
+    samples = args.self_consistency or evaluate_models.SELF_CONSISTENCY_SAMPLES
+    print("🚀 Bắt đầu đánh giá mô hình GPT-2 hoặc GPT-Neo...")
+    if args.batched:
+        evaluate_models.evaluate_questions_batched(args.input_file, args.output_file, batch_size=args.batch_size,
+                                                   methods=methods, use_cache=not args.no_cache,
+                                                   refresh_cache=args.refresh_cache, stop=stop, samples=samples)
+    else:
+        evaluate_models.evaluate_questions(args.input_file, args.output_file, use_cache=not args.no_cache,
+                                           methods=methods, refresh_cache=args.refresh_cache,
+                                           use_prefix_cache=args.prefix_cache, stop=stop, samples=samples)
+    if not args.no_cache and evaluate_models.GENERATION_CACHE_ENABLED:
+        print(f"💾 Cache: {evaluate_models.get_cache().stats()}")
+    print("✅ Hoàn thành đánh giá!")
+
+def cmd_analyze(args, profiler):
+    from analyze_results import load_results, analyze_results, save_analysis
+    profiler.mark("startup")
+
+    input_file = args.input_file
+    if not os.path.exists(input_file) and input_file.endswith(".jsonl"):
+        input_file = input_file[:-1]  # Kết quả cũ ở định dạng JSON
+    print("🔍 Đang phân tích kết quả đánh giá...")
+    accuracy_standard, accuracy_cot = analyze_results(load_results(input_file), scores_file=args.scores_file or None)
+    save_analysis(accuracy_standard, accuracy_cot, args.output_file)
+    print("✅ Hoàn thành phân tích!")
+
+def cmd_generate(args, profiler):
+    import model_manager
+    from streaming import condition_from_cli
+    server_url = args.server or model_manager.INFERENCE_SERVER_URL
+    if args.model_type == "llama" and server_url:
+        if args.stream:
+            print("⚠️ --stream is not available with the inference server; printing the full answer")
+        profiler.mark("startup")
+        print(model_manager.generate_text(args.prompt, args.model_type, args.max_tokens, args.temperature,
+                                          seed=args.seed, use_cache=not args.no_cache,
+                                          stop=condition_from_cli(args.stop, args.final_answer),
+                                          server_url=server_url))
+        return
+    with profiler.stage(f"init: {args.model_type} model"):
+        if args.model_type == "llama":
+            model_manager.load_llama_model()
+        else:
+            model_manager.load_gemini_model()
+    profiler.mark("startup")
+    stop = condition_from_cli(args.stop, args.final_answer)
+    if args.stream:
+        with model_manager.stream_text(args.prompt, args.model_type, args.max_tokens, args.temperature, stop,
+                                       seed=args.seed) as stream:
+            for delta in stream:
+                print(delta, end="", flush=True)
+        stats = stream.stats
+        ttft = f"{stats.ttft * 1000:.0f} ms" if stats.ttft is not None else "n/a"
+        print(f"\n✂️ {stats.tokens} tokens ({stats.stop_reason}), first token after {ttft}, {stats.tokens_saved} saved")
+        return
+    print(model_manager.generate_text(args.prompt, args.model_type, args.max_tokens, args.temperature,
+                                      seed=args.seed, use_cache=not args.no_cache, stop=stop))
+
+def add_stop_arguments(parser):
+    parser.add_argument("--stop", action="append", default=None,
+                        help="Stop sequence, repeatable; escapes such as \\n are decoded")
+    parser.add_argument("--final_answer", action="store_true",
+                        help="Stop once a complete \"Final answer: ...\" line has been generated")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Semiconductor CoT pipeline: extract, clean, evaluate, analyze, generate.")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Report import and initialization time per module")
+    parser.add_argument("--telemetry", action="store_true",
+                        help="Record per-request generation telemetry (same as TELEMETRY=1)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    extract = subparsers.add_parser("extract", help="Extract Q&A pairs from PDF documents")
+    extract.add_argument("--input_dir", required=True, help="Directory containing the PDF files")
+    extract.add_argument("--output_file", required=True, help="JSON file to write the Q&A pairs to")
+    extract.add_argument("--workers", type=int, default=1, help="Processes used to read PDFs in parallel")
+    extract.add_argument("--pages_per_task", type=int, default=8, help="Pages per task when splitting a PDF")
+    extract.add_argument("--cache_dir", default="db/cache/pdf", help="Per-PDF extraction cache")
+    extract.add_argument("--rules", default=None, help="JSON file with extraction rules")
+    extract.set_defaults(func=cmd_extract)
+
+    clean = subparsers.add_parser("clean", help="Analyze and clean a Q&A dataset")
+    clean.add_argument("--input_file", default="db/questions/cot_questions.json")
+    clean.add_argument("--output_file", default="db/questions/cot_questions_clean.json")
+    clean.set_defaults(func=cmd_clean)
+
+    evaluate = subparsers.add_parser("evaluate", help="Answer the questions with the GPT-2 pipeline")
+    evaluate.add_argument("--input_file", default="db/questions/cot_questions_clean.json")
+    evaluate.add_argument("--output_file", default="results/evaluated_results.jsonl",
+                          help="JSONL results file (re-running resumes where it stopped)")
+    evaluate.add_argument("--batched", action="store_true", help="Generate answers in batches")
+    evaluate.add_argument("--batch_size", type=int, default=None, help="Batch size (default: chosen from free memory)")
+    evaluate.add_argument("--no_cache", action="store_true", help="Bypass the generation cache")
+    evaluate.add_argument("--refresh_cache", action="store_true", help="Regenerate and overwrite cached outputs")
+    evaluate.add_argument("--prefix_cache", action="store_true", help="Reuse the KV cache of the prompt prefix")
+    add_stop_arguments(evaluate)
+    evaluate.add_argument("--self_consistency", type=int, default=0, metavar="N",
+                          help="Also answer with cot_sc: majority vote over up to N sampled CoT chains (0 = off)")
+    evaluate.set_defaults(func=cmd_evaluate)
+
+    analyze = subparsers.add_parser("analyze", help="Score evaluation results")
+    analyze.add_argument("--input_file", default="results/evaluated_results.jsonl")
+    analyze.add_argument("--output_file", default="results/analysis_results.csv")
+    analyze.add_argument("--scores_file", default="results/item_scores.parquet",
+                         help="Parquet file for per-answer scores (empty string to skip)")
+    analyze.set_defaults(func=cmd_analyze)
+
+    generate = subparsers.add_parser("generate", help="Generate text with LLaMA or Gemini")
+    generate.add_argument("prompt")
+    generate.add_argument("--model_type", choices=["llama", "gemini"], default="gemini")
+    generate.add_argument("--max_tokens", type=int, default=1024)
+    generate.add_argument("--temperature", type=float, default=0.7)
+    generate.add_argument("--seed", type=int, default=None)
+    generate.add_argument("--no_cache", action="store_true", help="Bypass the generation cache")
+    generate.add_argument("--stream", action="store_true", help="Print tokens as they arrive")
+    generate.add_argument("--server", default=None,
+                          help="Send LLaMA requests to a running inference_server.py (http://host:port or "
+                               "unix:///path; default: INFERENCE_SERVER_URL)")
+    add_stop_arguments(generate)
+    generate.set_defaults(func=cmd_generate)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.telemetry:
+        import telemetry
+        telemetry.enable()
+    profiler = StartupProfiler(enabled=args.profile_startup)
+    profiler.install()
+    try:
+        args.func(args, profiler)
+    finally:
+        profiler.uninstall()
+        profiler.report()
+
+if __name__ == "__main__":
+    main()
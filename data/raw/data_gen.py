@@ -1,46 +1,168 @@
-import pandas as pd
+import os
+import argparse
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import random
+import pandas as pd
 
 # Định nghĩa các tên vật liệu và cấu trúc tinh thể giả
 materials = ['CuO', 'Si', 'Ge', 'GaAs', 'CuMnSnO', 'ZnO']
 structures = ['Monoclinic', 'Cubic', 'Tetragonal', 'Hexagonal', 'Orthorhombic']
 
+# Phân phối mặc định, giống nhau cho mọi vật liệu:
+# điện trở suất trong khoảng 0.01 - 1.0, bandgap trong khoảng 1.0 - 3.5 eV
+DEFAULT_DISTRIBUTION = {
+    'resistivity': ('uniform', 0.01, 1.0),
+    'bandgap': ('uniform', 1.0, 3.5),
+}
+# Số chữ số thập phân khi làm tròn từng cột
+ROUNDING = {'resistivity': 4, 'bandgap': 2}
+
+# Sinh mẫu theo một đặc tả phân phối: ('uniform', low, high), ('normal', mean, std)
+# hoặc ('lognormal', mean, sigma); cũng có thể truyền hàm f(rng, n) -> mảng
+def sample(spec, rng, n):
+    """Sinh n giá trị theo đặc tả phân phối `spec`"""
+    if callable(spec):
+        return np.asarray(spec(rng, n), dtype=np.float64)
+    kind, a, b = spec
+    if kind == 'uniform':
+        return rng.uniform(a, b, n)
+    if kind == 'normal':
+        return rng.normal(a, b, n)
+    if kind == 'lognormal':
+        return rng.lognormal(a, b, n)
+    raise ValueError(f"Phân phối không hỗ trợ: {kind}")
+
+# Quy tắc gán nhãn mặc định:
+# nếu bandgap > 2.0 và resistivity < 0.5 thì target = 1, ngược lại target = 0
+def bandgap_resistivity_rule(columns, bandgap_min=2.0, resistivity_max=0.5):
+    """Gán nhãn cho cả khối dữ liệu cùng lúc; `columns` là dict tên cột -> mảng numpy"""
+    return ((columns['bandgap'] > bandgap_min) & (columns['resistivity'] < resistivity_max)).astype(np.int8)
+
+# Các quy tắc có thể chọn theo tên từ dòng lệnh; quy tắc tự viết là một hàm nhận dict cột
+# (định nghĩa ở cấp module để gửi được sang các process con)
+LABEL_RULES = {'bandgap_resistivity': bandgap_resistivity_rule}
+
+# Tạo một khối dữ liệu giả theo kiểu vector hóa, không lặp từng dòng
+def generate_chunk(num_samples, seed, distributions=None, label_rule=bandgap_resistivity_rule,
+                   material_weights=None):
+    """
+    Sinh `num_samples` dòng với bộ sinh số ngẫu nhiên khởi tạo từ `seed` (int hoặc np.random.SeedSequence).
+    :param distributions: dict vật liệu -> {cột: đặc tả phân phối}; vật liệu không có dùng DEFAULT_DISTRIBUTION.
+    :param label_rule: Hàm gán nhãn nhận dict cột, None = không tạo cột target.
+    :param material_weights: Xác suất chọn từng vật liệu (mặc định: đều nhau).
+    """
+    rng = np.random.default_rng(seed)
+    distributions = distributions or {}
+
+    # Chọn ngẫu nhiên vật liệu và cấu trúc (lưu dưới dạng mã số của categorical)
+    material_codes = rng.choice(len(materials), num_samples, p=material_weights).astype(np.int8)
+    structure_codes = rng.integers(0, len(structures), num_samples, dtype=np.int8)
+
+    # Tạo giá trị thuộc tính cho từng nhóm vật liệu theo phân phối riêng của nó
+    columns = {column: np.empty(num_samples) for column in DEFAULT_DISTRIBUTION}
+    for code, material in enumerate(materials):
+        mask = material_codes == code
+        count = int(mask.sum())
+        if not count:
+            continue
+        spec = {**DEFAULT_DISTRIBUTION, **distributions.get(material, {})}
+        for column in columns:
+            columns[column][mask] = sample(spec[column], rng, count)
+    for column, digits in ROUNDING.items():
+        np.round(columns[column], digits, out=columns[column])
+
+    df = pd.DataFrame({
+        'material_name': pd.Categorical.from_codes(material_codes, materials),
+        'resistivity': columns['resistivity'],
+        'bandgap': columns['bandgap'],
+        'structure': pd.Categorical.from_codes(structure_codes, structures),
+    })
+    if label_rule is not None:
+        df['target'] = label_rule(columns)
+    return df
+
 # Hàm tạo giá trị giả cho điện trở, bandgap và nhãn (target)
-def generate_fake_data_with_labels(num_samples):
-    data = []
-    
-    for _ in range(num_samples):
-        # Chọn ngẫu nhiên vật liệu và cấu trúc
-        material = random.choice(materials)
-        structure = random.choice(structures)
-        
-        # Tạo giá trị giả cho các thuộc tính vật liệu
-        resistivity = round(np.random.uniform(0.01, 1.0), 4)  # Giả sử giá trị điện trở suất trong khoảng từ 0.01 đến 1.0
-        bandgap = round(np.random.uniform(1.0, 3.5), 2)  # Bandgap giả trong khoảng 1.0 - 3.5 eV
-        
-        # Gán nhãn (target) dựa trên một quy tắc giả định
-        # Ví dụ: Nếu bandgap > 2.0 và resistivity < 0.5 thì target = 1, ngược lại target = 0
-        target = 1 if bandgap > 2.0 and resistivity < 0.5 else 0
-        
-        # Tạo một dòng dữ liệu
-        data.append({
-            'material_name': material,
-            'resistivity': resistivity,
-            'bandgap': bandgap,
-            'structure': structure,
-            'target': target
-        })
-    
-    return pd.DataFrame(data)
+def generate_fake_data_with_labels(num_samples, seed=None, **options):
+    """Sinh toàn bộ dữ liệu trong bộ nhớ (dùng cho bộ dữ liệu nhỏ); `options` như generate_chunk"""
+    return generate_chunk(num_samples, seed, **options)
 
 # Hàm lưu dữ liệu vào file CSV
 def save_data_to_csv(df, filename='fake_materials_data_with_labels.csv'):
     df.to_csv(filename, index=False)
     print(f"Data saved to {filename}")
 
-# Tạo bộ dữ liệu giả với 1000 mẫu và gán nhãn
-fake_data_with_labels = generate_fake_data_with_labels(1000)
+def _render_chunk(task):
+    """Sinh một khối trong process con; CSV được định dạng sẵn thành chuỗi để process chính chỉ việc ghi"""
+    num_samples, seed, fmt, options = task
+    df = generate_chunk(num_samples, seed, **options)
+    return df.to_csv(index=False, header=False) if fmt == 'csv' else df
+
+# Ghi bộ dữ liệu lớn theo từng khối: bộ nhớ chỉ phụ thuộc chunk_size, các khối được sinh song song
+def write_dataset(num_rows, output_file, chunk_size=1_000_000, workers=None, seed=0, **options):
+    """
+    Sinh `num_rows` dòng và ghi ra CSV hoặc Parquet (theo đuôi file) từng khối một.
+    Mỗi khối có seed riêng tách từ SeedSequence(seed) nên kết quả giống nhau với mọi số process.
+    :param workers: Số process (mặc định: số CPU; 1 = chạy tuần tự).
+    :param options: distributions / label_rule / material_weights như generate_chunk.
+    """
+    fmt = 'parquet' if output_file.endswith('.parquet') else 'csv'
+    sizes = [min(chunk_size, num_rows - start) for start in range(0, num_rows, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(size, chunk_seed, fmt, options) for size, chunk_seed in zip(sizes, seeds)]
+    workers = workers or os.cpu_count() or 1
+
+    directory = os.path.dirname(output_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    writer = None
+    with open(output_file, 'w', encoding='utf-8', newline='') if fmt == 'csv' else nullcontext() as f:
+        def write(chunk):
+            nonlocal writer
+            if fmt == 'csv':
+                f.write(chunk)
+                return
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(output_file, table.schema)
+            writer.write_table(table)
+
+        if fmt == 'csv':
+            header = ['material_name', 'resistivity', 'bandgap', 'structure']
+            if options.get('label_rule', bandgap_resistivity_rule) is not None:
+                header.append('target')
+            f.write(','.join(header) + '\n')
+        try:
+            if workers == 1:
+                for task in tasks:
+                    write(_render_chunk(task))
+            else:
+                # Giữ tối đa 2 khối mỗi process đang chờ ghi để bộ nhớ không tăng theo num_rows
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    pending = []
+                    for task in tasks:
+                        pending.append(executor.submit(_render_chunk, task))
+                        if len(pending) >= 2 * workers:
+                            write(pending.pop(0).result())
+                    for future in pending:
+                        write(future.result())
+        finally:
+            if writer is not None:
+                writer.close()
+    print(f"Data saved to {output_file} ({num_rows} rows)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sinh dữ liệu vật liệu giả có nhãn.")
+    parser.add_argument("--rows", type=int, default=1000, help="Số dòng cần sinh")
+    parser.add_argument("--output_file", default="fake_materials_data_with_labels.csv", help="File CSV hoặc .parquet")
+    parser.add_argument("--chunk_size", type=int, default=1_000_000, help="Số dòng mỗi khối")
+    parser.add_argument("--workers", type=int, default=None, help="Số process (mặc định: số CPU)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed để sinh lại đúng bộ dữ liệu")
+    parser.add_argument("--rule", default="bandgap_resistivity", choices=sorted(LABEL_RULES) + ["none"],
+                        help="Quy tắc gán nhãn (none = không tạo cột target)")
+    args = parser.parse_args()
 
-# Lưu bộ dữ liệu vào CSV
-save_data_to_csv(fake_data_with_labels)
+    label_rule = None if args.rule == "none" else LABEL_RULES[args.rule]
+    write_dataset(args.rows, args.output_file, args.chunk_size, args.workers, args.seed, label_rule=label_rule)
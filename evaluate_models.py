@@ -1,9 +1,22 @@
+import os
 import json
-from transformers import pipeline
+import argparse
 import time
+from generation_cache import cached_generate, get_cache, is_error_output, GENERATION_CACHE_ENABLED
+from results_io import ResultWriter, completed_keys, iter_jsonl
+from prompts import EVALUATION_PROMPTS, get_prompt, split_prompt
+from streaming import StopCriteria, condition_from_cli, hf_stream, make_condition
 
-# Tải mô hình GPT-2 hoặc GPT-Neo từ Hugging Face
-generator = pipeline("text-generation", model="gpt2", pad_token_id=50256)  # 50256 là EOS token ID cho GPT-2
+# Tải mô hình GPT-2 hoặc GPT-Neo từ Hugging Face khi cần dùng lần đầu (không tải lúc import)
+_generator = None
+
+def get_generator():
+    """Trả về pipeline sinh văn bản GPT-2, tạo khi dùng lần đầu"""
+    global _generator
+    if _generator is None:
+        from transformers import pipeline
+        _generator = pipeline("text-generation", model="gpt2", pad_token_id=50256)  # 50256 là EOS token ID cho GPT-2
+    return _generator
 
 # Đọc câu hỏi từ file JSON
 def load_questions(file_path):
@@ -11,57 +24,398 @@ def load_questions(file_path):
     with open(file_path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-# Trả lời câu hỏi bằng GPT-2 hoặc GPT-Neo
-def query_model(question, method="standard"):
-    """Gửi câu hỏi tới mô hình GPT-2 hoặc GPT-Neo với phương pháp mong muốn"""
-    if method == "standard":
-        prompt = f"Answer the following question concisely: {question}"
-    elif method == "cot":
-        prompt = f"Think step by step and then answer: {question}"
+# Đọc câu hỏi lần lượt: file JSONL được đọc từng dòng, file JSON được đọc một lần
+def iter_questions(file_path):
+    """Trả về lần lượt từng câu hỏi trong file JSON hoặc JSONL"""
+    if file_path.endswith(".jsonl"):
+        yield from iter_jsonl(file_path)
     else:
-        prompt = f"{question}"  # Dự phòng cho các phương pháp khác
+        yield from load_questions(file_path)
 
-    try:
-        # Sử dụng mô hình GPT-2 hoặc GPT-Neo để trả lời câu hỏi
-        response = generator(prompt, max_length=200, num_return_sequences=1)
-        return response[0]["generated_text"].strip()
-    except Exception as e:
-        print(f"⚠️ Lỗi khi gọi mô hình: {e}")
-        return "[ERROR]"
+# Một dòng kết quả cho mỗi cặp (câu hỏi, phương pháp)
+def make_record(index, item, method, answer):
+    """Tạo bản ghi kết quả để ghi ra file JSONL"""
+    return {
+        "index": index,
+        "question": item["question"],
+        "ground_truth": item["answer"],
+        "method": method,
+        "answer": answer,
+    }
+
+# Self-consistency: dùng prompt CoT, lấy mẫu nhiều chuỗi suy luận và bỏ phiếu đáp án cuối
+SELF_CONSISTENCY_METHOD = "cot_sc"
+SELF_CONSISTENCY_SAMPLES = 8  # Số chuỗi tối đa cho mỗi câu hỏi
+
+# Tạo prompt theo phương pháp mong muốn
+def build_prompt(question, method="standard"):
+    """Tạo prompt cho câu hỏi theo phương pháp standard, CoT hoặc self-consistency (cùng prompt CoT)"""
+    if method == SELF_CONSISTENCY_METHOD:
+        method = "cot"
+    if method in EVALUATION_PROMPTS:
+        return get_prompt("evaluation", method, question=question)
+    return f"{question}"  # Dự phòng cho các phương pháp khác
+
+# Token của prompt, ghép từ các đoạn template đã tokenize sẵn (không tokenize lại cả chuỗi)
+def build_prompt_ids(question, method="standard", max_new_tokens=1):
+    """
+    Trả về token ID của build_prompt(question, method) với tokenizer của pipeline.
+    :param max_new_tokens: Số token cần chừa lại trong cửa sổ ngữ cảnh; câu hỏi quá dài bị cắt phần giữa
+                           (không cắt phần template), xem prompt_compiler.prompt_budget.
+    """
+    from prompt_compiler import context_window, get_compiler, prompt_budget
+    generator = get_generator()
+    compiler = get_compiler(generator.tokenizer)
+    budget = prompt_budget(context_window(generator.model, generator.tokenizer), max_new_tokens)
+    if method == SELF_CONSISTENCY_METHOD:
+        method = "cot"
+    if method in EVALUATION_PROMPTS:
+        return compiler.render("evaluation", method, budget, question=question)
+    return compiler.render_text(build_prompt(question, method), budget)
+
+# Cache past_key_values của phần mở đầu cố định trong prompt, dùng chung cho mọi câu hỏi
+_prefix_cache = None
+
+def get_prefix_cache():
+    """Trả về PrefixCache của mô hình GPT-2, tạo khi dùng lần đầu"""
+    global _prefix_cache
+    if _prefix_cache is None:
+        from prefix_cache import PrefixCache
+        generator = get_generator()
+        _prefix_cache = PrefixCache(generator.model, generator.tokenizer)
+    return _prefix_cache
+
+# Định danh mô hình (kèm revision nếu có) dùng làm khóa cache
+def model_id():
+    """Tên mô hình kèm revision trên Hugging Face Hub, dùng cho cache sinh văn bản"""
+    config = get_generator().model.config
+    revision = getattr(config, "_commit_hash", None)
+    return f"{config._name_or_path}@{revision}" if revision else config._name_or_path
+
+# Trả lời bằng self-consistency: một lần prefill, nhiều chuỗi CoT lấy mẫu theo batch, bỏ phiếu đa số
+def answer_self_consistency(question, samples=SELF_CONSISTENCY_SAMPLES, stop=None, stats=None, max_length=200):
+    """
+    Trả về prompt + chuỗi suy luận có đáp án thắng phiếu (cùng dạng với câu trả lời CoT).
+    :param stop: StopCondition kết thúc từng chuỗi (mặc định: sau dòng "Final answer: ...").
+    :param stats: Dict cộng dồn số mẫu đã lấy ("sc_samples") và tối đa ("sc_max").
+    """
+    from self_consistency import self_consistency
+    generator = get_generator()
+    ids = build_prompt_ids(question, SELF_CONSISTENCY_METHOD)
+    result = self_consistency(generator.model, generator.tokenizer, ids, max_samples=samples,
+                              max_new_tokens=max(1, max_length - len(ids)), condition=make_condition(stop) or None)
+    if stats is not None:
+        stats["sc_samples"] = stats.get("sc_samples", 0) + result["samples"]
+        stats["sc_max"] = stats.get("sc_max", 0) + samples
+    return (build_prompt(question, SELF_CONSISTENCY_METHOD) + result["chain"]).strip()
+
+# In số mẫu self-consistency đã tiết kiệm nhờ dừng thích ứng
+def report_self_consistency(stats):
+    """In số chuỗi đã lấy so với số chuỗi cố định N"""
+    drawn, maximum = stats.get("sc_samples", 0), stats.get("sc_max", 0)
+    if maximum:
+        print(f"🗳️ Self-consistency: lấy {drawn}/{maximum} chuỗi, tiết kiệm {maximum - drawn} "
+              f"({(maximum - drawn) / maximum:.0%}) nhờ dừng khi kết quả bỏ phiếu đã chắc chắn")
+
+# Trả lời câu hỏi bằng GPT-2 hoặc GPT-Neo
+def query_model(question, method="standard", use_cache=True, refresh_cache=False, use_prefix_cache=False,
+                stop=None, stats=None, samples=SELF_CONSISTENCY_SAMPLES):
+    """
+    Gửi câu hỏi tới mô hình GPT-2 hoặc GPT-Neo với phương pháp mong muốn.
+    :param stop: StopCondition (hoặc chuỗi dừng); câu trả lời được stream và dừng sinh ngay khi gặp điều kiện.
+    :param stats: Dict cộng dồn "tokens_saved" và danh sách "ttft" khi dùng `stop`, và "generated"
+                  (số câu trả lời thực sự được sinh, không lấy từ cache).
+    :param samples: Số chuỗi tối đa cho phương pháp self-consistency ("cot_sc").
+    """
+    prompt = build_prompt(question, method)
+    condition = make_condition(stop)
+    params = condition.cache_params()
+    if method == SELF_CONSISTENCY_METHOD:
+        params["samples"] = samples
+
+    def generate():
+        if stats is not None:
+            stats["generated"] = stats.get("generated", 0) + 1  # Chỉ chạy khi cache không có câu trả lời
+        try:
+            if method == SELF_CONSISTENCY_METHOD:
+                return answer_self_consistency(question, samples, condition, stats)
+            if use_prefix_cache and method in EVALUATION_PROMPTS:
+                # Chỉ prefill phần câu hỏi, phần mở đầu lấy từ cache (điều kiện dừng chỉ cắt kết quả)
+                prefix, suffix = split_prompt("evaluation", method, question=question)
+                text, _, _ = get_prefix_cache().generate(prefix, suffix, max_length=200, do_sample=True)
+                return (prompt + condition.apply(text)).strip()
+            if condition:
+                # Stream từng token và dừng sinh ngay khi gặp chuỗi dừng / điều kiện dừng
+                generator = get_generator()
+                ids = build_prompt_ids(question, method)
+                stream = hf_stream(generator.model, generator.tokenizer, ids, max(1, 200 - len(ids)), condition,
+                                   do_sample=True, pad_token_id=generator.tokenizer.eos_token_id)
+                text = stream.read()
+                if stats is not None:
+                    stats["tokens_saved"] = stats.get("tokens_saved", 0) + stream.stats.tokens_saved
+                    stats.setdefault("ttft", []).append(stream.stats.ttft)
+                return (prompt + text).strip()
+            # Sử dụng mô hình GPT-2 hoặc GPT-Neo để trả lời câu hỏi
+            response = get_generator()(prompt, max_length=200, num_return_sequences=1)
+            return response[0]["generated_text"].strip()
+        except Exception as e:
+            print(f"⚠️ Lỗi khi gọi mô hình: {e}")
+            return "[ERROR]"
+
+    # Câu trả lời đã sinh trước đó (cùng mô hình, prompt, tham số) được lấy lại từ cache
+    return cached_generate(generate, "hf-pipeline", model_id(), prompt, 200, None,
+                           use_cache=use_cache, refresh=refresh_cache, **params)
+
+# In số token tiết kiệm được nhờ dừng sớm
+def report_early_stop(stats):
+    """In tổng số token không phải sinh nhờ điều kiện dừng và TTFT trung bình (nếu có)"""
+    ttft = [value for value in stats.get("ttft", []) if value is not None]
+    line = f"✂️ Dừng sớm: tiết kiệm {stats.get('tokens_saved', 0)} token"
+    if ttft:
+        line += f", TTFT trung bình {sum(ttft) / len(ttft) * 1000:.1f} ms"
+    print(line)
 
 # Đánh giá mô hình GPT-2 hoặc GPT-Neo trên bộ dữ liệu câu hỏi
-def evaluate_questions(input_file, output_file):
-    """Chạy đánh giá mô hình GPT-2 hoặc GPT-Neo trên bộ dữ liệu câu hỏi"""
-    data = load_questions(input_file)
-    results = []
-
-    for item in data:
-        question = item["question"]
-        gt_answer = item["answer"]
-
-        print(f"🧠 Đang xử lý: {question}")
-        standard_answer = query_model(question, method="standard")
-        cot_answer = query_model(question, method="cot")
-
-        results.append({
-            "question": question,
-            "ground_truth": gt_answer,
-            "standard_answer": standard_answer,
-            "cot_answer": cot_answer
-        })
-        time.sleep(1)  # Tránh gửi quá nhiều request cùng lúc
-
-    # Lưu kết quả vào file JSON
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+def evaluate_questions(input_file, output_file, use_cache=True, refresh_cache=False,
+                       methods=("standard", "cot"), use_prefix_cache=False, stop=None,
+                       samples=SELF_CONSISTENCY_SAMPLES):
+    """
+    Chạy đánh giá tuần tự, ghi từng kết quả ra file JSONL và bỏ qua các mục đã hoàn thành.
+    :param stop: StopCondition dừng sinh câu trả lời sớm (xem streaming.py).
+    :param samples: Số chuỗi tối đa khi `methods` có "cot_sc" (self-consistency).
+    """
+    condition = make_condition(stop)
+    stats = {"tokens_saved": 0, "ttft": [], "generated": 0}
+    done = completed_keys(output_file)
+    if done:
+        print(f"⏩ Bỏ qua {len(done)} kết quả đã có trong {output_file}")
+
+    with ResultWriter(output_file) as writer:
+        for i, item in enumerate(iter_questions(input_file)):
+            pending = [method for method in methods if (i, method) not in done]
+            if not pending:
+                continue
+            question = item["question"]
 
+            print(f"🧠 Đang xử lý: {question}")
+            generated = stats["generated"]
+            for method in pending:
+                answer = query_model(question, method=method, use_cache=use_cache, refresh_cache=refresh_cache,
+                                     use_prefix_cache=use_prefix_cache, stop=condition, stats=stats,
+                                     samples=samples)
+                writer.write(make_record(i, item, method, answer))
+            if stats["generated"] > generated:
+                time.sleep(1)  # Tránh gửi quá nhiều request cùng lúc (không cần khi mọi câu trả lời lấy từ cache)
+
+    if condition:
+        report_early_stop(stats)
+    report_self_consistency(stats)
     print(f"✅ Đã lưu kết quả vào {output_file}")
 
+# Ước lượng bộ nhớ còn trống (GPU nếu có, ngược lại RAM)
+def available_memory_bytes(device):
+    """Trả về số byte bộ nhớ còn trống trên thiết bị chạy mô hình"""
+    if device.type == "cuda":
+        import torch
+        free, _ = torch.cuda.mem_get_info(device)
+        return free
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 4 * 1024 ** 3  # Không đọc được thì giả sử còn 4 GB
+
+# Chọn batch size dựa trên bộ nhớ còn trống và kích thước KV cache
+def pick_batch_size(model, max_length, memory_fraction=0.5, max_batch_size=64):
+    """Chọn batch size sao cho KV cache và activations vừa với bộ nhớ còn trống"""
+    config = model.config
+    n_layer = getattr(config, "n_layer", None) or getattr(config, "num_hidden_layers", 12)
+    hidden = getattr(config, "n_embd", None) or getattr(config, "hidden_size", 768)
+    bytes_per_value = next(model.parameters()).element_size()
+    # K và V cho mỗi layer, cộng thêm ~4x hidden cho activations và logits tạm
+    per_token = (2 * n_layer + 4) * hidden * bytes_per_value
+    per_sequence = per_token * max_length + config.vocab_size * 4
+    budget = available_memory_bytes(model.device) * memory_fraction
+    return int(max(1, min(max_batch_size, budget // per_sequence)))
+
+# Sinh câu trả lời cho một batch prompt đã được gom theo độ dài
+def generate_batch(prompts, max_length=200, prompt_ids=None, stop=None, stats=None):
+    """
+    Sinh câu trả lời cho nhiều prompt cùng lúc, trả về (câu trả lời, số token sinh ra).
+    :param prompt_ids: Token ID đã có sẵn của từng prompt (ví dụ từ build_prompt_ids), bỏ qua bước tokenize.
+    :param stop: StopCondition; batch dừng sinh khi mọi prompt đã gặp điều kiện dừng (hoặc EOS).
+    :param stats: Dict cộng dồn "tokens_saved" khi dùng `stop`.
+    """
+    import torch
+    from transformers import StoppingCriteriaList
+    generator = get_generator()
+    tokenizer = generator.tokenizer
+    model = generator.model
+    if prompt_ids is not None:
+        from prompt_compiler import get_compiler
+        encoded = get_compiler(tokenizer).pad(prompt_ids, tokenizer.padding_side, model.device)
+    else:
+        encoded = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+    lengths = encoded["attention_mask"].sum(dim=1).tolist()
+    max_new_tokens = max(1, max_length - min(lengths))
+    prompt_width = encoded["input_ids"].shape[1]
+    condition = make_condition(stop)
+    criteria = StopCriteria(tokenizer, prompt_width, condition) if condition else None
+
+    with torch.no_grad():
+        outputs = model.generate(
+            **encoded,
+            max_new_tokens=max_new_tokens,
+            do_sample=True,
+            pad_token_id=tokenizer.pad_token_id,
+            **({"stopping_criteria": StoppingCriteriaList([criteria])} if criteria else {}),
+        )
+    if criteria is not None and criteria.triggered and stats is not None:
+        # Số bước không phải sinh, tính theo giới hạn max_length của từng prompt
+        stats["tokens_saved"] = stats.get("tokens_saved", 0) + sum(
+            max(0, max_length - length - criteria.steps) for length in lengths)
+
+    answers, new_tokens = [], 0
+    for prompt, length, output in zip(prompts, lengths, outputs):
+        # Giữ đúng giới hạn max_length của từng prompt như khi chạy tuần tự
+        generated = output[prompt_width:prompt_width + max(0, max_length - length)]
+        if tokenizer.eos_token_id is not None:
+            eos = (generated == tokenizer.eos_token_id).nonzero()
+            if len(eos):
+                generated = generated[:eos[0].item()]
+        new_tokens += len(generated)
+        text = condition.apply(tokenizer.decode(generated, skip_special_tokens=True))
+        answers.append((prompt + text).strip())
+    return answers, new_tokens
+
+# Đánh giá theo batch: gom các (câu hỏi, phương pháp), nhóm theo độ dài token
+def evaluate_questions_batched(input_file, output_file, batch_size=None, max_length=200,
+                               methods=("standard", "cot"), use_cache=True, refresh_cache=False,
+                               window=1024, stop=None, samples=SELF_CONSISTENCY_SAMPLES):
+    """
+    Chạy đánh giá theo batch có padding, nhóm prompt theo độ dài để giảm padding thừa.
+    Câu hỏi được xử lý theo từng cửa sổ `window` câu nên bộ nhớ không tăng theo kích thước bộ dữ liệu.
+    :param stop: StopCondition dừng sinh sớm (xem streaming.py).
+    :param samples: Số chuỗi tối đa khi `methods` có "cot_sc"; các chuỗi của một câu hỏi đã là một batch.
+    """
+    condition = make_condition(stop)
+    generator = get_generator()
+    tokenizer = generator.tokenizer
+    tokenizer.padding_side = "left"  # Mô hình decoder-only cần pad bên trái khi sinh theo batch
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    if batch_size is None:
+        batch_size = pick_batch_size(generator.model, max_length)
+    print(f"📦 Batch size {batch_size}")
+
+    use_cache = use_cache and GENERATION_CACHE_ENABLED
+    cache = get_cache() if use_cache else None
+    done = completed_keys(output_file)
+    if done:
+        print(f"⏩ Bỏ qua {len(done)} kết quả đã có trong {output_file}")
+
+    stats = {"questions": 0, "tokens": 0, "cached": 0, "tokens_saved": 0}
+    start = time.perf_counter()
+    with ResultWriter(output_file) as writer:
+        items = []
+        for i, item in enumerate(iter_questions(input_file)):
+            items.append((i, item))
+            if len(items) == window:
+                _evaluate_window(items, methods, done, cache, refresh_cache, batch_size, max_length, writer,
+                                 stats, condition, samples)
+                items = []
+        if items:
+            _evaluate_window(items, methods, done, cache, refresh_cache, batch_size, max_length, writer,
+                             stats, condition, samples)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    if cache:
+        print(f"💾 {stats['cached']} câu trả lời lấy từ cache")
+    print(f"⏱️ {stats['questions'] / elapsed:.2f} câu hỏi/giây, {stats['tokens'] / elapsed:.1f} token/giây")
+    if condition:
+        report_early_stop(stats)
+    report_self_consistency(stats)
+    print(f"✅ Đã lưu kết quả vào {output_file}")
+    return {"questions_per_sec": stats["questions"] / elapsed, "tokens_per_sec": stats["tokens"] / elapsed,
+            "batch_size": batch_size, "elapsed": elapsed, "tokens_saved": stats["tokens_saved"]}
+
+def _evaluate_window(items, methods, done, cache, refresh_cache, batch_size, max_length, writer, stats,
+                     condition=None, samples=SELF_CONSISTENCY_SAMPLES):
+    """Sinh câu trả lời cho một cửa sổ câu hỏi và ghi kết quả ngay khi từng batch xong"""
+    jobs = []
+    for i, item in items:
+        pending = [method for method in methods if (i, method) not in done]
+        if pending:
+            stats["questions"] += 1
+        for method in pending:
+            prompt = build_prompt(item["question"], method)
+            params = condition.cache_params()
+            if method == SELF_CONSISTENCY_METHOD:
+                params["samples"] = samples
+            key = cache.make_key("hf-pipeline", model_id(), prompt, max_length, None, **params) if cache else None
+            cached = cache.get(key) if cache and not refresh_cache else None
+            if cached is not None:
+                stats["cached"] += 1
+                writer.write(make_record(i, item, method, cached))
+            elif method == SELF_CONSISTENCY_METHOD:
+                # Các chuỗi của một câu hỏi được lấy mẫu thành một batch riêng từ cùng một lần prefill
+                try:
+                    answer = answer_self_consistency(item["question"], samples, condition, stats, max_length)
+                except Exception as e:
+                    print(f"⚠️ Lỗi khi gọi mô hình: {e}")
+                    answer = "[ERROR]"
+                writer.write(make_record(i, item, method, answer))
+                if cache and not is_error_output(answer):
+                    cache.put(key, answer)
+            else:
+                jobs.append((i, item, method, prompt, key, build_prompt_ids(item["question"], method)))
+    if not jobs:
+        return
+
+    # Sắp xếp theo độ dài để các prompt trong cùng batch có độ dài gần nhau
+    order = sorted(range(len(jobs)), key=lambda j: len(jobs[j][5]))
+
+    for b in range(0, len(order), batch_size):
+        batch = [jobs[j] for j in order[b:b + batch_size]]
+        try:
+            outputs, new_tokens = generate_batch([job[3] for job in batch], max_length, [job[5] for job in batch],
+                                                 condition, stats)
+        except Exception as e:
+            print(f"⚠️ Lỗi khi gọi mô hình: {e}")
+            outputs, new_tokens = ["[ERROR]"] * len(batch), 0
+        stats["tokens"] += new_tokens
+        for (i, item, method, _, key, _), answer in zip(batch, outputs):
+            writer.write(make_record(i, item, method, answer))
+            if cache and not is_error_output(answer):
+                cache.put(key, answer)
+
 # Chạy đánh giá mô hình
 if __name__ == "__main__":
-    input_file = "db/questions/cot_questions_clean.json"
-    output_file = "results/evaluated_results.json"
+    parser = argparse.ArgumentParser(description="Đánh giá mô hình GPT-2 hoặc GPT-Neo trên bộ câu hỏi.")
+    parser.add_argument("--input_file", default="db/questions/cot_questions_clean.json", help="File JSON chứa câu hỏi")
+    parser.add_argument("--output_file", default="results/evaluated_results.jsonl", help="File JSONL để lưu kết quả (chạy lại sẽ tiếp tục từ chỗ dừng)")
+    parser.add_argument("--batched", action="store_true", help="Sinh câu trả lời theo batch")
+    parser.add_argument("--batch_size", type=int, default=None, help="Batch size (mặc định: tự chọn theo bộ nhớ)")
+    parser.add_argument("--no_cache", action="store_true", help="Bỏ qua cache sinh văn bản")
+    parser.add_argument("--refresh_cache", action="store_true", help="Sinh lại và ghi đè cache")
+    parser.add_argument("--prefix_cache", action="store_true", help="Dùng lại KV cache của phần mở đầu prompt")
+    parser.add_argument("--stop", action="append", default=None, help="Chuỗi dừng, có thể lặp lại (ví dụ --stop '\\n\\n')")
+    parser.add_argument("--final_answer", action="store_true", help="Dừng sau dòng \"Final answer: ...\" đầu tiên")
+    parser.add_argument("--self_consistency", type=int, default=0, metavar="N",
+                        help="Thêm phương pháp cot_sc: bỏ phiếu trên tối đa N chuỗi CoT (0 = tắt)")
+    args = parser.parse_args()
+    stop = condition_from_cli(args.stop, args.final_answer)
+    methods = ("standard", "cot") + ((SELF_CONSISTENCY_METHOD,) if args.self_consistency else ())
+    samples = args.self_consistency or SELF_CONSISTENCY_SAMPLES
 
     print("🚀 Bắt đầu đánh giá mô hình GPT-2 hoặc GPT-Neo...")
-    evaluate_questions(input_file, output_file)
+    if args.batched:
+        evaluate_questions_batched(args.input_file, args.output_file, batch_size=args.batch_size, methods=methods,
+                                   use_cache=not args.no_cache, refresh_cache=args.refresh_cache, stop=stop,
+                                   samples=samples)
+    else:
+        evaluate_questions(args.input_file, args.output_file, use_cache=not args.no_cache, methods=methods,
+                           refresh_cache=args.refresh_cache, use_prefix_cache=args.prefix_cache, stop=stop,
+                           samples=samples)
+    if not args.no_cache and GENERATION_CACHE_ENABLED:
+        print(f"💾 Cache: {get_cache().stats()}")
     print("✅ Hoàn thành đánh giá!")
@@ -1,50 +1,244 @@
 import os
 import argparse
+import re
 import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PyPDF2 import PdfReader
 from tqdm import tqdm
 
-def extract_qa_from_text(text):
+# Thư mục cache kết quả trích xuất cho từng PDF (theo hash nội dung file)
+CACHE_DIR = "db/cache/pdf"
+
+# Luật trích xuất mặc định, theo thứ tự ưu tiên: luật đứng trước thắng khi nhiều luật cùng khớp
+DEFAULT_RULES = [
+    {
+        "name": "objective",
+        "phrases": ["objective", "aim", "goal", "purpose"],
+        "question": "What is the main objective of the study in: {line}",
+    },
+    {
+        "name": "findings",
+        "phrases": ["the results show", "we found that", "this indicates"],
+        "question": "What are the main findings in: {line}",
+    },
+]
+
+class RuleMatcher:
+    """Gộp cụm từ kích hoạt của mọi luật thành một regex, mỗi dòng chỉ quét một lần"""
+
+    def __init__(self, rules=None):
+        self.rules = rules or DEFAULT_RULES
+        # Cụm từ -> luật có ưu tiên cao nhất chứa cụm từ đó
+        self.phrase_rule = {}
+        for i, rule in enumerate(self.rules):
+            for phrase in rule["phrases"]:
+                self.phrase_rule.setdefault(phrase.lower(), i)
+        self.pattern = self._compile(self.phrase_rule)
+        # Regex riêng của từng luật, chỉ dùng khi luật ưu tiên thấp khớp trước
+        self.rule_patterns = [self._compile(p.lower() for p in rule["phrases"]) for rule in self.rules]
+
+    @staticmethod
+    def _compile(phrases):
+        phrases = sorted(set(phrases), key=len, reverse=True)
+        return re.compile("|".join(re.escape(p) for p in phrases))
+
+    def match(self, line):
+        """Trả về luật có ưu tiên cao nhất khớp với dòng, hoặc None"""
+        lowered = line.lower()
+        m = self.pattern.search(lowered)
+        if m is None:
+            return None
+        index = self.phrase_rule[m.group()]
+        for higher in range(index):
+            if self.rule_patterns[higher].search(lowered):
+                return self.rules[higher]
+        return self.rules[index]
+
+    def fingerprint(self):
+        """Hash của bộ luật, dùng để biết cache Q&A có còn hợp lệ không"""
+        return hashlib.sha256(json.dumps(self.rules, sort_keys=True).encode("utf-8")).hexdigest()
+
+def load_rules(rules_file):
+    """Đọc bộ luật từ file JSON (danh sách {name, phrases, question})"""
+    with open(rules_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def extract_qa_from_lines(lines, matcher=None):
+    """Trích xuất các cặp câu hỏi và trả lời từ một luồng dòng văn bản (không cần giữ cả tài liệu)."""
+    matcher = matcher or RuleMatcher()
+    previous = None
+    for line in lines:
+        if previous is not None:
+            qa = _qa_for_line(previous, line, matcher)
+            if qa:
+                yield qa
+        previous = line
+    if previous is not None:
+        qa = _qa_for_line(previous, None, matcher)
+        if qa:
+            yield qa
+
+def _qa_for_line(line, next_line, matcher):
+    line = line.strip()
+    rule = matcher.match(line)
+    if rule is None:
+        return None
+    answer = next_line.strip() if next_line is not None else "Not found"
+    return {"question": rule["question"].format(line=line), "answer": answer}
+
+def extract_qa_from_text(text, matcher=None):
     """Trích xuất các cặp câu hỏi và trả lời từ nội dung bài báo."""
-    qas = []
-    lines = text.split("\n")
-    for i, line in enumerate(lines):
-        line = line.strip()
-        if any(keyword in line.lower() for keyword in ["objective", "aim", "goal", "purpose"]):
-            question = f"What is the main objective of the study in: {line}"
-            answer = lines[i + 1].strip() if i + 1 < len(lines) else "Not found"
-            qas.append({"question": question, "answer": answer})
-        elif any(phrase in line.lower() for phrase in ["the results show", "we found that", "this indicates"]):
-            question = f"What are the main findings in: {line}"
-            answer = lines[i + 1].strip() if i + 1 < len(lines) else "Not found"
-            qas.append({"question": question, "answer": answer})
-    return qas
-
-def extract_from_pdf(pdf_path):
-    """Đọc nội dung PDF và trích xuất câu hỏi"""
+    return list(extract_qa_from_lines(text.split("\n"), matcher))
+
+def iter_page_lines(pages):
+    """Trả về lần lượt từng dòng của một luồng văn bản trang"""
+    for page in pages:
+        yield from page.split("\n")
+
+def iter_pdf_pages(pdf_path):
+    """Đọc lần lượt văn bản từng trang PDF"""
+    reader = PdfReader(pdf_path)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+def extract_from_pdf(pdf_path, matcher=None):
+    """Đọc nội dung PDF theo từng trang và trích xuất câu hỏi"""
+    return list(extract_qa_from_lines(iter_page_lines(iter_pdf_pages(pdf_path)), matcher))
+
+def extract_pages(pdf_path, start, end):
+    """Đọc văn bản của các trang [start, end) trong một file PDF"""
     reader = PdfReader(pdf_path)
-    text = "\n".join([page.extract_text() or "" for page in reader.pages])
-    return extract_qa_from_text(text)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+def file_sha256(path):
+    """Tính SHA-256 của nội dung file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_cache_index(cache_dir):
+    """Đọc chỉ mục đường dẫn -> (mtime, size, sha256) của cache PDF"""
+    index_file = os.path.join(cache_dir, "index.json")
+    if not os.path.exists(index_file):
+        return {}
+    with open(index_file, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-def main(input_dir, output_file):
+def save_cache_index(cache_dir, index):
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2, ensure_ascii=False)
+
+def pdf_digest(path, index):
+    """Lấy hash nội dung của PDF; chỉ đọc lại file khi mtime hoặc kích thước thay đổi"""
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    entry = index.get(key)
+    if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+        return entry["sha256"]
+    digest = file_sha256(path)
+    index[key] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": digest}
+    return digest
+
+def load_cached(cache_dir, digest):
+    """Đọc văn bản và cặp Q&A đã trích xuất trước đó của một PDF, nếu có"""
+    cache_file = os.path.join(cache_dir, f"{digest}.json")
+    if not os.path.exists(cache_file):
+        return None
+    with open(cache_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_cached(cache_dir, digest, pages, qa_pairs, rules_fingerprint):
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, f"{digest}.json"), "w", encoding="utf-8") as f:
+        json.dump({"pages": pages, "qa_pairs": qa_pairs, "rules": rules_fingerprint}, f, ensure_ascii=False)
+
+def read_pdfs(pdf_paths, workers=1, pages_per_task=8):
+    """
+    Đọc văn bản của nhiều PDF, chia việc theo file và theo từng khoảng trang.
+    :return: dict đường dẫn -> danh sách văn bản các trang (theo đúng thứ tự trang).
+    """
+    tasks = []
+    for path in pdf_paths:
+        try:
+            num_pages = len(PdfReader(path).pages)
+        except Exception as e:
+            print(f"⚠️ Lỗi khi xử lý {os.path.basename(path)}: {e}")
+            continue
+        for start in range(0, num_pages, pages_per_task):
+            tasks.append((path, start, min(start + pages_per_task, num_pages)))
+
+    chunks = {}
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(extract_pages, *task): task for task in tasks}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Processing PDF pages"):
+                task = futures[future]
+                try:
+                    chunks[task] = future.result()
+                except Exception as e:
+                    print(f"⚠️ Lỗi khi xử lý {os.path.basename(task[0])}: {e}")
+    else:
+        for task in tqdm(tasks, desc="Processing PDF pages"):
+            try:
+                chunks[task] = extract_pages(*task)
+            except Exception as e:
+                print(f"⚠️ Lỗi khi xử lý {os.path.basename(task[0])}: {e}")
+
+    # Ghép các khoảng trang theo thứ tự, bỏ qua file có trang bị lỗi
+    pages = {}
+    failed = {task[0] for task in tasks if task not in chunks}
+    for task in tasks:
+        if task[0] not in failed:
+            pages.setdefault(task[0], []).extend(chunks[task])
+    return pages
+
+def main(input_dir, output_file, workers=1, pages_per_task=8, cache_dir=CACHE_DIR, rules=None):
     """Duyệt qua thư mục chứa PDF và trích xuất câu hỏi"""
     if not os.path.exists(input_dir):
         print(f"⚠️ Lỗi: Thư mục {input_dir} không tồn tại!")
         return
 
-    qa_pairs = []
-    pdf_files = [f for f in os.listdir(input_dir) if f.endswith(".pdf")]
+    pdf_files = sorted(f for f in os.listdir(input_dir) if f.endswith(".pdf"))
     if not pdf_files:
         print("⚠️ Không có file PDF nào trong thư mục.")
         return
 
-    for filename in tqdm(pdf_files, desc="Processing PDFs"):
+    matcher = RuleMatcher(rules)
+    fingerprint = matcher.fingerprint()
+
+    # PDF không thay đổi (cùng hash nội dung) dùng lại kết quả đã lưu trong cache
+    index = load_cache_index(cache_dir)
+    results = {}
+    digests = {}
+    for filename in pdf_files:
         filepath = os.path.join(input_dir, filename)
-        try:
-            print(f"📖 Đang xử lý: {filename}")
-            qa_pairs.extend(extract_from_pdf(filepath))
-        except Exception as e:
-            print(f"⚠️ Lỗi khi xử lý {filename}: {e}")
+        digests[filepath] = pdf_digest(filepath, index)
+        cached = load_cached(cache_dir, digests[filepath])
+        if cached is None:
+            continue
+        if cached.get("rules") != fingerprint:
+            # Bộ luật đã đổi: chỉ cần chạy lại luật trên văn bản đã lưu
+            cached["qa_pairs"] = list(extract_qa_from_lines(iter_page_lines(cached["pages"]), matcher))
+            save_cached(cache_dir, digests[filepath], cached["pages"], cached["qa_pairs"], fingerprint)
+        results[filepath] = cached["qa_pairs"]
+    save_cache_index(cache_dir, index)
+
+    pending = [os.path.join(input_dir, f) for f in pdf_files if os.path.join(input_dir, f) not in results]
+    print(f"📖 {len(pdf_files) - len(pending)} PDF lấy từ cache, {len(pending)} PDF cần xử lý")
+    for filepath, pages in read_pdfs(pending, workers, pages_per_task).items():
+        qa = list(extract_qa_from_lines(iter_page_lines(pages), matcher))
+        save_cached(cache_dir, digests[filepath], pages, qa, fingerprint)
+        results[filepath] = qa
+
+    # Giữ thứ tự theo tên file, không phụ thuộc số worker
+    qa_pairs = []
+    for filename in pdf_files:
+        for qa in results.get(os.path.join(input_dir, filename), []):
+            qa_pairs.append({**qa, "source": filename})
 
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     with open(output_file, "w", encoding="utf-8") as f:
@@ -55,6 +249,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Trích xuất câu hỏi từ PDF về vật liệu bán dẫn.")
     parser.add_argument("--input_dir", required=True, help="Thư mục chứa các file PDF")
     parser.add_argument("--output_file", required=True, help="File JSON để lưu kết quả")
+    parser.add_argument("--workers", type=int, default=1, help="Số process dùng để đọc PDF song song")
+    parser.add_argument("--pages_per_task", type=int, default=8, help="Số trang mỗi tác vụ khi chia nhỏ PDF")
+    parser.add_argument("--cache_dir", default=CACHE_DIR, help="Thư mục cache kết quả theo từng PDF")
+    parser.add_argument("--rules", default=None, help="File JSON chứa bộ luật trích xuất (mặc định: DEFAULT_RULES)")
     args = parser.parse_args()
 
-    main(args.input_dir, args.output_file)
\ No newline at end of file
+    rules = load_rules(args.rules) if args.rules else None
+    main(args.input_dir, args.output_file, args.workers, args.pages_per_task, args.cache_dir, rules)
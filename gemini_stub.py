@@ -0,0 +1,133 @@
+"""
+Local stand-in for the Gemini REST API, for testing the async client offline.
+
+    python gemini_stub.py --port 8700 --latency 0.2 --max_rpm 30
+    GEMINI_API_BASE=http://127.0.0.1:8700 python evaluate_models.py ...
+
+It serves `:generateContent` and `:streamGenerateContent` (server-sent
+events with `alt=sse`) for any model name, and answers "echo: <prompt>"
+after a configurable latency. It can mimic rate limiting: the first
+`rate_limit_first` requests, and every request over `max_rpm` in the last
+minute, get a 429 with a `Retry-After` header (seconds or an HTTP date).
+"""
+
+import time
+import random
+import asyncio
+import argparse
+from aiohttp import web
+
+class GeminiStub:
+    """An aiohttp server answering like the Gemini API; counts requests and rejections."""
+
+    def __init__(self, latency=0.05, jitter=0.0, rate_limit_first=0, retry_after="1", max_rpm=None, seed=0):
+        """
+        :param latency: Seconds before each answer.
+        :param jitter: Extra random latency, uniform in [0, jitter] seconds.
+        :param rate_limit_first: Number of initial requests answered with 429.
+        :param retry_after: Retry-After header value of 429 responses (None omits it).
+        :param max_rpm: Requests accepted per sliding minute; more get 429.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_first = rate_limit_first
+        self.retry_after = retry_after
+        self.max_rpm = max_rpm
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.rejected = 0
+        self.accepted_at = []
+        self.prompts = []
+        self._runner = None
+        self.base_url = None
+
+    def _rate_limited(self):
+        self.requests += 1
+        now = time.monotonic()
+        self.accepted_at = [t for t in self.accepted_at if now - t < 60]
+        if self.requests <= self.rate_limit_first or (self.max_rpm and len(self.accepted_at) >= self.max_rpm):
+            self.rejected += 1
+            return True
+        self.accepted_at.append(now)
+        return False
+
+    def _too_many(self):
+        headers = {"Retry-After": self.retry_after} if self.retry_after is not None else {}
+        return web.json_response({"error": {"code": 429, "message": "Resource has been exhausted"}},
+                                 status=429, headers=headers)
+
+    async def handle(self, request):
+        model, _, method = request.match_info["model"].partition(":")
+        if method not in ("generateContent", "streamGenerateContent"):
+            return web.json_response({"error": {"message": f"Unknown method {method!r}"}}, status=404)
+        if self._rate_limited():
+            return self._too_many()
+        body = await request.json()
+        prompt = "".join(part.get("text", "") for part in body["contents"][0]["parts"])
+        self.prompts.append(prompt)
+        await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+        text = f"echo: {prompt}"
+        usage = {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4,
+                 "totalTokenCount": (len(prompt) + len(text)) // 4}
+        if method == "generateContent":
+            return web.json_response({"candidates": [{"content": {"parts": [{"text": text}]}}], "usageMetadata": usage})
+
+        import json
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            event = {"candidates": [{"content": {"parts": [{"text": word if i == 0 else " " + word}]}}]}
+            if i == len(words) - 1:
+                event["usageMetadata"] = usage
+            await response.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start serving (port 0 picks a free one); returns the base URL to pass as `base_url`."""
+        app = web.Application()
+        app.router.add_post("/v1beta/models/{model}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Gemini REST API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before each answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency (seconds)")
+    parser.add_argument("--rate_limit_first", type=int, default=0, help="Initial requests answered with 429")
+    parser.add_argument("--retry_after", default="1", help="Retry-After header of 429 responses")
+    parser.add_argument("--max_rpm", type=int, default=None, help="Requests accepted per minute")
+    args = parser.parse_args()
+
+    async def main():
+        stub = GeminiStub(args.latency, args.jitter, args.rate_limit_first, args.retry_after, args.max_rpm)
+        print(f"🚀 Gemini stub on {await stub.start(args.host, args.port)}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await stub.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("🛑 Shutting down")
@@ -0,0 +1,157 @@
+"""
+Persistent, content-addressed cache of generated text shared by every backend
+(LLaMA, Gemini, the gpt2 pipeline and LLMModel).
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Cache location and size limit (override with environment variables)
+GENERATION_CACHE_PATH = os.getenv("GENERATION_CACHE_PATH", "model_cache/generation_cache.sqlite")
+GENERATION_CACHE_MAX_MB = float(os.getenv("GENERATION_CACHE_MAX_MB", 1024))
+# Set GENERATION_CACHE=0 to bypass the cache everywhere
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE", "1") != "0"
+
+def is_error_output(value):
+    """Error placeholders ("[Error: ...]", "[ERROR]") are never cached."""
+    values = value if isinstance(value, list) else [value]
+    return any(isinstance(v, str) and v.startswith(("[Error", "[ERROR")) for v in values)
+
+class GenerationCache:
+    """SQLite store mapping a request hash to its generated output, evicted least-recently-used by size."""
+
+    def __init__(self, path=GENERATION_CACHE_PATH, max_size_mb=GENERATION_CACHE_MAX_MB):
+        """
+        :param path: SQLite file to store cached generations in.
+        :param max_size_mb: Size limit of the stored outputs, in MB.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON generations (accessed)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+
+    @staticmethod
+    def make_key(backend, model, prompt, max_tokens, temperature, seed=None, **params):
+        """
+        Hash everything that determines a generation into a cache key.
+        :param backend: Backend name, e.g. "llama", "gemini", "hf-pipeline".
+        :param model: Model identifier, including its revision when known.
+        :param params: Any extra sampling parameters (e.g. num_return_sequences).
+        """
+        payload = json.dumps(
+            [backend, model, prompt, max_tokens, temperature, seed, sorted(params.items())],
+            ensure_ascii=False, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached output for `key`, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE generations SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return json.loads(row[0])
+
+    def put(self, key, value):
+        """Store `value` (any JSON-serialisable output) under `key`."""
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM generations WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generations (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, data, size, now, now),
+            )
+            self._size += size - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        while self._size > self.max_size_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM generations ORDER BY accessed LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+                self._size -= size
+                if self._size <= self.max_size_bytes:
+                    break
+
+    def clear(self):
+        """Delete every cached generation."""
+        with self._lock:
+            self._conn.execute("DELETE FROM generations")
+            self._conn.commit()
+            self._size = 0
+
+    def stats(self):
+        """Return hit/miss counters and the current store size."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "size_mb": self._size / (1024 * 1024),
+        }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Return the process-wide GenerationCache, opening it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = GenerationCache()
+        return _cache
+
+def cached_generate(generate_fn, backend, model, prompt, max_tokens, temperature, seed=None,
+                    use_cache=True, refresh=False, **params):
+    """
+    Return a cached generation, or call `generate_fn()` and store its output.
+    :param generate_fn: Zero-argument callable that produces the output on a miss.
+    :param use_cache: False bypasses the cache entirely (no lookup, no store).
+    :param refresh: True skips the lookup but stores the fresh output.
+    """
+    if not (use_cache and GENERATION_CACHE_ENABLED):
+        return generate_fn()
+
+    cache = get_cache()
+    key = cache.make_key(backend, model, prompt, max_tokens, temperature, seed, **params)
+    if not refresh:
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+    value = generate_fn()
+    if not is_error_output(value):
+        cache.put(key, value)
+    return value
@@ -0,0 +1,622 @@
+"""
+Resident local inference server with continuous batching.
+
+    python inference_server.py serve --model llama=$LLAMA_MODEL_PATH --model gpt2
+    python inference_server.py serve --model gpt2 --socket /tmp/semicot.sock
+    INFERENCE_SERVER_URL=http://127.0.0.1:8600 python cli.py generate "..." --model_type llama
+    python inference_server.py bench --model gpt2 --clients 1 4 8
+
+Models are loaded once and stay resident. Safetensors checkpoints are
+memory-mapped instead of read into fresh buffers: their weights are backed by
+the page cache, so starting the server again (or a second server on the same
+checkpoint) does not read and copy the whole file.
+
+Every model has one engine thread that batches at the token-step level:
+requests that arrive while others are decoding are prefilled together and
+merged into the running batch before the next step, and finished requests
+leave it at once. Concurrent clients therefore share each forward pass
+instead of queueing behind one another, and throughput grows with the number
+of clients until the batch is compute bound.
+
+API (JSON over HTTP, on localhost or a Unix socket):
+    POST /generate  {"prompt", "model", "max_tokens" or "max_length", "temperature", "top_k",
+                     "stop", "final_answer"}
+                    -> {"text", "prompt_tokens", "completion_tokens", "stop_reason",
+                        "queue_s", "ttft_s", "latency_s"}
+    GET  /health    -> resident models and engine statistics
+
+`text` is the completion only (without the prompt). Requests are sampled
+independently within a batch, so per-request seeds are not supported.
+"""
+
+import os
+import json
+import mmap
+import time
+import queue
+import socket
+import struct
+import argparse
+import threading
+import http.client
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from telemetry import track
+from streaming import final_answer, make_condition
+
+# e.g. http://127.0.0.1:8600 or unix:///tmp/semicot.sock; set it to make generate_text a client of the server
+INFERENCE_SERVER_URL = os.getenv("INFERENCE_SERVER_URL")
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = int(os.getenv("INFERENCE_SERVER_PORT", 8600))
+MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", 16))  # rows decoded per step
+
+SAFETENSORS_DTYPES = {
+    "F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16",
+    "I64": "int64", "I32": "int32", "I16": "int16", "I8": "int8", "U8": "uint8", "BOOL": "bool",
+}
+
+def safetensors_files(path):
+    """The .safetensors files of a local checkpoint directory (sharded or not); [] if there are none."""
+    index = os.path.join(path, "model.safetensors.index.json")
+    if os.path.exists(index):
+        with open(index, "r", encoding="utf-8") as f:
+            return sorted({os.path.join(path, name) for name in json.load(f)["weight_map"].values()})
+    single = os.path.join(path, "model.safetensors")
+    return [single] if os.path.exists(single) else []
+
+def mmap_safetensors(path):
+    """
+    State dict of a .safetensors file whose tensors are views of a copy-on-write memory map.
+    Pages are read from the page cache when first touched; nothing is copied up front.
+    """
+    import torch
+
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)  # Writable views, file never modified
+    data_start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = getattr(torch, SAFETENSORS_DTYPES[info["dtype"]])
+        begin, end = info["data_offsets"]
+        count = (end - begin) // torch.empty(0, dtype=dtype).element_size()
+        if count:
+            tensor = torch.frombuffer(mapped, dtype=dtype, count=count, offset=data_start + begin)
+        else:
+            tensor = torch.empty(0, dtype=dtype)
+        tensors[name] = tensor.view(info["shape"])
+    return tensors
+
+def load_mmap_model(path, torch_dtype=None):
+    """
+    Build a causal LM with empty weights and point them at the memory-mapped checkpoint.
+    :param torch_dtype: Expected weight dtype; weights stored in another one would have to be copied.
+    :return: The model in eval mode, or None when this is not possible (no local safetensors,
+             a dtype conversion, weights missing from the checkpoint, or an older torch).
+    """
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    files = safetensors_files(path) if os.path.isdir(path) else []
+    if not files:
+        return None
+    try:
+        from accelerate import init_empty_weights
+    except ImportError:
+        return None
+    state = {}
+    for file in files:
+        state.update(mmap_safetensors(file))
+    dtypes = {t.dtype for t in state.values() if t.is_floating_point()}
+    if torch_dtype is not None and dtypes - {torch_dtype}:
+        return None  # Converting would copy every weight anyway
+
+    config = AutoConfig.from_pretrained(path)
+    with init_empty_weights():  # Parameters on the meta device; buffers computed in __init__ stay real
+        model = AutoModelForCausalLM.from_config(config)
+    if dtypes:
+        model.to(next(iter(dtypes)))
+    expected = set(model.state_dict())
+    prefix = model.base_model_prefix
+    # Checkpoints of the bare base model (e.g. the hub's gpt2) name "h.0..." what the LM head model calls "transformer.h.0..."
+    state = {name if name in expected or f"{prefix}.{name}" not in expected else f"{prefix}.{name}": tensor
+             for name, tensor in state.items()}
+    try:
+        model.load_state_dict(state, strict=False, assign=True)
+    except TypeError:  # torch < 2.1 has no assign=True
+        return None
+    model.tie_weights()
+    if any(t.is_meta for t in list(model.parameters()) + list(model.buffers())):
+        return None
+    return model.eval()
+
+def load_resident_model(path, precision="fp32"):
+    """
+    Load a model for the server, memory-mapped when possible.
+    :return: (model, how it was loaded: "mmap", "copy" or "quantized").
+    """
+    import torch
+    from transformers import AutoModelForCausalLM
+    from quantization import QUANTIZED_PRECISIONS, load_causal_lm
+
+    if precision in QUANTIZED_PRECISIONS:
+        return load_causal_lm(path, precision), "quantized"
+    dtype = torch.bfloat16 if precision == "bf16" else torch.float32
+    model = load_mmap_model(path, dtype)
+    if model is not None:
+        return model, "mmap"
+    return AutoModelForCausalLM.from_pretrained(path, torch_dtype=dtype).eval(), "copy"
+
+def cache_tensors(past_key_values):
+    """The cache as a list of (keys, values) per layer, each (batch, heads, positions, head_dim)."""
+    if isinstance(past_key_values, tuple):
+        return [(layer[0], layer[1]) for layer in past_key_values]
+    if hasattr(past_key_values, "layers"):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    return list(zip(past_key_values.key_cache, past_key_values.value_cache))
+
+def build_cache(tensors, like):
+    """A cache of the same kind as the model's `like` holding `tensors`."""
+    if isinstance(like, tuple):
+        return tuple(tensors)
+    cache = type(like)()
+    for layer, (keys, values) in enumerate(tensors):
+        cache.update(keys, values, layer)
+    return cache
+
+def _pad_positions(tensor, width, dim):
+    """Left-pad `tensor` with zeros along `dim` to `width`."""
+    import torch.nn.functional as F
+
+    missing = width - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    padding = [0, 0] * (tensor.dim() - 1 - dim) + [missing, 0]
+    return F.pad(tensor, padding)
+
+class Request:
+    """One generation request waiting for or inside a batch."""
+
+    def __init__(self, input_ids, max_new_tokens, temperature, top_k, condition, span):
+        self.input_ids = input_ids
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_k = top_k
+        self.condition = condition
+        self.span = span
+        self.generated = []
+        self.submitted = time.perf_counter()
+        self.admitted = None
+        self.first_token = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+class BatchEngine:
+    """Decodes all requests for one model in a shared batch; they join and leave between steps."""
+
+    def __init__(self, name, model, tokenizer, max_batch_size=MAX_BATCH_SIZE):
+        from prompt_compiler import context_window, get_compiler
+
+        self.name = name
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.compiler = get_compiler(tokenizer)
+        self.window = context_window(model, tokenizer)
+        self.eos_token_id = tokenizer.eos_token_id
+        self.queue = queue.Queue()
+        self.active = []  # Requests in the batch, in row order
+        self.cache = None  # [(keys, values)] per layer, rows left-padded to a common width
+        self.cache_like = None  # The model's own cache object, to rebuild caches of the same kind
+        self.mask = None  # (rows, positions) attention mask, 0 on padding
+        self.next_tokens = None  # (rows,) last sampled token of every row
+        self.stats = {"requests": 0, "steps": 0, "tokens": 0, "rows": 0, "prefills": 0}
+        self.thread = threading.Thread(target=self._run, name=f"engine-{name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, prompt, max_tokens=None, max_length=None, temperature=0.7, top_k=50, stop=None,
+               stop_predicate=None):
+        """
+        Queue a prompt and wait for its completion (called from any thread).
+        :param max_tokens: New tokens at most; or `max_length` for prompt plus new tokens.
+        :return: Result dict (see the module docstring).
+        """
+        from prompt_compiler import prompt_budget
+
+        # Bad requests fail here, before they are queued, instead of failing the batch they would join
+        if not isinstance(prompt, str):
+            raise TypeError(f"'prompt' must be a string, got {type(prompt).__name__}")
+        if max_tokens is None and max_length is None:
+            max_tokens = 128
+        if max_tokens is not None and int(max_tokens) < 1:
+            raise ValueError(f"'max_tokens' must be at least 1, got {max_tokens}")
+        if max_length is not None and int(max_length) < 2:
+            raise ValueError(f"'max_length' must be at least 2 (prompt plus one new token), got {max_length}")
+        temperature, top_k = float(temperature), int(top_k or 0)
+        if temperature < 0 or top_k < 0:
+            raise ValueError("'temperature' and 'top_k' must not be negative")
+        condition = make_condition(stop, stop_predicate)
+
+        # Over-long prompts lose their middle so that at least one new token fits; a prompt within
+        # its share of the window is kept whole and max_tokens is lowered instead
+        if max_tokens is not None:
+            max_tokens = int(max_tokens) if self.window is None else min(int(max_tokens), self.window - 1)
+            budget = prompt_budget(self.window, max_tokens)
+        else:
+            max_length = int(max_length) if self.window is None else min(int(max_length), self.window)
+            budget = max_length - 1
+        input_ids = self.compiler.render_text(prompt, budget)
+        if max_tokens is None:
+            max_tokens = max_length - len(input_ids)
+        elif self.window is not None:
+            max_tokens = min(max_tokens, self.window - len(input_ids))
+        span = track("server", self.name, max_tokens=max_tokens).start()
+        span.attempt()
+        request = Request(input_ids, max_tokens, temperature, top_k, condition, span)
+        self.queue.put(request)
+        request.done.wait()
+        completion = len(request.generated)
+        span.update(prompt_tokens=len(input_ids), completion_tokens=completion,
+                    batch_rows=request.result.get("batch_rows") if request.result else None)
+        span.finish(request.error)
+        if request.error:
+            raise RuntimeError(request.error)
+        return request.result
+
+    def health(self):
+        steps = self.stats["steps"]
+        return {**self.stats, "active": len(self.active), "queued": self.queue.qsize(),
+                "mean_batch_size": self.stats["rows"] / steps if steps else 0.0}
+
+    def _run(self):
+        import torch
+
+        while True:
+            waiting = [] if self.active else [self.queue.get()]  # Sleep until there is work
+            while len(self.active) + len(waiting) < self.max_batch_size:
+                try:
+                    waiting.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with torch.no_grad():
+                    if waiting:
+                        self._admit(waiting)
+                    if self.active:
+                        self._step()
+            except Exception as e:
+                print(f"❌ Engine {self.name}: {e}")
+                for request in self.active + waiting:
+                    if not request.done.is_set():
+                        request.error = f"{type(e).__name__}: {e}"
+                        request.done.set()
+                self.active, self.cache, self.mask, self.next_tokens = [], None, None, None
+
+    def _admit(self, requests):
+        """Prefill new requests as one left-padded batch and merge them into the running batch."""
+        import torch
+
+        device = self.model.device
+        batch = self.compiler.pad([request.input_ids for request in requests], "left", device)
+        mask = batch["attention_mask"]
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0)
+        now = time.perf_counter()
+        for request in requests:
+            request.admitted = now
+        out = self.model(input_ids=batch["input_ids"], attention_mask=mask, position_ids=position_ids,
+                         use_cache=True)
+        self.stats["prefills"] += 1
+        self.cache_like = out.past_key_values
+        tokens = self._sample(out.logits[:, -1, :], requests)
+        keep = [row for row, (request, token) in enumerate(zip(requests, tokens.tolist()))
+                if not self._append(request, token)]
+        if not keep:
+            return
+        index = torch.tensor(keep, device=device)
+        tensors = [(k[index], v[index]) for k, v in cache_tensors(out.past_key_values)]
+        requests = [requests[row] for row in keep]
+        mask, tokens = mask[index], tokens[index]
+        if not self.active:
+            self.active, self.cache, self.mask, self.next_tokens = requests, tensors, mask, tokens
+            return
+        width = max(self.mask.shape[1], mask.shape[1])
+        self.cache = [(torch.cat([_pad_positions(k0, width, 2), _pad_positions(k1, width, 2)]),
+                       torch.cat([_pad_positions(v0, width, 2), _pad_positions(v1, width, 2)]))
+                      for (k0, v0), (k1, v1) in zip(self.cache, tensors)]
+        self.mask = torch.cat([_pad_positions(self.mask, width, 1), _pad_positions(mask, width, 1)])
+        self.next_tokens = torch.cat([self.next_tokens, tokens])
+        self.active = self.active + requests
+
+    def _step(self):
+        """One decoding step for every row; finished rows leave the batch."""
+        import torch
+
+        rows = len(self.active)
+        self.mask = torch.cat([self.mask, self.mask.new_ones(rows, 1)], dim=1)
+        position_ids = self.mask.sum(-1, keepdim=True) - 1
+        out = self.model(input_ids=self.next_tokens[:, None], attention_mask=self.mask, position_ids=position_ids,
+                         past_key_values=build_cache(self.cache, self.cache_like), use_cache=True)
+        self.cache = cache_tensors(out.past_key_values)
+        tokens = self._sample(out.logits[:, -1, :], self.active)
+        self.stats["steps"] += 1
+        self.stats["rows"] += rows
+        keep = [row for row, (request, token) in enumerate(zip(self.active, tokens.tolist()))
+                if not self._append(request, token, rows)]
+        if len(keep) == rows:
+            self.next_tokens = tokens
+            return
+        if not keep:
+            self.active, self.cache, self.mask, self.next_tokens = [], None, None, None
+            return
+        index = torch.tensor(keep, device=tokens.device)
+        mask = self.mask[index]
+        first = int(mask.any(0).nonzero()[0])  # Drop columns that are padding in every remaining row
+        self.cache = [(k[index, :, first:], v[index, :, first:]) for k, v in self.cache]
+        self.mask, self.next_tokens = mask[:, first:], tokens[index]
+        self.active = [self.active[row] for row in keep]
+
+    def _sample(self, logits, requests):
+        """Next token of every row with its own temperature and top-k (temperature 0 = greedy)."""
+        import torch
+
+        logits = logits.float()
+        temperature = torch.tensor([r.temperature for r in requests], device=logits.device)
+        vocab = logits.shape[-1]
+        top_k = torch.tensor([min(r.top_k, vocab) if r.top_k > 0 else vocab for r in requests], device=logits.device)
+        scaled = logits / temperature.clamp(min=1e-5)[:, None]
+        kth = torch.topk(scaled, int(top_k.max())).values.gather(1, (top_k - 1)[:, None])
+        scaled = scaled.masked_fill(scaled < kth, float("-inf"))
+        sampled = torch.multinomial(torch.softmax(scaled, dim=-1), 1)[:, 0]
+        return torch.where(temperature > 0, sampled, logits.argmax(-1))
+
+    def _append(self, request, token, batch_rows=None):
+        """Add a sampled token to `request`; True (and the result is set) when it has finished."""
+        now = time.perf_counter()
+        if request.first_token is None:
+            request.first_token = now
+            request.span.first_token()
+        reason = None
+        if token == self.eos_token_id:
+            reason = "eos"
+        else:
+            request.generated.append(token)
+            self.stats["tokens"] += 1
+            if request.condition:
+                reason = request.condition.find(self.tokenizer.decode(request.generated, skip_special_tokens=True))[1]
+            if reason is None and len(request.generated) >= request.max_new_tokens:
+                reason = "length"
+        if reason is None:
+            return False
+        text = self.tokenizer.decode(request.generated, skip_special_tokens=True)
+        self.stats["requests"] += 1
+        request.result = {
+            "text": request.condition.apply(text) if request.condition else text,
+            "prompt_tokens": len(request.input_ids),
+            "completion_tokens": len(request.generated),
+            "stop_reason": reason,
+            "queue_s": request.admitted - request.submitted,
+            "ttft_s": request.first_token - request.submitted,
+            "latency_s": now - request.submitted,
+            "batch_rows": batch_rows or 1,
+        }
+        request.done.set()
+        return True
+
+class _EngineServerMixin:
+    """Engines shared by the HTTP and Unix-socket servers."""
+
+    daemon_threads = True
+
+    def generate(self, body):
+        model = body.get("model") or next(iter(self.engines))
+        if model not in self.engines:
+            raise KeyError(f"Model {model!r} is not loaded (available: {', '.join(self.engines)})")
+        if not body.get("prompt"):
+            raise ValueError("'prompt' is required")
+        return self.engines[model].submit(
+            body["prompt"], body.get("max_tokens"), body.get("max_length"), body.get("temperature", 0.7),
+            body.get("top_k", 50), body.get("stop"), final_answer if body.get("final_answer") else None)
+
+    def health(self):
+        return {"status": "ok", "models": {name: {**engine.health(), "loaded": self.loaded[name]}
+                                           for name, engine in self.engines.items()}}
+
+class InferenceHTTPServer(_EngineServerMixin, ThreadingHTTPServer):
+    pass
+
+class UnixInferenceServer(_EngineServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    pass
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, self.server.health())
+        else:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            self._send(200, self.server.generate(body))
+        except KeyError as e:
+            self._send(404, {"error": str(e.args[0])})
+        except (ValueError, TypeError) as e:
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        pass  # One line per request would drown the engine output; see /health and telemetry instead
+
+def create_server(engines, loaded, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    """An HTTP server on host:port, or on a Unix socket when `socket_path` is given."""
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  # Stale socket of a previous run
+        server = UnixInferenceServer(socket_path, _Handler)
+    else:
+        server = InferenceHTTPServer((host, port), _Handler)
+    server.engines, server.loaded = engines, loaded
+    return server
+
+def serve(models, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, precision="fp32",
+          max_batch_size=MAX_BATCH_SIZE):
+    """
+    Load `models` and serve them until interrupted.
+    :param models: {name: model path} or {name: (model path, tokenizer path)}.
+    """
+    from transformers import AutoTokenizer
+
+    engines, loaded = {}, {}
+    for name, spec in models.items():
+        model_path, tokenizer_path = spec if isinstance(spec, tuple) else (spec, spec)
+        start = time.perf_counter()
+        model, loaded[name] = load_resident_model(model_path, precision)
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+        engines[name] = BatchEngine(name, model, tokenizer, max_batch_size)
+        print(f"✅ {name} ({model_path}) loaded in {time.perf_counter() - start:.1f}s ({loaded[name]})")
+    server = create_server(engines, loaded, host, port, socket_path)
+    address = f"unix://{socket_path}" if socket_path else f"http://{host}:{server.server_address[1]}"
+    print(f"🚀 Serving {', '.join(engines)} on {address} (max batch size {max_batch_size})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("🛑 Shutting down")
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class InferenceClient:
+    """Client of a running inference server (safe to share between threads)."""
+
+    def __init__(self, url=None, timeout=600):
+        """
+        :param url: http://host:port or unix:///path/to.sock (default: INFERENCE_SERVER_URL, else localhost).
+        """
+        self.url = url or INFERENCE_SERVER_URL or f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
+        self.timeout = timeout
+        self._parsed = urlparse(self.url)
+
+    def _request(self, method, path, payload=None):
+        if self._parsed.scheme == "unix":
+            connection = _UnixHTTPConnection(self._parsed.path, self.timeout)
+        else:
+            connection = http.client.HTTPConnection(self._parsed.hostname, self._parsed.port or 80, timeout=self.timeout)
+        try:
+            body = json.dumps(payload).encode("utf-8") if payload is not None else None
+            connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            data = json.loads(response.read() or b"{}")
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise RuntimeError(f"Inference server error {response.status}: {data.get('error')}")
+        return data
+
+    def generate(self, prompt, model=None, max_tokens=None, max_length=None, temperature=0.7, top_k=50,
+                 stop=None, stop_predicate=None):
+        """
+        Completion of `prompt` (without the prompt) and its statistics.
+        streaming.final_answer runs on the server; any other predicate is applied to the returned text.
+        """
+        condition = make_condition(stop, stop_predicate)
+        remote = condition.predicate is final_answer
+        result = self._request("POST", "/generate", {
+            "prompt": prompt, "model": model, "max_tokens": max_tokens, "max_length": max_length,
+            "temperature": temperature, "top_k": top_k, "stop": condition.stop or None, "final_answer": remote,
+        })
+        if condition.predicate is not None and not remote:
+            result["text"] = condition.apply(result["text"])
+        return result
+
+    def health(self):
+        return self._request("GET", "/health")
+
+def benchmark(client, model=None, prompts=None, clients=(1, 4, 8), requests=32, max_tokens=64):
+    """Tokens/s of `requests` generations sent by 1, 4, 8, ... concurrent clients."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    prompts = prompts or ["Explain the role of lithography in semiconductor manufacturing."]
+    results = {}
+    for n in clients:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            outputs = list(pool.map(
+                lambda i: client.generate(prompts[i % len(prompts)], model, max_tokens, temperature=0.7),
+                range(requests)))
+        elapsed = time.perf_counter() - start
+        tokens = sum(output["completion_tokens"] for output in outputs)
+        latency = sum(output["latency_s"] for output in outputs) / len(outputs)
+        results[n] = {"tokens_per_sec": tokens / elapsed, "requests_per_sec": requests / elapsed,
+                      "mean_latency_s": latency}
+        print(f"📈 {n:>3} clients: {tokens / elapsed:8.1f} tokens/s, {requests / elapsed:6.2f} requests/s, "
+              f"mean latency {latency:.2f}s")
+    return results
+
+def parse_model_specs(specs):
+    """["name=model_path[,tokenizer_path]", "path"] -> {name: path or (model path, tokenizer path)}."""
+    models = {}
+    for spec in specs:
+        name, _, path = spec.partition("=") if "=" in spec else (spec, "", spec)
+        model_path, _, tokenizer_path = path.partition(",")
+        models[name] = (model_path, tokenizer_path) if tokenizer_path else model_path
+    return models
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resident inference server with continuous batching.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Load models and serve them")
+    serve_parser.add_argument("--model", action="append", required=True,
+                              help="name=model_path[,tokenizer_path] (repeatable; a bare path is its own name)")
+    serve_parser.add_argument("--host", default=DEFAULT_HOST)
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--socket", help="Serve on this Unix socket instead of TCP")
+    serve_parser.add_argument("--precision", default="fp32",
+                              help="fp32, bf16, int8-dynamic, int8-weight or int4-weight (see quantization.py)")
+    serve_parser.add_argument("--max_batch_size", type=int, default=MAX_BATCH_SIZE)
+
+    bench_parser = subparsers.add_parser("bench", help="Measure throughput against a running server")
+    bench_parser.add_argument("--url", help="Server URL (default: INFERENCE_SERVER_URL or localhost)")
+    bench_parser.add_argument("--model", help="Model name on the server (default: its first model)")
+    bench_parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 8])
+    bench_parser.add_argument("--requests", type=int, default=32)
+    bench_parser.add_argument("--max_tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(parse_model_specs(args.model), args.host, args.port, args.socket, args.precision, args.max_batch_size)
+    else:
+        benchmark(InferenceClient(args.url), args.model, clients=args.clients, requests=args.requests,
+                  max_tokens=args.max_tokens)
@@ -1,27 +1,108 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+import os
+from transformers import AutoTokenizer, pipeline
+from generation_cache import cached_generate
+from telemetry import track, first_token_streamer
+from streaming import hf_stream, make_condition
+from quantization import QUANTIZED_CACHE_DIR, load_causal_lm
 
 class LLMModel:
-    def __init__(self, model_name="gpt2"):
+    def __init__(self, model_name="gpt2", precision="fp32", cache_dir=QUANTIZED_CACHE_DIR, server_url=None):
         """
         Initialize the LLM model and tokenizer.
         :param model_name: Name of the pre-trained model to load.
+        :param precision: "fp32", "bf16", "int8-dynamic", "int8-weight" or "int4-weight" (see quantization.py).
+        :param cache_dir: Where quantized weights are cached between runs (None disables the cache).
+        :param server_url: Use the model resident in this inference server (inference_server.py) instead of
+                           loading it here; default INFERENCE_SERVER_URL. The server must serve it as `model_name`.
         """
-        print(f"Loading model: {model_name}")
+        self.model_name = model_name
+        self.precision = precision
+        self.client = None
+        server_url = server_url or os.getenv("INFERENCE_SERVER_URL")
+        if server_url:
+            from inference_server import InferenceClient
+            print(f"Using model {model_name} on the inference server at {server_url}")
+            self.client = InferenceClient(server_url)
+            return
+        print(f"Loading model: {model_name} ({precision})")
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForCausalLM.from_pretrained(model_name)
+        self.model = load_causal_lm(model_name, precision, cache_dir)
         self.pipeline = pipeline("text-generation", model=self.model, tokenizer=self.tokenizer)
 
-    def generate_text(self, prompt, max_length=50, num_return_sequences=1):
+    def stream_text(self, prompt, max_length=50, stop=None, stop_predicate=None):
+        """
+        Stream generated text as deltas, halting generation at a stop sequence or predicate.
+        :param max_length: Maximum length of prompt plus generated text, in tokens (as in generate_text).
+        :return: TextStream of the continuation (without the prompt); see streaming.py.
+        """
+        if self.client:
+            raise RuntimeError("Streaming is not available through the inference server; use generate_text")
+        input_ids = self.tokenizer(prompt)["input_ids"]
+        span = track("hf-pipeline-stream", self.model_id, max_length=max_length)
+        span.attempt()
+        span.update(prompt_tokens=len(input_ids))
+        pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
+        return hf_stream(self.model, self.tokenizer, input_ids, max(1, max_length - len(input_ids)),
+                         make_condition(stop, stop_predicate), span, do_sample=True, pad_token_id=pad_token_id)
+
+    def generate_text(self, prompt, max_length=50, num_return_sequences=1, use_cache=True, refresh_cache=False,
+                      stop=None, stop_predicate=None):
         """
         Generate text based on a given prompt.
         :param prompt: Input text prompt.
         :param max_length: Maximum length of the generated text.
         :param num_return_sequences: Number of generated sequences to return.
+        :param use_cache: Serve repeated requests from the on-disk generation cache.
+        :param refresh_cache: Regenerate and overwrite any cached output.
+        :param stop: Stop sequence(s); generation of a sequence ends as soon as one appears (it is not included).
+        :param stop_predicate: Callable(text) ending generation early, e.g. streaming.final_answer.
         :return: List of generated text sequences.
         """
         print(f"Generating text for prompt: {prompt}")
-        outputs = self.pipeline(prompt, max_length=max_length, num_return_sequences=num_return_sequences)
-        return [output["generated_text"] for output in outputs]
+        condition = make_condition(stop, stop_predicate)
+
+        def generate():
+            if self.client:
+                # Sent concurrently so the server decodes the sequences in one batch (HF sampling defaults)
+                from concurrent.futures import ThreadPoolExecutor
+                with ThreadPoolExecutor(max_workers=num_return_sequences) as pool:
+                    results = pool.map(lambda _: self.client.generate(
+                        prompt, self.model_name, max_length=max_length, temperature=1.0, top_k=50,
+                        stop=condition.stop, stop_predicate=condition.predicate), range(num_return_sequences))
+                    return [prompt + result["text"] for result in results]
+            if condition:
+                texts = []
+                for _ in range(num_return_sequences):
+                    with self.stream_text(prompt, max_length, condition) as stream:
+                        texts.append(prompt + stream.read())
+                    print(f"✂️ Stopped after {stream.stats.tokens} tokens ({stream.stats.stop_reason}), "
+                          f"{stream.stats.tokens_saved} saved")
+                return texts
+            with track("hf-pipeline", self.model_id, max_length=max_length,
+                       num_return_sequences=num_return_sequences) as span:
+                span.attempt()
+                outputs = self.pipeline(prompt, max_length=max_length, num_return_sequences=num_return_sequences,
+                                        streamer=first_token_streamer(span))
+                texts = [output["generated_text"] for output in outputs]
+                if span:
+                    prompt_tokens = len(self.tokenizer(prompt)["input_ids"])
+                    generated = sum(len(ids) for ids in self.tokenizer(texts)["input_ids"])
+                    span.update(prompt_tokens=prompt_tokens,
+                                completion_tokens=generated - prompt_tokens * len(texts))
+                return texts
+
+        return cached_generate(generate, "hf-pipeline", self.model_id, prompt, max_length, None,
+                               use_cache=use_cache, refresh=refresh_cache,
+                               num_return_sequences=num_return_sequences, **condition.cache_params())
+
+    @property
+    def model_id(self):
+        """Model name plus the hub revision it was loaded from, when known, and any reduced precision."""
+        if self.client:
+            return f"{self.model_name}@{self.client.url}"
+        revision = getattr(self.model.config, "_commit_hash", None)
+        model_id = f"{self.model_name}@{revision}" if revision else self.model_name
+        return model_id if self.precision == "fp32" else f"{model_id}#{self.precision}"
 
     def fine_tune(self, dataset_path, output_dir, epochs=3):
         """
@@ -0,0 +1,200 @@
+"""
+Columnar store for the materials tables (data/raw/documents/fake_materials_data*.csv).
+
+Each CSV is converted once, streaming, to Parquet in data/processed:
+`material_name` and `structure` become dictionary (categorical) columns with
+int8 codes, `resistivity`/`bandgap` float32 and `target` int8. Later loads
+memory-map the Parquet file, read only the requested columns and push
+filters (material, structure, value ranges) down to the row-group statistics,
+instead of re-parsing text and materializing Python strings.
+"""
+
+import os
+import time
+import argparse
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+PROCESSED_DIR = "data/processed"
+MATERIALS = ["CuO", "Si", "Ge", "GaAs", "CuMnSnO", "ZnO"]
+STRUCTURES = ["Monoclinic", "Cubic", "Tetragonal", "Hexagonal", "Orthorhombic"]
+CATEGORICAL_COLUMNS = {"material_name": MATERIALS, "structure": STRUCTURES}
+FLOAT_COLUMNS = ("resistivity", "bandgap")
+ROW_GROUP_SIZE = 1_000_000
+
+def find_header(csv_path, max_lines=10):
+    """
+    Return the number of lines before the real header row.
+    fake_materials_data.csv starts with a stray "target" line above the header.
+    """
+    with open(csv_path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if i >= max_lines:
+                break
+            if line.startswith("material_name,") or ",material_name," in line:
+                return i
+    raise ValueError(f"No header with a material_name column in the first {max_lines} lines of {csv_path}")
+
+def _encode(column, categories):
+    """Dictionary-encode a string column against `categories` (extended in place with unseen values)."""
+    unseen = [value for value in pc.unique(column).to_pylist() if value is not None and value not in categories]
+    categories.extend(unseen)
+    if len(categories) > 127:
+        raise ValueError("More than 127 categories do not fit int8 dictionary codes")
+    indices = pc.index_in(column, value_set=pa.array(categories, pa.string())).cast(pa.int8())
+    return pa.DictionaryArray.from_arrays(indices, pa.array(categories, pa.string()))
+
+def _convert_batch(batch, categories):
+    columns, names = [], []
+    for name, column in zip(batch.schema.names, batch.columns):
+        if name in categories:
+            column = _encode(column, categories[name])
+        elif name in FLOAT_COLUMNS:
+            column = column.cast(pa.float32())
+        elif name == "target":
+            column = column.cast(pa.int8())
+        columns.append(column)
+        names.append(name)
+    return pa.RecordBatch.from_arrays(columns, names=names)
+
+def convert_csv(csv_path, parquet_path, block_size=64 << 20, row_group_size=ROW_GROUP_SIZE):
+    """
+    Stream a materials CSV into a typed, dictionary-encoded Parquet file.
+    :param block_size: Bytes of CSV parsed per batch (bounds memory use).
+    :return: Number of rows written.
+    """
+    read_options = pa_csv.ReadOptions(skip_rows=find_header(csv_path), block_size=block_size)
+    convert_options = pa_csv.ConvertOptions(
+        column_types={**{name: pa.string() for name in CATEGORICAL_COLUMNS},
+                      **{name: pa.float64() for name in FLOAT_COLUMNS}},
+    )
+    reader = pa_csv.open_csv(csv_path, read_options=read_options, convert_options=convert_options)
+    categories = {name: list(values) for name, values in CATEGORICAL_COLUMNS.items()}
+
+    directory = os.path.dirname(parquet_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = parquet_path + ".tmp"
+    writer = None
+    rows = 0
+    try:
+        for batch in reader:
+            batch = _convert_batch(batch, categories)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, batch.schema, write_statistics=True)
+            writer.write_table(pa.Table.from_batches([batch]), row_group_size=row_group_size)
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    os.replace(tmp_path, parquet_path)
+    return rows
+
+def parquet_path_for(csv_path, processed_dir=PROCESSED_DIR):
+    return os.path.join(processed_dir, os.path.splitext(os.path.basename(csv_path))[0] + ".parquet")
+
+def materials_dataset(csv_path, processed_dir=PROCESSED_DIR):
+    """Return the Parquet copy of `csv_path`, converting it first if missing or older than the CSV."""
+    parquet_path = parquet_path_for(csv_path, processed_dir)
+    if not os.path.exists(parquet_path) or os.path.getmtime(parquet_path) < os.path.getmtime(csv_path):
+        start = time.perf_counter()
+        rows = convert_csv(csv_path, parquet_path)
+        print(f"📦 Converted {csv_path} -> {parquet_path} ({rows} rows, {time.perf_counter() - start:.2f} s)")
+    return parquet_path
+
+def make_filter(materials=None, structures=None, bandgap=None, resistivity=None, target=None):
+    """
+    Build a pushdown filter expression; None means "no constraint".
+    :param materials: Iterable of material names to keep.
+    :param structures: Iterable of crystal structures to keep.
+    :param bandgap: (low, high) inclusive range in eV; either bound may be None.
+    :param resistivity: (low, high) inclusive range; either bound may be None.
+    :param target: 0 or 1.
+    """
+    conditions = []
+    if materials is not None:
+        conditions.append(ds.field("material_name").isin(list(materials)))
+    if structures is not None:
+        conditions.append(ds.field("structure").isin(list(structures)))
+    for name, bounds in (("bandgap", bandgap), ("resistivity", resistivity)):
+        if bounds is None:
+            continue
+        low, high = bounds
+        if low is not None:
+            conditions.append(ds.field(name) >= pa.scalar(low, pa.float32()))
+        if high is not None:
+            conditions.append(ds.field(name) <= pa.scalar(high, pa.float32()))
+    if target is not None:
+        conditions.append(ds.field("target") == pa.scalar(target, pa.int8()))
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+def load(source, columns=None, memory_map=True, **filters):
+    """
+    Load a materials table as an Arrow table.
+    :param source: CSV path (converted on first use) or Parquet path.
+    :param columns: Columns to read (default: all).
+    :param filters: Keyword arguments of make_filter, e.g. materials=["Si"], bandgap=(2.0, None).
+    """
+    path = materials_dataset(source) if source.endswith(".csv") else source
+    return pq.read_table(path, columns=columns, filters=make_filter(**filters), memory_map=memory_map)
+
+def load_pandas(source, columns=None, **filters):
+    """Like `load`, returned as a DataFrame with categorical and float32 columns."""
+    return load(source, columns, **filters).to_pandas(split_blocks=True, self_destruct=True)
+
+def benchmark(csv_path, processed_dir=PROCESSED_DIR, **filters):
+    """Compare pandas.read_csv + boolean filtering with the Parquet store (in `processed_dir`) on one filter."""
+    import pandas as pd
+
+    skip = find_header(csv_path)
+    start = time.perf_counter()
+    df = pd.read_csv(csv_path, skiprows=skip)
+    mask = pd.Series(True, index=df.index)
+    if filters.get("materials") is not None:
+        mask &= df["material_name"].isin(filters["materials"])
+    for name in ("bandgap", "resistivity"):
+        low, high = filters.get(name) or (None, None)
+        if low is not None:
+            mask &= df[name] >= low
+        if high is not None:
+            mask &= df[name] <= high
+    csv_rows = int(mask.sum())
+    csv_time = time.perf_counter() - start
+    csv_mb = df.memory_usage(deep=True).sum() / 1024 ** 2
+    del df, mask
+
+    parquet_path = materials_dataset(csv_path, processed_dir)  # Convert outside the timed section
+    start = time.perf_counter()
+    table = load(parquet_path, **filters)
+    parquet_time = time.perf_counter() - start
+
+    result = {
+        "csv_sec": csv_time,
+        "csv_mb": csv_mb,
+        "parquet_sec": parquet_time,
+        "parquet_mb": table.nbytes / 1024 ** 2,
+        "rows": table.num_rows,
+        "rows_match": table.num_rows == csv_rows,
+    }
+    print(f"⏱️ read_csv + filter: {csv_time:.2f} s, {csv_mb:.1f} MB | Parquet: {parquet_time:.3f} s, "
+          f"{result['parquet_mb']:.1f} MB ({table.num_rows} rows, match: {result['rows_match']})")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert materials CSVs to the columnar Parquet store.")
+    parser.add_argument("csv_files", nargs="*", default=["data/raw/documents/fake_materials_data.csv",
+                                                         "data/raw/documents/fake_materials_data_with_labels.csv"])
+    parser.add_argument("--processed_dir", default=PROCESSED_DIR, help="Output directory for the Parquet files")
+    parser.add_argument("--benchmark", action="store_true", help="Compare with pandas.read_csv on a sample filter")
+    args = parser.parse_args()
+
+    for csv_file in args.csv_files:
+        materials_dataset(csv_file, args.processed_dir)
+        if args.benchmark:
+            benchmark(csv_file, args.processed_dir, materials=["Si", "GaAs"], bandgap=(2.0, 3.0))
@@ -0,0 +1,415 @@
+"""
+Comparative evaluation of several models on one question set.
+
+Every (question, method) prompt is answered by every backend. Each backend
+gets one or more worker processes, and each worker loads its model once and
+keeps it resident. Prompts are dealt in batches to per-worker queues; a worker
+that runs out of work steals batches from the other workers of the same
+backend, so a slow replica never holds up its siblings and slow backends
+never hold up fast ones. Answers stream back to the parent process, which
+appends them to a resumable JSONL file (one record per question, method and
+backend) and finally writes one aligned table with a column per backend.
+
+Backends are given as "kind[:model][,key=value...]":
+
+    gpt2 / hf:<name or path>[,precision=int8-dynamic]   Hugging Face causal LM (evaluate_models.generate_batch)
+    llama                                               model_manager LLaMA (LLAMA_MODEL_PATH)
+    gemini                                              model_manager async Gemini client
+    echo[,delay=0.05]                                   offline stand-in that repeats the question
+
+Common options: workers=N (replicas), batch_size=N, label=<column name>.
+
+    python model_evaluator.py --backends gpt2 gemini "echo,delay=0.01" --limit 50 --analyze
+"""
+
+import os
+import csv
+import time
+import queue
+import hashlib
+import argparse
+import multiprocessing
+from generation_cache import GENERATION_CACHE_ENABLED, is_error_output
+from results_io import ResultWriter, iter_jsonl
+from prompts import get_prompt
+
+METHODS = ("standard", "cot")
+ERROR_ANSWER = "[ERROR]"
+
+class EchoBackend:
+    """Offline stand-in: answers with the question itself after `delay` seconds per prompt."""
+    cacheable = False
+
+    def __init__(self, model=None, delay=0.0, batch_size=4, temperature=None):
+        self.model_id = "echo"
+        self.delay = float(delay)
+        self.batch_size = int(batch_size)
+        self.temperature = temperature
+
+    def load(self):
+        pass
+
+    def generate(self, prompts, max_tokens):
+        time.sleep(self.delay * len(prompts))
+        return [prompt.split(": ", 1)[-1] for prompt in prompts]
+
+class HFBackend:
+    """A Hugging Face causal LM answered in padded batches through evaluate_models.generate_batch."""
+    cacheable = True
+    cache_backend = "hf-pipeline"  # Same cache keys as evaluate_models
+
+    def __init__(self, model="gpt2", precision="fp32", batch_size=8, temperature=None):
+        self.model = model
+        self.precision = precision
+        self.batch_size = int(batch_size)
+        self.temperature = temperature
+        self.model_id = model
+
+    def load(self):
+        import evaluate_models
+        from transformers import AutoTokenizer, pipeline
+        from quantization import load_causal_lm
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model)
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        model = load_causal_lm(self.model, self.precision)
+        evaluate_models._generator = pipeline("text-generation", model=model, tokenizer=tokenizer,
+                                              pad_token_id=tokenizer.pad_token_id)
+        self.model_id = evaluate_models.model_id()
+        if self.precision != "fp32":
+            self.model_id += f"#{self.precision}"
+
+    def generate(self, prompts, max_tokens):
+        import evaluate_models
+        return evaluate_models.generate_batch(prompts, max_length=max_tokens)[0]
+
+class LlamaBackend:
+    """LLaMA through model_manager, one prompt at a time."""
+    cacheable = True
+    cache_backend = "llama"
+
+    def __init__(self, model=None, batch_size=1, temperature=0.7):
+        self.batch_size = int(batch_size)
+        self.temperature = float(temperature)
+        self.model_id = None
+
+    def load(self):
+        import model_manager
+        model_manager.load_llama_model()
+        self.model_id = model_manager.model_identifier("llama")
+
+    def generate(self, prompts, max_tokens):
+        import model_manager
+        return [model_manager.generate_with_llama(prompt, max_tokens, self.temperature) for prompt in prompts]
+
+class GeminiBackend:
+    """Gemini through the rate-limited async client; a batch is sent concurrently."""
+    cacheable = True
+    cache_backend = "gemini"
+
+    def __init__(self, model="gemini-1.5-flash", batch_size=8, temperature=0.7):
+        self.model_id = model or "gemini-1.5-flash"
+        self.batch_size = int(batch_size)
+        self.temperature = float(temperature)
+
+    def load(self):
+        pass
+
+    def generate(self, prompts, max_tokens):
+        import asyncio
+        import model_manager
+        return asyncio.run(model_manager.agenerate_batch(prompts, max_tokens, self.temperature,
+                                                         model_name=self.model_id))
+
+BACKENDS = {
+    "echo": EchoBackend,
+    "hf": HFBackend,
+    "gpt2": lambda model=None, **options: HFBackend(model or "gpt2", **options),
+    "llama": LlamaBackend,
+    "gemini": GeminiBackend,
+}
+
+def parse_backend(spec):
+    """
+    Parse "kind[:model][,key=value...]".
+    :return: (label, kind, model, options, workers)
+    """
+    head, *pairs = spec.split(",")
+    kind, _, model = head.partition(":")
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown backend {kind!r}; choose from {', '.join(BACKENDS)}")
+    options = dict(pair.split("=", 1) for pair in pairs)
+    label = options.pop("label", head)
+    workers = int(options.pop("workers", 1))
+    return label, kind, model or None, options, workers
+
+def make_backend(kind, model=None, options=None):
+    return BACKENDS[kind](model, **(options or {}))
+
+def _cached(backend, prompts, max_tokens, use_cache):
+    """Split prompts into cache hits and misses: ({position: answer}, cache, keys)."""
+    if not (use_cache and backend.cacheable and GENERATION_CACHE_ENABLED):
+        return {}, None, None
+    from generation_cache import get_cache
+    cache = get_cache()
+    keys = [cache.make_key(backend.cache_backend, backend.model_id, prompt, max_tokens, backend.temperature)
+            for prompt in prompts]
+    hits = {}
+    for position, key in enumerate(keys):
+        value = cache.get(key)
+        if value is not None:
+            hits[position] = value
+    return hits, cache, keys
+
+def _take(queues, own, remaining, lock):
+    """Next batch for worker `own`: its own queue first, then stolen from a sibling. None when all are done."""
+    order = [own] + [j for j in range(len(queues)) if j != own]
+    while True:
+        with lock:
+            if remaining.value <= 0:
+                return None, False
+        for j in order:
+            try:
+                batch = queues[j].get(timeout=0.01)
+            except queue.Empty:
+                continue
+            with lock:
+                remaining.value -= len(batch)
+            return batch, j != own
+
+def _worker(label, kind, model, options, queues, own, remaining, lock, results, max_tokens, use_cache):
+    """Worker process: load one backend, answer batches until the backend has no work left."""
+    name = f"{label}#{own}"
+    try:
+        backend = make_backend(kind, model, options)
+        start = time.perf_counter()
+        backend.load()
+        results.put(("ready", name, {"model": backend.model_id, "load_s": time.perf_counter() - start}))
+    except Exception as e:
+        results.put(("failed", name, f"{type(e).__name__}: {e}"))
+        return
+
+    stats = {"batches": 0, "stolen": 0, "prompts": 0, "cached": 0, "busy_s": 0.0}
+    while True:
+        batch, stolen = _take(queues, own, remaining, lock)
+        if batch is None:
+            break
+        prompts = [task[2] for task in batch]
+        start = time.perf_counter()
+        hits, cache, keys = _cached(backend, prompts, max_tokens, use_cache)
+        misses = [position for position in range(len(prompts)) if position not in hits]
+        answers = dict(hits)
+        if misses:
+            try:
+                generated = backend.generate([prompts[position] for position in misses], max_tokens)
+            except Exception as e:
+                print(f"⚠️ {name}: {e}")
+                generated = [ERROR_ANSWER] * len(misses)
+            for position, answer in zip(misses, generated):
+                answers[position] = answer
+                if cache is not None and not is_error_output(answer):
+                    cache.put(keys[position], answer)
+        elapsed = time.perf_counter() - start
+        # Cache hits cost nothing; generation time is shared by the prompts that were generated
+        latency = elapsed / len(misses) if misses else 0.0
+        results.put(("answers", name, [
+            (index, method, answers[position], 0.0 if position in hits else latency, backend.model_id)
+            for position, (index, method, _) in enumerate(batch)
+        ]))
+        stats["batches"] += 1
+        stats["stolen"] += stolen
+        stats["prompts"] += len(batch)
+        stats["cached"] += len(hits)
+        stats["busy_s"] += elapsed
+    results.put(("done", name, stats))
+
+def load_items(input_file, limit=None):
+    from evaluate_models import iter_questions
+    items = []
+    for item in iter_questions(input_file):
+        if limit is not None and len(items) >= limit:
+            break
+        items.append(item)
+    return items
+
+def question_id(question):
+    """Stable key of a question, so results are matched by content rather than by position in the input file."""
+    return hashlib.sha1(question.encode("utf-8")).hexdigest()[:16]
+
+def _question_key(record):
+    return record.get("question_id") or question_id(record["question"])
+
+def completed(output_file):
+    """
+    (question id, method, backend) triples already answered in a comparison results file.
+    Error answers do not count, so a resumed run retries them.
+    """
+    if not os.path.exists(output_file):
+        return set()
+    return {(_question_key(record), record["method"], record["backend"]) for record in iter_jsonl(output_file)
+            if not is_error_output(record.get("answer"))}
+
+def run_comparison(input_file, backends, methods=METHODS, output_file="results/comparison_results.jsonl",
+                   table_file="results/comparison_table.csv", max_tokens=200, use_cache=True, limit=None):
+    """
+    Answer every (question, method) with every backend and write the merged results.
+    :param backends: Backend specs, e.g. ["gpt2", "gemini", "echo,delay=0.05,workers=2"].
+    :param output_file: JSONL with one record per (question, method, backend); re-running resumes.
+    :param table_file: CSV with one row per (question, method) and answer/latency columns per backend.
+    :return: Per-worker statistics.
+    """
+    items = load_items(input_file, limit)
+    specs = [parse_backend(spec) for spec in backends]
+    labels = [spec[0] for spec in specs]
+    if len(set(labels)) != len(labels):
+        raise ValueError(f"Backend labels must be unique, got {labels} (use label=...)")
+    done = completed(output_file)
+    ids = [question_id(item["question"]) for item in items]
+    if done:
+        current = set(ids)
+        stale = sum(key not in current for key, _, _ in done)
+        print(f"⏩ Skipping {len(done) - stale} answers already in {output_file}")
+        if stale:
+            print(f"⚠️ {stale} answers in {output_file} are for questions not in {input_file}; "
+                  f"they are left out of the table")
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes, shared, expected = [], [], 0
+    for label, kind, model, options, workers in specs:
+        tasks = [(i, method, get_prompt("evaluation", method, question=item["question"]))
+                 for i, item in enumerate(items) for method in methods if (ids[i], method, label) not in done]
+        if not tasks:
+            continue
+        expected += len(tasks)
+        batch_size = int(options.get("batch_size", make_backend(kind, model, options).batch_size))
+        queues = [context.Queue() for _ in range(workers)]
+        for b, start in enumerate(range(0, len(tasks), batch_size)):
+            queues[b % workers].put(tasks[start:start + batch_size])  # Deal batches round-robin
+        remaining, lock = context.Value("i", len(tasks), lock=False), context.Lock()
+        shared.append((queues, remaining, lock))  # Keep the semaphores alive until the workers have started
+        for own in range(workers):
+            process = context.Process(target=_worker, daemon=True, args=(
+                label, kind, model, options, queues, own, remaining, lock, results, max_tokens, use_cache))
+            process.start()
+            processes.append(process)
+        print(f"🚀 {label}: {len(tasks)} prompts, {workers} worker(s), batch size {batch_size}")
+
+    stats, received, failed = {}, 0, 0
+    start = time.perf_counter()
+    with ResultWriter(output_file) as writer:
+        finished = False
+        while True:
+            try:
+                message, name, payload = results.get(timeout=0.1)
+            except queue.Empty:
+                if finished:
+                    break
+                # One more pass after the last worker exits, for messages still in the pipe
+                finished = all(not process.is_alive() for process in processes)
+                continue
+            label = name.rsplit("#", 1)[0]
+            if message == "ready":
+                print(f"✅ {name} loaded {payload['model']} in {payload['load_s']:.1f} s")
+            elif message == "failed":
+                print(f"❌ {name} could not load: {payload}")
+            elif message == "done":
+                stats[name] = payload
+            elif message == "answers":
+                for index, method, answer, latency, model_id in payload:
+                    item = items[index]
+                    writer.write({"index": index, "question_id": ids[index], "question": item["question"],
+                                  "ground_truth": item["answer"], "method": method, "backend": label,
+                                  "model": model_id, "answer": answer, "latency_s": latency})
+                    failed += is_error_output(answer)
+                received += len(payload)
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    if received < expected or failed:
+        print(f"⚠️ {expected - received} prompts were not answered and {failed} failed; run again to retry them")
+    for name, worker_stats in sorted(stats.items()):
+        print(f"📊 {name}: {worker_stats['prompts']} prompts ({worker_stats['cached']} cached), "
+              f"{worker_stats['stolen']}/{worker_stats['batches']} batches stolen, busy {worker_stats['busy_s']:.1f} s")
+    print(f"⏱️ {received} answers in {elapsed:.1f} s")
+
+    write_table(output_file, table_file, labels, items)
+    return stats
+
+def aligned_rows(output_file, labels=None, items=None):
+    """
+    One row per (question, method) with `answer_<backend>` and `latency_<backend>` columns.
+    Records are matched by question, and a later record (a retried answer) replaces an earlier one.
+    :param items: Questions of the current input file; answers to other questions are left out,
+                  and rows are numbered by position in `items`.
+    """
+    positions = {question_id(item["question"]): i for i, item in enumerate(items)} if items is not None else None
+    rows, seen = {}, []
+    for record in iter_jsonl(output_file):
+        qid = _question_key(record)
+        if positions is not None and qid not in positions:
+            continue
+        index = positions[qid] if positions is not None else record["index"]
+        row = rows.setdefault((qid, record["method"]), {"index": index, "method": record["method"],
+                                                        "question": record["question"],
+                                                        "ground_truth": record["ground_truth"]})
+        row[f"answer_{record['backend']}"] = record["answer"]
+        row[f"latency_{record['backend']}"] = record.get("latency_s")
+        if record["backend"] not in seen:
+            seen.append(record["backend"])
+    labels = labels or seen
+    methods = {method: i for i, method in enumerate(METHODS)}
+    ordered = sorted(rows.values(), key=lambda row: (row["index"], methods.get(row["method"], len(methods))))
+    return ordered, labels
+
+def write_table(output_file, table_file, labels=None, items=None):
+    """Write the aligned comparison table as CSV (restricted to `items` when given)."""
+    rows, labels = aligned_rows(output_file, labels, items)
+    fields = ["index", "method", "question", "ground_truth"]
+    fields += [f"answer_{label}" for label in labels] + [f"latency_{label}" for label in labels]
+    directory = os.path.dirname(table_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(table_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore", lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"✅ Saved comparison table to {table_file} ({len(rows)} rows x {len(labels)} backends)")
+    return rows
+
+def analyze_backends(output_file, labels=None, items=None):
+    """Score each backend's answers with analyze_results (standard vs CoT accuracy per backend)."""
+    from analyze_results import analyze_results
+
+    rows, labels = aligned_rows(output_file, labels, items)
+    accuracy = {}
+    for label in labels:
+        print(f"\n🔎 {label}")
+        records = ({"index": row["index"], "method": row["method"], "ground_truth": row["ground_truth"],
+                    "answer": row[f"answer_{label}"]} for row in rows if f"answer_{label}" in row)
+        accuracy[label] = analyze_results(records)
+    return accuracy
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare several models on the same question set.")
+    parser.add_argument("--input_file", default="db/questions/cot_questions_clean.json", help="JSON/JSONL question file")
+    parser.add_argument("--backends", nargs="+", default=["gpt2", "gemini"],
+                        help='Backend specs, e.g. gpt2 "hf:distilgpt2,precision=int8-dynamic" llama gemini "echo,delay=0.05"')
+    parser.add_argument("--methods", nargs="+", default=list(METHODS), choices=METHODS)
+    parser.add_argument("--output_file", default="results/comparison_results.jsonl",
+                        help="JSONL results file (re-running resumes where it stopped)")
+    parser.add_argument("--table_file", default="results/comparison_table.csv", help="Aligned CSV table")
+    parser.add_argument("--max_tokens", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N questions")
+    parser.add_argument("--no_cache", action="store_true", help="Bypass the generation cache")
+    parser.add_argument("--analyze", action="store_true", help="Score every backend after the run")
+    args = parser.parse_args()
+
+    run_comparison(args.input_file, args.backends, args.methods, args.output_file, args.table_file,
+                   args.max_tokens, not args.no_cache, args.limit)
+    if args.analyze:
+        analyze_backends(args.output_file, [parse_backend(spec)[0] for spec in args.backends],
+                         load_items(args.input_file, args.limit))
@@ -3,91 +3,364 @@ Model manager for LLaMA 3 - 70B and Gemini 1.5 Flash.
 """
 
 import os
-import torch
+import time
+import asyncio
 import gc
-from transformers import AutoTokenizer, AutoModelForCausalLM
-import google.generativeai as genai
+import threading
+from collections import OrderedDict
 from tenacity import retry, stop_after_attempt, wait_exponential
+from generation_cache import cached_generate
+from telemetry import track, current_span, first_token_streamer
+from streaming import AsyncTextStream, StreamStats, TextStream, hf_stream, make_condition
 
 # Load environment variables
 from dotenv import load_dotenv
 load_dotenv()
 
-# Configure API keys
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
 # Paths for LLaMA 3 - 70B
 llama_model_path = os.getenv("LLAMA_MODEL_PATH")
 llama_tokenizer_path = os.getenv("LLAMA_TOKENIZER_PATH")
 
-print(f"LLAMA_MODEL_PATH: {llama_model_path}")
-print(f"LLAMA_TOKENIZER_PATH: {llama_tokenizer_path}")
+# Optional draft model for speculative decoding (must share the LLaMA tokenizer)
+llama_draft_model_path = os.getenv("LLAMA_DRAFT_MODEL_PATH")
+SPECULATIVE_K = int(os.getenv("SPECULATIVE_K", 4))  # draft tokens verified per target pass
+
+# Resident inference server (inference_server.py); when set, LLaMA requests go to it instead of a model loaded here
+INFERENCE_SERVER_URL = os.getenv("INFERENCE_SERVER_URL")
+LLAMA_SERVER_MODEL = os.getenv("LLAMA_SERVER_MODEL", "llama")  # name given to `serve --model NAME=PATH`
 
 # GPU memory configuration
 SYSTEM_RESERVE = 2.5  # GB reserved for system
 MAX_GPU_MEMORY = 47.5  # GB maximum GPU memory for the model
+MAX_CPU_MEMORY = float(os.getenv("MAX_CPU_MEMORY", 64))  # GB maximum CPU RAM for resident models
+
+GIB = 1024 ** 3
+
+# Gemini REST endpoint and rate limits used by the async client
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", 15))  # requests per minute
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", 1_000_000))  # tokens per minute
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", 8))
+
+# torch, transformers and google.generativeai are imported on first use so
+# that importing this module (e.g. from the CLI) stays cheap
+_genai = None
+
+def get_genai():
+    """Import google.generativeai and configure the API key on first use."""
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        _genai = genai
+    return _genai
 
 def clear_memory():
     """Free GPU and CPU memory."""
+    import torch
     torch.cuda.empty_cache()
     gc.collect()
     print("🧹 Memory cache cleared")
 
-def load_llama_model():
+def model_memory_footprint(model):
+    """
+    Estimate how many bytes a loaded model occupies on GPU and on CPU.
+    :param model: A torch module, or any other handle (counted as zero bytes).
+    :return: Dict with "gpu" and "cpu" byte counts.
+    """
+    footprint = {"gpu": 0, "cpu": 0}
+    import torch
+    if not isinstance(model, torch.nn.Module):
+        return footprint
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        device = "gpu" if tensor.device.type == "cuda" else "cpu"
+        footprint[device] += tensor.numel() * tensor.element_size()
+    return footprint
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models, evicted least-recently-used first
+    whenever the resident models exceed the GPU or CPU memory budget.
+    """
+
+    def __init__(self, max_gpu_memory=None, max_cpu_memory=None):
+        """
+        :param max_gpu_memory: GPU budget in GB (default: MAX_GPU_MEMORY per visible GPU).
+        :param max_cpu_memory: CPU RAM budget in GB (default: MAX_CPU_MEMORY - SYSTEM_RESERVE).
+        """
+        if max_cpu_memory is None:
+            max_cpu_memory = MAX_CPU_MEMORY - SYSTEM_RESERVE
+        # The GPU budget needs torch, so the default is resolved on first load
+        self._max_gpu_bytes = None if max_gpu_memory is None else max_gpu_memory * GIB
+        self.max_cpu_bytes = max_cpu_memory * GIB
+        self._entries = OrderedDict()  # key -> (handles, footprint)
+        self._lock = threading.RLock()
+
+    @property
+    def max_gpu_bytes(self):
+        if self._max_gpu_bytes is None:
+            import torch
+            self._max_gpu_bytes = MAX_GPU_MEMORY * torch.cuda.device_count() * GIB
+        return self._max_gpu_bytes
+
+    def get(self, key, loader):
+        """
+        Return the handles cached under `key`, calling `loader()` on a miss.
+        :param key: Hashable key, e.g. (backend, path, dtype, device_map).
+        :param loader: Zero-argument callable returning the handles to cache.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+
+            handles = loader()
+            footprint = {"gpu": 0, "cpu": 0}
+            items = handles if isinstance(handles, tuple) else (handles,)
+            for item in items:
+                for device, size in model_memory_footprint(item).items():
+                    footprint[device] += size
+            self._entries[key] = (handles, footprint)
+            self._evict(keep=key)
+            return handles
+
+    def evict(self, key):
+        """Drop a single cached entry, if present."""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                clear_memory()
+
+    def clear(self):
+        """Drop every cached entry."""
+        with self._lock:
+            self._entries.clear()
+            clear_memory()
+
+    def usage(self):
+        """Return the bytes currently held on GPU and CPU by resident models."""
+        with self._lock:
+            usage = {"gpu": 0, "cpu": 0}
+            for _, footprint in self._entries.values():
+                for device, size in footprint.items():
+                    usage[device] += size
+            return usage
+
+    def _evict(self, keep):
+        evicted = False
+        while len(self._entries) > 1:
+            usage = self.usage()
+            if usage["gpu"] <= self.max_gpu_bytes and usage["cpu"] <= self.max_cpu_bytes:
+                break
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            print(f"♻️ Evicting model from cache: {oldest}")
+            del self._entries[oldest]
+            evicted = True
+        if evicted:
+            clear_memory()
+
+# Shared by every backend in this process
+model_registry = ModelRegistry()
+
+def load_llama_model(model_path=None, tokenizer_path=None, torch_dtype="bfloat16", device_map="auto"):
+    """
+    Return the LLaMA 3 - 70B tokenizer and model, loading them on first use.
+    :param torch_dtype: torch dtype or its name (e.g. "bfloat16", "float32").
+    """
+    model_path = model_path or llama_model_path
+    tokenizer_path = tokenizer_path or llama_tokenizer_path
+    dtype_name = str(torch_dtype).replace("torch.", "")
+    key = ("llama", model_path, tokenizer_path, dtype_name, str(device_map))
+    return model_registry.get(
+        key, lambda: _load_llama_model(model_path, tokenizer_path, torch_dtype, device_map)
+    )
+
+def _load_llama_model(model_path, tokenizer_path, torch_dtype, device_map):
     """Load the LLaMA 3 - 70B model."""
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
     print("⏳ Loading LLaMA 3 - 70B model...")
+    print(f"LLAMA_MODEL_PATH: {model_path}")
+    print(f"LLAMA_TOKENIZER_PATH: {tokenizer_path}")
     clear_memory()
+    if isinstance(torch_dtype, str):
+        torch_dtype = getattr(torch, torch_dtype)
 
     tokenizer = AutoTokenizer.from_pretrained(
-        llama_tokenizer_path,
+        tokenizer_path,
         use_fast=True,
         trust_remote_code=True
     )
     model = AutoModelForCausalLM.from_pretrained(
-        llama_model_path,
-        device_map="auto",
-        torch_dtype=torch.bfloat16,
+        model_path,
+        device_map=device_map,
+        torch_dtype=torch_dtype,
         trust_remote_code=True,
         max_memory={f"cuda:{i}": f"{int(MAX_GPU_MEMORY)}GiB" for i in range(torch.cuda.device_count())}
     )
     print("✅ LLaMA 3 - 70B model loaded")
     return tokenizer, model
 
-def load_gemini_model():
-    """Load the Gemini 1.5 Flash model."""
-    print("⏳ Loading Gemini 1.5 Flash model...")
+def load_gemini_model(model_name="gemini-1.5-flash"):
+    """Return the Gemini 1.5 Flash model, creating it on first use."""
     try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        print("✅ Gemini 1.5 Flash model loaded")
-        return model
+        return model_registry.get(("gemini", model_name), lambda: _load_gemini_model(model_name))
     except Exception as e:
         print(f"❌ Error loading Gemini model: {e}")
         return None
 
-@retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=2, min=4, max=60))
-def generate_with_llama(prompt, max_tokens=1024, temperature=0.7):
-    """Generate text using the LLaMA 3 - 70B model."""
+def _load_gemini_model(model_name):
+    """Load the Gemini 1.5 Flash model."""
+    print("⏳ Loading Gemini 1.5 Flash model...")
+    model = get_genai().GenerativeModel(model_name)
+    print("✅ Gemini 1.5 Flash model loaded")
+    return model
+
+def load_draft_model(draft_model_path, device=None, torch_dtype="bfloat16"):
+    """
+    Return the tokenizer and model of a small draft model for speculative decoding, loading them on first use.
+    :param device: Device to place the draft on (normally the target model's first device).
+    """
+    dtype_name = str(torch_dtype).replace("torch.", "")
+    key = ("draft", draft_model_path, dtype_name, str(device))
+    return model_registry.get(key, lambda: _load_draft_model(draft_model_path, device, dtype_name))
+
+def _load_draft_model(draft_model_path, device, dtype_name):
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
+    print(f"⏳ Loading draft model {draft_model_path}...")
+    tokenizer = AutoTokenizer.from_pretrained(draft_model_path, use_fast=True)
+    model = AutoModelForCausalLM.from_pretrained(draft_model_path, torch_dtype=getattr(torch, dtype_name))
+    if device is not None:
+        model = model.to(device)
+    print("✅ Draft model loaded")
+    return tokenizer, model.eval()
+
+def generate_with_llama(prompt, max_tokens=1024, temperature=0.7, draft_model_path=None, k=None):
+    """
+    Generate text using the LLaMA 3 - 70B model.
+    :param draft_model_path: Draft model for speculative decoding (default: LLAMA_DRAFT_MODEL_PATH; unset = off).
+    :param k: Draft tokens proposed per target pass (default: SPECULATIVE_K).
+    """
     tokenizer, model = load_llama_model()
+    draft_model_path = draft_model_path or llama_draft_model_path
+    if draft_model_path:
+        draft_tokenizer, draft_model = load_draft_model(draft_model_path, model.device, model.dtype)
+        with track("llama-speculative", model_identifier("llama"), max_tokens=max_tokens):
+            return _generate_speculative(tokenizer, model, draft_tokenizer, draft_model, prompt, max_tokens,
+                                         temperature, k or SPECULATIVE_K)
+    with track("llama", model_identifier("llama"), max_tokens=max_tokens):
+        return _generate_with_llama(tokenizer, model, prompt, max_tokens, temperature)
+
+def prompt_token_ids(tokenizer, model, prompt, max_tokens):
+    """
+    Tokenize `prompt` and fit prompt + new tokens into the context window.
+    A prompt that fits keeps every token and `max_tokens` is lowered instead; only a prompt over its
+    share of the window (see prompt_compiler.prompt_budget) loses its middle, not its end (where the
+    question usually is).
+    :return: (token ids, max_new_tokens)
+    """
+    from prompt_compiler import context_window, get_compiler, prompt_budget
+
+    window = context_window(model, tokenizer)
+    budget = prompt_budget(window, max_tokens)
+    compiler = get_compiler(tokenizer)
+    ids = compiler.tokenize(prompt)
+    if budget is not None and len(ids) > budget:
+        print(f"⚠️ Prompt of {len(ids)} tokens trimmed to {budget} to fit the context window of {window}")
+        ids = compiler.render_text(prompt, budget)
+    if window and len(ids) + max_tokens > window:
+        print(f"⚠️ max_tokens lowered from {max_tokens} to {window - len(ids)} to fit the context window of {window}")
+        max_tokens = window - len(ids)
+    return ids, max_tokens
 
-    inputs = tokenizer(prompt, return_tensors="pt", padding=True, truncation=True).to(model.device)
+# Retries only repeat generation; the model stays resident in the registry
+@retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=2, min=4, max=60))
+def _generate_with_llama(tokenizer, model, prompt, max_tokens, temperature):
+    import torch
+    span = current_span()
+    span.attempt()
+    ids, max_tokens = prompt_token_ids(tokenizer, model, prompt, max_tokens)
+    input_ids = torch.tensor([ids], device=model.device)
     with torch.no_grad():
         outputs = model.generate(
-            inputs["input_ids"],
+            input_ids,
             max_new_tokens=max_tokens,
             temperature=temperature,
             do_sample=True,
-            pad_token_id=tokenizer.eos_token_id
+            pad_token_id=tokenizer.eos_token_id,
+            streamer=first_token_streamer(span)
         )
+    prompt_tokens = input_ids.shape[1]
+    span.update(prompt_tokens=prompt_tokens, completion_tokens=outputs.shape[1] - prompt_tokens)
     response = tokenizer.decode(outputs[0], skip_special_tokens=True)
     return response.strip()
 
 @retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=2, min=4, max=60))
+def _generate_speculative(tokenizer, model, draft_tokenizer, draft_model, prompt, max_tokens, temperature, k):
+    from speculative_decoding import check_vocab_compatible, speculative_generate
+
+    span = current_span()
+    span.attempt()
+    check_vocab_compatible(tokenizer, draft_tokenizer)
+    input_ids, max_tokens = prompt_token_ids(tokenizer, model, prompt, max_tokens)
+    generated, stats = speculative_generate(
+        model, draft_model, input_ids, max_new_tokens=max_tokens, k=k, eos_token_id=tokenizer.eos_token_id,
+        do_sample=temperature > 0, temperature=temperature
+    )
+    span.update(prompt_tokens=len(input_ids), completion_tokens=len(generated),
+                acceptance_rate=stats["acceptance_rate"])
+    print(f"⚡ Speculative decoding: {stats['acceptance_rate']:.0%} of draft tokens accepted, "
+          f"{stats['tokens_per_target_pass']:.2f} tokens/target pass, {stats['tokens_per_sec']:.1f} tokens/s")
+    response = tokenizer.decode(input_ids + generated, skip_special_tokens=True)
+    return response.strip()
+
+def stream_with_llama(prompt, max_tokens=1024, temperature=0.7, stop=None, stop_predicate=None):
+    """
+    Stream LLaMA 3 - 70B output as text deltas, halting generation at a stop sequence or predicate.
+    Streaming always decodes with the target model alone (no speculative draft).
+    :return: TextStream of the completion (without the prompt); see streaming.py.
+    """
+    tokenizer, model = load_llama_model()
+    span = track("llama-stream", model_identifier("llama"), max_tokens=max_tokens)
+    span.attempt()
+    input_ids, max_tokens = prompt_token_ids(tokenizer, model, prompt, max_tokens)
+    span.update(prompt_tokens=len(input_ids))
+    return hf_stream(model, tokenizer, input_ids, max_tokens, make_condition(stop, stop_predicate), span,
+                     temperature=temperature, do_sample=True, pad_token_id=tokenizer.eos_token_id)
+
+def generate_with_server(prompt, max_tokens=1024, temperature=0.7, stop=None, stop_predicate=None, server_url=None,
+                         model=LLAMA_SERVER_MODEL):
+    """
+    Generate with a model resident in the inference server, batched with the requests of other clients.
+    :return: Prompt plus completion, like generate_with_llama.
+    """
+    from inference_server import InferenceClient
+
+    client = InferenceClient(server_url)
+    with track("llama-server", f"{model}@{client.url}", max_tokens=max_tokens) as span:
+        span.attempt()
+        result = client.generate(prompt, model, max_tokens, temperature=temperature, stop=stop,
+                                 stop_predicate=stop_predicate)
+        span.update(prompt_tokens=result["prompt_tokens"], completion_tokens=result["completion_tokens"],
+                    queue_s=result["queue_s"], batch_rows=result["batch_rows"])
+    return (prompt + result["text"]).strip()
+
 def generate_with_gemini(prompt, max_tokens=1024, temperature=0.7):
     """Generate text using the Gemini 1.5 Flash model."""
     model = load_gemini_model()
     if not model:
         return "[Error: Gemini model could not be loaded]"
+    with track("gemini", model_identifier("gemini"), max_tokens=max_tokens):
+        return _generate_with_gemini(model, prompt, max_tokens, temperature)
 
+@retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=2, min=4, max=60))
+def _generate_with_gemini(model, prompt, max_tokens, temperature):
+    span = current_span()
+    span.attempt()
     try:
         response = model.generate_content(
             prompt,
@@ -96,19 +369,369 @@ def generate_with_gemini(prompt, max_tokens=1024, temperature=0.7):
                 "temperature": temperature
             }
         )
-        return response.text.strip()
+        text = response.text.strip()
+        if span:
+            usage = getattr(response, "usage_metadata", None)
+            span.update(prompt_tokens=getattr(usage, "prompt_token_count", None),
+                        completion_tokens=getattr(usage, "candidates_token_count", None))
+        return text
     except Exception as e:
         print(f"❌ Error generating with Gemini: {e}")
+        span.update(error=str(e))
         return f"[Error: {e}]"
 
-def generate_text(prompt, model_type="llama", max_tokens=1024, temperature=0.7):
-    """Generate text using the specified model."""
-    if model_type.lower() == "llama":
-        return generate_with_llama(prompt, max_tokens, temperature)
-    elif model_type.lower() == "gemini":
-        return generate_with_gemini(prompt, max_tokens, temperature)
-    else:
+def stream_with_gemini(prompt, max_tokens=1024, temperature=0.7, stop=None, stop_predicate=None):
+    """
+    Stream Gemini 1.5 Flash output as text deltas; the response is closed once a stop condition is met.
+    Tokens saved by an early stop are estimated from the text (the API reports usage only at the end).
+    :return: TextStream of the completion; see streaming.py.
+    """
+    model = load_gemini_model()
+    if not model:
+        raise RuntimeError("Gemini model could not be loaded")
+    span = track("gemini-stream", model_identifier("gemini"), max_tokens=max_tokens).start()
+    span.attempt()
+    stats = StreamStats(max_tokens)
+    usage = {}
+
+    def chunks():
+        response = model.generate_content(
+            prompt,
+            generation_config={"max_output_tokens": max_tokens, "temperature": temperature},
+            stream=True
+        )
+        for chunk in response:
+            metadata = getattr(chunk, "usage_metadata", None)
+            if getattr(metadata, "candidates_token_count", None):
+                usage["completion"] = metadata.candidates_token_count
+                span.update(prompt_tokens=metadata.prompt_token_count)
+            yield "".join(getattr(part, "text", "") for candidate in chunk.candidates
+                          for part in candidate.content.parts)
+
+    def tokens(text):
+        return usage.get("completion") or estimate_tokens(text, 0)
+
+    return TextStream(chunks(), make_condition(stop, stop_predicate), stats, span, tokens=tokens)
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delay-seconds or an HTTP date); None if missing or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from datetime import datetime, timezone
+    from email.utils import parsedate_to_datetime
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously at `rate_per_minute`.
+    The rate can be lowered on 429 responses and recovers slowly on success.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.max_rate = rate_per_minute
+        self.rate = rate_per_minute
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate / 60)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        """Wait until `amount` tokens are available and take them."""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self.blocked_until - time.monotonic()
+                if wait <= 0 and self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                if wait <= 0:
+                    wait = (amount - self.tokens) * 60 / self.rate
+                await asyncio.sleep(wait)
+
+    def adjust(self, amount):
+        """Return (negative) or charge (positive) tokens after the real cost is known."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+    def throttle(self, retry_after=None):
+        """Halve the refill rate and pause the bucket after a 429 response."""
+        self.rate = max(self.max_rate / 16, self.rate / 2)
+        self.tokens = 0
+        self.updated = time.monotonic()
+        pause = retry_after if retry_after is not None else 60 / self.rate
+        self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+
+    def recover(self):
+        """Additively raise the refill rate back towards its configured maximum."""
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 16)
+
+class GeminiRateLimiter:
+    """Requests-per-minute and tokens-per-minute limits shared by concurrent calls."""
+
+    def __init__(self, rpm=GEMINI_RPM, tpm=GEMINI_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    async def acquire(self, estimated_tokens):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimated_tokens)
+
+    def record(self, estimated_tokens, used_tokens):
+        self.tokens.adjust(used_tokens - estimated_tokens)
+        self.requests.recover()
+        self.tokens.recover()
+
+    def throttle(self, retry_after=None):
+        self.requests.throttle(retry_after)
+        self.tokens.throttle(retry_after)
+
+def estimate_tokens(prompt, max_tokens):
+    """Rough token cost of a request (about 4 characters per token) for the TPM bucket."""
+    return len(prompt) // 4 + max_tokens
+
+async def agenerate_with_gemini(prompt, max_tokens=1024, temperature=0.7, session=None,
+                                limiter=None, model_name="gemini-1.5-flash", base_url=None,
+                                max_retries=5):
+    """
+    Generate text with Gemini 1.5 Flash through its REST API without blocking the event loop.
+    :param session: Shared aiohttp.ClientSession (a temporary one is created if omitted).
+    :param limiter: Shared GeminiRateLimiter; 429 responses throttle it for every caller.
+    :param base_url: API root, e.g. a local stub server (default: GEMINI_API_BASE).
+    :return: The generated text, or an "[Error: ...]" string like generate_with_gemini.
+    """
+    import aiohttp
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await agenerate_with_gemini(prompt, max_tokens, temperature, session,
+                                               limiter, model_name, base_url, max_retries)
+
+    limiter = limiter or GeminiRateLimiter()
+    url = f"{(base_url or GEMINI_API_BASE).rstrip('/')}/v1beta/models/{model_name}:generateContent"
+    payload = {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": {"maxOutputTokens": max_tokens, "temperature": temperature},
+    }
+    estimated = estimate_tokens(prompt, max_tokens)
+
+    with track("gemini-async", model_name, max_tokens=max_tokens) as span:
+        for attempt in range(max_retries):
+            span.attempt()
+            await limiter.acquire(estimated)
+            try:
+                async with session.post(url, json=payload, params={"key": os.getenv("GEMINI_API_KEY") or ""}) as resp:
+                    if resp.status == 429 or resp.status >= 500:
+                        if resp.status == 429:
+                            limiter.throttle(parse_retry_after(resp.headers.get("Retry-After")))
+                        else:
+                            await asyncio.sleep(min(60, 2 ** attempt))
+                        continue
+                    body = await resp.json()
+                    if resp.status != 200:
+                        message = body.get("error", {}).get("message", resp.reason)
+                        span.update(error=message)
+                        return f"[Error: {message}]"
+            except aiohttp.ClientError as e:
+                print(f"❌ Error generating with Gemini: {e}")
+                await asyncio.sleep(min(60, 2 ** attempt))
+                continue
+
+            usage = body.get("usageMetadata", {})
+            used = usage.get("totalTokenCount", estimated)
+            limiter.record(estimated, used)
+            span.update(prompt_tokens=usage.get("promptTokenCount"), completion_tokens=usage.get("candidatesTokenCount"))
+            try:
+                parts = body["candidates"][0]["content"]["parts"]
+                return "".join(part.get("text", "") for part in parts).strip()
+            except (KeyError, IndexError) as e:
+                span.update(error=f"unexpected response ({e})")
+                return f"[Error: unexpected Gemini response ({e})]"
+
+        span.update(error="failed after retries")
+        return "[Error: Gemini request failed after retries]"
+
+def astream_with_gemini(prompt, max_tokens=1024, temperature=0.7, stop=None, stop_predicate=None, session=None,
+                        limiter=None, model_name="gemini-1.5-flash", base_url=None, max_retries=5):
+    """
+    Stream Gemini output over the REST API (server-sent events) without blocking the event loop.
+    Rate-limit and server errors are retried only before the first chunk arrives.
+    :return: AsyncTextStream of the completion; use `async for delta in stream` (see streaming.py).
+    """
+    import json
+    import aiohttp
+
+    limiter = limiter or GeminiRateLimiter()
+    url = f"{(base_url or GEMINI_API_BASE).rstrip('/')}/v1beta/models/{model_name}:streamGenerateContent"
+    payload = {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": {"maxOutputTokens": max_tokens, "temperature": temperature},
+    }
+    estimated = estimate_tokens(prompt, max_tokens)
+    span = track("gemini-async-stream", model_name, max_tokens=max_tokens).start()
+    stats = StreamStats(max_tokens)
+    usage = {}
+
+    async def chunks():
+        own_session = session is None
+        client = aiohttp.ClientSession() if own_session else session
+        try:
+            for attempt in range(max_retries):
+                span.attempt()
+                await limiter.acquire(estimated)
+                try:
+                    async with client.post(url, json=payload,
+                                           params={"alt": "sse", "key": os.getenv("GEMINI_API_KEY") or ""}) as resp:
+                        if resp.status == 429 or resp.status >= 500:
+                            if resp.status == 429:
+                                limiter.throttle(parse_retry_after(resp.headers.get("Retry-After")))
+                            else:
+                                await asyncio.sleep(min(60, 2 ** attempt))
+                            continue
+                        if resp.status != 200:
+                            body = await resp.json()
+                            raise RuntimeError(body.get("error", {}).get("message", resp.reason))
+                        async for line in resp.content:
+                            if not line.startswith(b"data:"):
+                                continue
+                            event = json.loads(line[5:])
+                            if event.get("usageMetadata", {}).get("candidatesTokenCount"):
+                                usage.update(event["usageMetadata"])
+                            for candidate in event.get("candidates", [])[:1]:
+                                text = "".join(part.get("text", "") for part in candidate.get("content", {}).get("parts", []))
+                                usage["chars"] = usage.get("chars", 0) + len(text)
+                                yield text
+                        return
+                except aiohttp.ClientError as e:
+                    if stats.ttft is not None:
+                        raise
+                    print(f"❌ Error streaming with Gemini: {e}")
+                    await asyncio.sleep(min(60, 2 ** attempt))
+            raise RuntimeError("Gemini request failed after retries")
+        finally:
+            # A stream closed early has no usage metadata: charge the estimated tokens actually received
+            limiter.record(estimated, usage.get("totalTokenCount") or estimate_tokens(prompt, usage.get("chars", 0) // 4))
+            span.update(prompt_tokens=usage.get("promptTokenCount"))
+            if own_session:
+                await client.close()
+
+    def tokens(text):
+        return usage.get("candidatesTokenCount") or estimate_tokens(text, 0)
+
+    return AsyncTextStream(chunks(), make_condition(stop, stop_predicate), stats, span, tokens=tokens)
+
+async def agenerate_batch(prompts, max_tokens=1024, temperature=0.7,
+                          max_concurrency=GEMINI_MAX_CONCURRENCY, rpm=GEMINI_RPM, tpm=GEMINI_TPM,
+                          model_name="gemini-1.5-flash", base_url=None):
+    """
+    Generate Gemini answers for many prompts concurrently.
+    At most `max_concurrency` requests are in flight, all sharing one RPM/TPM limiter.
+    :return: Answers in the same order as `prompts`.
+    """
+    import aiohttp
+    limiter = GeminiRateLimiter(rpm=rpm, tpm=tpm)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    connector = aiohttp.TCPConnector(limit=max_concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def run(prompt):
+            async with semaphore:
+                return await agenerate_with_gemini(prompt, max_tokens, temperature, session,
+                                                   limiter, model_name, base_url)
+
+        return await asyncio.gather(*(run(prompt) for prompt in prompts))
+
+def model_identifier(model_type):
+    """Identify the model (and, for local checkpoints, its revision) for the generation cache."""
+    if model_type == "llama":
+        config_file = os.path.join(llama_model_path or "", "config.json")
+        if os.path.exists(config_file):
+            return f"{llama_model_path}@{os.path.getmtime(config_file):.0f}"
+        return llama_model_path
+    return "gemini-1.5-flash"
+
+def stream_text(prompt, model_type="llama", max_tokens=1024, temperature=0.7, stop=None, stop_predicate=None,
+                seed=None):
+    """
+    Stream text from the specified model as deltas, stopping early at `stop` sequences or `stop_predicate`.
+    :param stop_predicate: e.g. streaming.final_answer to end a CoT answer after its "Final answer:" line.
+    :return: TextStream; `stream.stats` holds the time to first token and the tokens saved.
+    """
+    model_type = model_type.lower()
+    if model_type == "llama":
+        if seed is not None:
+            import torch
+            torch.manual_seed(seed)
+        return stream_with_llama(prompt, max_tokens, temperature, stop, stop_predicate)
+    if model_type == "gemini":
+        return stream_with_gemini(prompt, max_tokens, temperature, stop, stop_predicate)
+    raise ValueError("Unsupported model type. Use 'llama' or 'gemini'")
+
+def generate_text(prompt, model_type="llama", max_tokens=1024, temperature=0.7, seed=None,
+                  use_cache=True, refresh_cache=False, stop=None, stop_predicate=None, server_url=None):
+    """
+    Generate text using the specified model.
+    Outputs are served from the on-disk generation cache when the same request was seen before;
+    `use_cache=False` bypasses it and `refresh_cache=True` regenerates and overwrites the entry.
+    With `stop` sequences or a `stop_predicate`, the output is streamed and generation ends as soon as they match.
+    With `server_url` (default: INFERENCE_SERVER_URL), LLaMA requests are sent to the resident inference server.
+    """
+    model_type = model_type.lower()
+    condition = make_condition(stop, stop_predicate)
+    server_url = server_url or INFERENCE_SERVER_URL
+    if model_type not in ("llama", "gemini"):
         return "[Error: Unsupported model type. Use 'llama' or 'gemini']"
+    if model_type == "llama" and server_url:
+        def generate():
+            try:
+                return generate_with_server(prompt, max_tokens, temperature, condition.stop,
+                                            condition.predicate, server_url)
+            except Exception as e:
+                print(f"❌ Error with the inference server at {server_url}: {e}")
+                return f"[Error: {e}]"
+        # Requests in a shared batch are not seeded, so `seed` only keys the cache
+        return cached_generate(generate, "server", f"{LLAMA_SERVER_MODEL}@{server_url}", prompt, max_tokens,
+                               temperature, seed, use_cache=use_cache, refresh=refresh_cache,
+                               **condition.cache_params())
+    if condition:
+        def generate():
+            try:
+                with stream_text(prompt, model_type, max_tokens, temperature, condition, seed=seed) as stream:
+                    text = stream.read()
+            except Exception as e:
+                print(f"❌ Error streaming with {model_type}: {e}")
+                return f"[Error: {e}]"
+            print(f"✂️ Stopped after {stream.stats.tokens} tokens ({stream.stats.stop_reason}), "
+                  f"{stream.stats.tokens_saved} saved")
+            # Same shape as the non-streaming output: LLaMA echoes the prompt, Gemini does not
+            return (prompt + text).strip() if model_type == "llama" else text.strip()
+    elif model_type == "llama":
+        def generate():
+            if seed is not None:
+                import torch
+                torch.manual_seed(seed)
+            return generate_with_llama(prompt, max_tokens, temperature)
+    else:
+        def generate():
+            return generate_with_gemini(prompt, max_tokens, temperature)
+
+    return cached_generate(generate, model_type, model_identifier(model_type), prompt, max_tokens,
+                           temperature, seed, use_cache=use_cache, refresh=refresh_cache, **condition.cache_params())
 
 if __name__ == "__main__":
     # Example usage
@@ -0,0 +1,169 @@
+"""
+Reuse of the attention cache (past_key_values) for fixed prompt prefixes.
+
+Prompt templates put the same instruction text in front of every question
+("Answer the following question concisely:", the templates in prompts.py).
+PrefixCache runs the model over each prefix once and starts every later
+generation from a copy of that cache, so only the question is prefilled.
+"""
+
+import copy
+import time
+import argparse
+from collections import OrderedDict
+import torch
+
+def clone_past(past_key_values):
+    """Copy a cache before reuse; tuple caches are immutable, Cache objects are extended in place."""
+    if past_key_values is None or isinstance(past_key_values, tuple):
+        return past_key_values
+    return copy.deepcopy(past_key_values)
+
+def _next_token(logits, do_sample, temperature, top_k):
+    if not do_sample:
+        return logits.argmax(dim=-1, keepdim=True)
+    logits = logits / max(temperature, 1e-5)
+    if top_k:
+        kth = torch.topk(logits, min(top_k, logits.shape[-1])).values[..., -1, None]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+    return torch.multinomial(torch.softmax(logits, dim=-1), num_samples=1)
+
+@torch.no_grad()
+def decode(model, input_ids, past_key_values=None, past_length=0, max_new_tokens=32,
+           eos_token_id=None, do_sample=False, temperature=1.0, top_k=50):
+    """
+    Prefill `input_ids` on top of an optional cache, then decode token by token.
+    :param past_key_values: Cache covering the first `past_length` tokens of the prompt.
+    :return: (generated token ids as a list, prefill time in seconds).
+    """
+    attention_mask = torch.ones(1, past_length + input_ids.shape[1], dtype=torch.long, device=input_ids.device)
+    start = time.perf_counter()
+    out = model(input_ids=input_ids, past_key_values=past_key_values, attention_mask=attention_mask, use_cache=True)
+    prefill_time = time.perf_counter() - start
+
+    generated = []
+    for _ in range(max_new_tokens):
+        token = _next_token(out.logits[:, -1, :], do_sample, temperature, top_k)
+        generated.append(token.item())
+        if eos_token_id is not None and generated[-1] == eos_token_id:
+            break
+        if len(generated) == max_new_tokens:
+            break  # The logits of another forward pass would never be used
+        attention_mask = torch.cat([attention_mask, attention_mask.new_ones(1, 1)], dim=1)
+        out = model(input_ids=token, past_key_values=out.past_key_values, attention_mask=attention_mask, use_cache=True)
+    return generated, prefill_time
+
+class PrefixCache:
+    """Keeps the past_key_values of recently used prompt prefixes for one model (LRU)."""
+
+    def __init__(self, model, tokenizer, max_entries=32):
+        """
+        :param model: Causal LM (HF AutoModelForCausalLM or compatible).
+        :param tokenizer: Tokenizer matching the model.
+        :param max_entries: Number of prefixes kept resident.
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # prefix text -> (token ids, past_key_values)
+
+    @torch.no_grad()
+    def get(self, prefix):
+        """Return (token ids, past_key_values) for `prefix`, computing them on first use."""
+        if prefix in self._entries:
+            self._entries.move_to_end(prefix)
+            return self._entries[prefix]
+        ids = self.tokenizer(prefix)["input_ids"]
+        input_ids = torch.tensor([ids], device=self.model.device)
+        past = self.model(input_ids=input_ids, use_cache=True).past_key_values
+        self._entries[prefix] = (ids, past)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return self._entries[prefix]
+
+    def split_ids(self, prefix, suffix):
+        """
+        Tokenize `prefix + suffix` as (cached prefix ids, suffix ids).
+        Returns None when the tokenizer merges tokens across the boundary,
+        in which case the cached prefix cannot be reused exactly.
+        """
+        prefix_ids, _ = self.get(prefix)
+        suffix_ids = self.tokenizer(suffix, add_special_tokens=False)["input_ids"]
+        if prefix_ids + suffix_ids != self.tokenizer(prefix + suffix)["input_ids"]:
+            return None
+        return prefix_ids, suffix_ids
+
+    def generate(self, prefix, suffix, max_new_tokens=32, max_length=None, **sampling):
+        """
+        Generate a continuation of `prefix + suffix`, prefilling only the suffix.
+        :param max_length: Optional total length limit (prompt + generated), like the HF pipeline.
+        :param sampling: do_sample / temperature / top_k passed to `decode`.
+        :return: (generated text, generated token ids, prefill time in seconds).
+        """
+        split = self.split_ids(prefix, suffix)
+        if split is None:
+            ids = self.tokenizer(prefix + suffix)["input_ids"]
+            input_ids, past, past_length = ids, None, 0
+        else:
+            prefix_ids, input_ids = split
+            past, past_length = clone_past(self.get(prefix)[1]), len(prefix_ids)
+            ids = prefix_ids + input_ids
+        if max_length is not None:
+            max_new_tokens = max(1, max_length - len(ids))
+
+        generated, prefill_time = decode(
+            self.model, torch.tensor([input_ids], device=self.model.device), past, past_length,
+            max_new_tokens, self.tokenizer.eos_token_id, **sampling
+        )
+        return self.tokenizer.decode(generated, skip_special_tokens=True), generated, prefill_time
+
+def benchmark_prefix_cache(model, tokenizer, prompts, max_new_tokens=32):
+    """
+    Compare cached and uncached greedy generation on (prefix, suffix) pairs.
+    :return: Dict with total prefill time of both paths, the saving and whether all outputs matched.
+    """
+    cache = PrefixCache(model, tokenizer)
+    for prefix, _ in prompts:
+        cache.get(prefix)  # Precompute every prefix once, outside the timed loop
+
+    uncached_time = cached_time = 0.0
+    mismatches = 0
+    for prefix, suffix in prompts:
+        ids = tokenizer(prefix + suffix)["input_ids"]
+        expected, prefill = decode(model, torch.tensor([ids], device=model.device),
+                                   max_new_tokens=max_new_tokens, eos_token_id=tokenizer.eos_token_id)
+        uncached_time += prefill
+        _, generated, prefill = cache.generate(prefix, suffix, max_new_tokens=max_new_tokens)
+        cached_time += prefill
+        mismatches += generated != expected
+
+    result = {
+        "prompts": len(prompts),
+        "prefill_uncached_ms": uncached_time * 1000,
+        "prefill_cached_ms": cached_time * 1000,
+        "prefill_saved_pct": (1 - cached_time / uncached_time) * 100 if uncached_time else 0.0,
+        "outputs_match": mismatches == 0,
+    }
+    print(f"⏱️ Prefill: {result['prefill_uncached_ms']:.1f} ms -> {result['prefill_cached_ms']:.1f} ms "
+          f"({result['prefill_saved_pct']:.1f}% saved), outputs match: {result['outputs_match']}")
+    return result
+
+if __name__ == "__main__":
+    import json
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from prompts import EVALUATION_PROMPTS, split_prompt
+
+    parser = argparse.ArgumentParser(description="Benchmark prefix KV-cache reuse on the question set.")
+    parser.add_argument("--model", default="gpt2", help="Model name or path")
+    parser.add_argument("--input_file", default="db/questions/cot_questions_clean.json", help="Question file")
+    parser.add_argument("--max_new_tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model).eval()
+    with open(args.input_file, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)]
+
+    prompts = [split_prompt(category, key, question=q) for q in questions
+               for category, key in [("evaluation", m) for m in EVALUATION_PROMPTS] + [("general", "question")]]
+    benchmark_prefix_cache(model, tokenizer, prompts, args.max_new_tokens)
@@ -0,0 +1,278 @@
+"""
+Token-level prompt rendering for the templates in prompts.py.
+
+Each template is split once into its literal segments and {fields}; the
+literal segments are tokenized once per tokenizer and cached. Rendering a
+prompt then only tokenizes the field values (themselves LRU-cached, so the
+same question rendered for "standard" and "cot" is tokenized once) and
+concatenates token ids. Batches are rendered straight to padded tensors.
+
+A token budget is enforced by trimming the variable fields, never the
+template text: {context}/{input_text} lose their tail (retrieved chunks are
+ranked best first), other long fields lose their middle so the end of a
+question survives. Plain strings that exceed the budget keep their head and
+tail instead of being cut at the end like `tokenizer(..., truncation=True)`.
+"""
+
+import string
+import weakref
+from collections import OrderedDict
+from prompts import context_field, format_context, get_template
+
+# Fields trimmed first (from the end) when a prompt is over budget
+CONTEXT_FIELDS = ("context", "input_text")
+ELLIPSIS = " ..."
+
+def prompt_budget(window, max_new_tokens):
+    """
+    Tokens a prompt may use when up to `max_new_tokens` should follow it in a `window`-token context.
+    The prompt's share is at least half the window: a short prompt is never cut to make room for a
+    large max_new_tokens; callers lower max_new_tokens to window - len(prompt) instead.
+    """
+    if not window:
+        return None
+    return window - max(1, min(max_new_tokens, window // 2))
+
+def context_window(model, tokenizer=None):
+    """Maximum sequence length of `model` (and its tokenizer, when it declares a real limit)."""
+    config = model.config
+    limit = getattr(config, "max_position_embeddings", None) or getattr(config, "n_positions", None)
+    model_max = getattr(tokenizer, "model_max_length", None)
+    if model_max and model_max < 1e9:
+        limit = min(limit, model_max) if limit else model_max
+    return limit
+
+class CompiledTemplate:
+    """A template as alternating literal token ids and field names."""
+
+    def __init__(self, compiler, template):
+        self.template = template
+        self.parts = []  # (field name, leading spaces) or list of token ids (literal)
+        self.fields = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if spec or conversion:
+                raise ValueError(f"Format specs/conversions are not supported: {template!r}")
+            # Trailing spaces belong to the next word, as in a BPE tokenization of the whole string
+            lead = literal[len(literal.rstrip(" ")):] if field is not None else ""
+            text = literal[:len(literal) - len(lead)]
+            if text:
+                self.parts.append(compiler.encode(text))
+            if field is not None:
+                self.parts.append((field, lead))
+                self.fields.append(field)
+        self.literal_tokens = sum(len(part) for part in self.parts if isinstance(part, list))
+        # Token ids are only guaranteed to equal tokenizing the formatted string if merges never
+        # cross a segment boundary; check once with a sample value and fall back otherwise.
+        # Values can still merge with the template text (e.g. a trailing "\n" before "\n\n"),
+        # so render() also checks the seams of every prompt it stitches
+        sample = {field: "sample text" for field in self.fields}
+        self.exact = self.render_ids(compiler, sample) == compiler.tokenize(template.format(**sample))
+
+    def render_ids(self, compiler, fields, max_tokens=None, check_seams=False):
+        """
+        Token ids for `fields`, trimmed to `max_tokens` (including special tokens) if given.
+        :param check_seams: Return None if tokens on either side of a segment boundary would merge.
+        """
+        values = {}
+        for part in self.parts:
+            if isinstance(part, tuple):
+                field, lead = part
+                values[field] = compiler.encode(lead + str(fields[field]))
+        if max_tokens is not None:
+            budget = max_tokens - len(compiler.special_ids) - self.literal_tokens
+            if budget < 0:
+                raise ValueError(f"The template alone needs {self.literal_tokens} tokens, over the budget of {max_tokens}")
+            values = compiler.trim_fields(values, budget)
+        segments = [values[part[0]] if isinstance(part, tuple) else part for part in self.parts]
+        if check_seams:
+            segments = [segment for segment in segments if segment]
+            if not all(compiler.seam_ok(left, right) for left, right in zip(segments, segments[1:])):
+                return None
+        ids = list(compiler.special_ids)
+        for segment in segments:
+            ids.extend(segment)
+        return ids
+
+class PromptCompiler:
+    """Compiled templates and a field-token cache for one tokenizer (see get_compiler)."""
+
+    def __init__(self, tokenizer, max_cached_values=4096):
+        self.tokenizer = tokenizer
+        self.special_ids = tokenizer("", add_special_tokens=True)["input_ids"]
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.max_cached_values = max_cached_values
+        self._templates = {}
+        self._values = OrderedDict()
+        self._seams = {}
+        self.ellipsis_ids = self.encode(ELLIPSIS)
+
+    def tokenize(self, text):
+        """Token ids of `text` with the tokenizer's special tokens, no truncation."""
+        return self.tokenizer(text, add_special_tokens=True)["input_ids"]
+
+    def encode(self, text):
+        """Token ids of a text fragment (no special tokens), LRU-cached."""
+        ids = self._values.get(text)
+        if ids is not None:
+            self._values.move_to_end(text)
+            return ids
+        ids = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+        self._values[text] = ids
+        if len(self._values) > self.max_cached_values:
+            self._values.popitem(last=False)
+        return ids
+
+    def seam_ok(self, left, right):
+        """True if the last token of `left` and the first of `right` stay two tokens when their text is joined."""
+        pair = (left[-1], right[0])
+        ok = self._seams.get(pair)
+        if ok is None:
+            if len(self._seams) >= self.max_cached_values:
+                self._seams.clear()
+            text = self.tokenizer.decode(list(pair), clean_up_tokenization_spaces=False)
+            ok = self._seams[pair] = self.encode(text) == list(pair)
+        return ok
+
+    def compile(self, category, key):
+        """The CompiledTemplate of prompts.get_template(category, key), built once."""
+        compiled = self._templates.get((category, key))
+        if compiled is None:
+            compiled = self._templates[(category, key)] = CompiledTemplate(self, get_template(category, key))
+        return compiled
+
+    def trim_middle(self, ids, budget):
+        """Keep the head and tail of `ids` joined by an ellipsis so the result fits `budget` tokens."""
+        if len(ids) <= budget:
+            return ids
+        keep = budget - len(self.ellipsis_ids)
+        if keep <= 1:
+            return ids[:max(0, budget)]
+        head = keep // 2
+        return ids[:head] + self.ellipsis_ids + ids[len(ids) - (keep - head):]
+
+    def trim_fields(self, values, budget):
+        """
+        Shrink field token lists until their total fits `budget`.
+        Context fields are cut from the end first; then the longest other field loses its middle.
+        """
+        excess = sum(len(ids) for ids in values.values()) - budget
+        if excess <= 0:
+            return values
+        values = dict(values)
+        for field in CONTEXT_FIELDS:
+            if field in values and excess > 0:
+                cut = min(excess, len(values[field]))
+                values[field] = values[field][:len(values[field]) - cut]
+                excess -= cut
+        while excess > 0:
+            field = max(values, key=lambda name: len(values[name]))
+            length = len(values[field])
+            if length == 0:
+                break
+            values[field] = self.trim_middle(values[field], max(0, length - excess))
+            excess = sum(len(ids) for ids in values.values()) - budget
+        return values
+
+    def render(self, category, key, max_tokens=None, **fields):
+        """
+        Token ids of a prompts.py template, like tokenizing get_prompt(...) but from cached pieces.
+        :param max_tokens: Token budget; variable fields are trimmed to fit (template text never is).
+        """
+        compiled = self.compile(category, key)
+        if compiled.exact:
+            ids = compiled.render_ids(self, fields, max_tokens, check_seams=True)
+            if ids is not None:
+                return ids
+        # Tokens merge across a segment boundary: tokenize the whole text and
+        # only fall back to the segment ids when the prompt has to be trimmed
+        ids = self.tokenize(compiled.template.format(**fields))
+        if max_tokens is None or len(ids) <= max_tokens:
+            return ids
+        return compiled.render_ids(self, fields, max_tokens)
+
+    def render_grounded(self, category, key, chunks, max_tokens=None, **fields):
+        """
+        Token ids of prompts.get_grounded_prompt(category, key, chunks, **fields); over budget,
+        the context loses its lowest-ranked chunks (its tail) first.
+        """
+        fields[context_field(category, key)] = format_context(chunks)
+        return self.render(category, key, max_tokens, **fields)
+
+    def render_text(self, text, max_tokens=None):
+        """
+        Token ids of a plain prompt string; over budget, the middle is dropped (head and tail are kept).
+        """
+        ids = self.tokenize(text)
+        if max_tokens is None or len(ids) <= max_tokens:
+            return ids
+        specials = len(self.special_ids)
+        return ids[:specials] + self.trim_middle(ids[specials:], max_tokens - specials)
+
+    def pad(self, sequences, padding_side="left", device=None):
+        """
+        Pad token id lists into tensors.
+        :return: {"input_ids": LongTensor, "attention_mask": LongTensor}
+        """
+        import torch
+
+        width = max((len(ids) for ids in sequences), default=0)
+        input_ids = torch.full((len(sequences), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(sequences), width), dtype=torch.long)
+        for row, ids in enumerate(sequences):
+            if not ids:
+                continue
+            span = slice(width - len(ids), width) if padding_side == "left" else slice(0, len(ids))
+            input_ids[row, span] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, span] = 1
+        if device is not None:
+            input_ids, attention_mask = input_ids.to(device), attention_mask.to(device)
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+    def render_batch(self, category, key, batch, max_tokens=None, padding_side="left", device=None):
+        """
+        Render many prompts of one template straight to padded tensors.
+        :param batch: List of field dicts, e.g. [{"question": ...}, ...].
+        """
+        return self.pad([self.render(category, key, max_tokens, **fields) for fields in batch], padding_side, device)
+
+_compilers = weakref.WeakKeyDictionary()
+
+def get_compiler(tokenizer):
+    """The PromptCompiler of `tokenizer`, created on first use and kept as long as the tokenizer lives."""
+    compiler = _compilers.get(tokenizer)
+    if compiler is None:
+        compiler = _compilers[tokenizer] = PromptCompiler(tokenizer)
+    return compiler
+
+def benchmark(tokenizer, questions, category="evaluation", keys=("standard", "cot"), repeat=3):
+    """Compare tokenizing get_prompt(...) strings with rendering through the compiler."""
+    import time
+    from prompts import get_prompt
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        baseline = [tokenizer(get_prompt(category, key, question=q))["input_ids"] for q in questions for key in keys]
+    baseline_time = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        compiler = PromptCompiler(tokenizer)  # Cold field cache on every repeat
+        compiled = [compiler.render(category, key, question=q) for q in questions for key in keys]
+    compiled_time = (time.perf_counter() - start) / repeat
+    same = sum(a == b for a, b in zip(baseline, compiled)) / max(1, len(baseline))
+    print(f"⏱️ get_prompt + tokenizer: {baseline_time * 1000:.1f} ms | compiled: {compiled_time * 1000:.1f} ms "
+          f"({len(baseline)} prompts, identical ids: {same:.1%})")
+    return {"tokenizer_sec": baseline_time, "compiled_sec": compiled_time, "identical": same}
+
+if __name__ == "__main__":
+    import json
+    import argparse
+    from transformers import AutoTokenizer
+
+    parser = argparse.ArgumentParser(description="Benchmark compiled prompt rendering against get_prompt + tokenizer.")
+    parser.add_argument("--tokenizer", default="gpt2", help="Tokenizer name or path")
+    parser.add_argument("--input_file", default="db/questions/cot_questions_clean.json", help="Question file")
+    args = parser.parse_args()
+
+    with open(args.input_file, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)]
+    benchmark(AutoTokenizer.from_pretrained(args.tokenizer), questions)
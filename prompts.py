@@ -23,6 +23,47 @@ RESEARCH_PROMPTS = {
     "research_question": "What are the key research questions in the field of {field}?",
 }
 
+# Prompts used when evaluating models on the extracted question set
+EVALUATION_PROMPTS = {
+    "standard": "Answer the following question concisely: {question}",
+    "cot": "Think step by step and then answer: {question}",
+}
+
+# Prompts grounded in passages retrieved from the PDF corpus (see retrieval.py)
+RETRIEVAL_PROMPTS = {
+    "question": "Answer the question using only the context below. Cite passages by their [number].\n\n"
+                "Context:\n{context}\n\nQuestion: {question}\nAnswer:",
+    "cot": "Use only the context below. Think step by step, citing passages by their [number], "
+           "and then answer.\n\nContext:\n{context}\n\nQuestion: {question}",
+}
+
+# Prompt categories by name (built once, not on every lookup)
+PROMPT_CATEGORIES = {
+    "general": GENERAL_PROMPTS,
+    "task": TASK_PROMPTS,
+    "research": RESEARCH_PROMPTS,
+    "evaluation": EVALUATION_PROMPTS,
+    "retrieval": RETRIEVAL_PROMPTS,
+}
+
+# Function to retrieve an unformatted template
+def get_template(category, key):
+    """
+    Retrieve a prompt template from the specified category and key.
+    :param category: The category of the prompt (e.g., 'general', 'task').
+    :param key: The key of the specific prompt within the category.
+    :return: The template string, with its {placeholders} unformatted.
+    """
+    categories = PROMPT_CATEGORIES
+    if category not in categories:
+        raise ValueError(f"Invalid category: {category}. Valid categories are: {list(categories.keys())}")
+
+    prompts = categories[category]
+    if key not in prompts:
+        raise ValueError(f"Invalid key: {key}. Valid keys for category '{category}' are: {list(prompts.keys())}")
+
+    return prompts[key]
+
 # Function to retrieve a prompt
 def get_prompt(category, key, **kwargs):
     """
@@ -32,21 +73,61 @@ def get_prompt(category, key, **kwargs):
     :param kwargs: Additional arguments to format the prompt.
     :return: The formatted prompt string.
     """
-    categories = {
-        "general": GENERAL_PROMPTS,
-        "task": TASK_PROMPTS,
-        "research": RESEARCH_PROMPTS,
-    }
+    prompt = get_template(category, key)
+    return prompt.format(**kwargs)
 
-    if category not in categories:
-        raise ValueError(f"Invalid category: {category}. Valid categories are: {list(categories.keys())}")
+# Function to split a prompt into its fixed prefix and the variable rest
+def split_prompt(category, key, **kwargs):
+    """
+    Split a formatted prompt into the template text before the first placeholder
+    (identical for every call, so its model state can be cached) and the remainder.
+    :return: (prefix, suffix) with prefix + suffix == get_prompt(category, key, **kwargs).
+    """
+    template = get_template(category, key)
+    prefix = template.split("{", 1)[0].rstrip()
+    return prefix, template.format(**kwargs)[len(prefix):]
 
-    prompts = categories[category]
-    if key not in prompts:
-        raise ValueError(f"Invalid key: {key}. Valid keys for category '{category}' are: {list(prompts.keys())}")
+# Function to format retrieved chunks as a numbered context block
+def format_context(chunks, max_chars=None):
+    """
+    Number the chunks ("[1] (source p.N) text") in rank order.
+    :param chunks: Dicts with "text" and optionally "source" and "page" (e.g. from RetrievalIndex.search).
+    :param max_chars: Keep only the best-ranked chunks whose formatted text fits in this many characters
+                      (the best chunk is cut to the budget if it alone is longer).
+    """
+    parts, used = [], 0
+    for number, chunk in enumerate(chunks, start=1):
+        origin = f" ({chunk['source']} p.{chunk['page']})" if chunk.get("source") else ""
+        part = f"[{number}]{origin} {chunk['text']}"
+        if max_chars is not None and used + len(part) > max_chars:
+            if not parts:
+                parts.append(part[:max_chars].rstrip())
+            break
+        parts.append(part)
+        used += len(part) + 1
+    return "\n".join(parts)
 
-    prompt = prompts[key]
-    return prompt.format(**kwargs)
+# Function to find the placeholder that retrieved chunks go into
+def context_field(category, key):
+    """Name of the template's context placeholder: "context" (category "retrieval") or "input_text"."""
+    template = get_template(category, key)
+    for field in ("context", "input_text"):
+        if "{" + field + "}" in template:
+            return field
+    raise ValueError(f"Prompt {category}/{key} has no {{context}} or {{input_text}} placeholder")
+
+# Function to build a prompt around retrieved chunks
+def get_grounded_prompt(category, key, chunks, max_chars=None, **kwargs):
+    """
+    Fill a template's context placeholder with retrieved chunks instead of a whole document.
+    Templates with {context} (category "retrieval") or {input_text} (e.g. general/summary) are supported.
+    :param chunks: Retrieved chunks, best first.
+    :param max_chars: Character budget for the context block.
+    :param kwargs: The template's other placeholders (e.g. question).
+    """
+    template = get_template(category, key)
+    field = context_field(category, key)
+    return template.format(**{**kwargs, field: format_context(chunks, max_chars)})
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,277 @@
+"""
+Reduced-precision CPU inference for Hugging Face causal LMs.
+
+Precisions:
+- "fp32"         full precision (the default)
+- "bf16"         bfloat16 weights and activations
+- "int8-dynamic" torch dynamic quantization: int8 weights, activations quantized per batch
+- "int8-weight"  weight-only int8 (per output channel scale), dequantized on the fly
+- "int4-weight"  weight-only int4 (per group of 64 inputs), two weights packed per byte
+
+GPT-2 style models implement their projections with `Conv1D`; those are
+converted to `nn.Linear` first so every scheme applies to them. Quantized
+models are cached on disk, so later starts load them directly instead of
+loading fp32 weights and quantizing again.
+"""
+
+import os
+import io
+import re
+import time
+import argparse
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+PRECISIONS = ("fp32", "bf16", "int8-dynamic", "int8-weight", "int4-weight")
+QUANTIZED_PRECISIONS = ("int8-dynamic", "int8-weight", "int4-weight")
+QUANTIZED_CACHE_DIR = os.getenv("QUANTIZED_CACHE_DIR", "model_cache/quantized")
+INT4_GROUP_SIZE = 64
+
+class WeightOnlyLinear(nn.Module):
+    """Linear layer storing int8 or packed int4 weights with float scales; computes in the input dtype."""
+
+    def __init__(self, linear, bits=8, group_size=INT4_GROUP_SIZE):
+        """
+        :param linear: nn.Linear to quantize.
+        :param bits: 8 (per output channel scale) or 4 (per group of `group_size` inputs).
+        """
+        super().__init__()
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+        self.bits = bits
+        if bits == 4 and self.in_features % 2:
+            raise ValueError(f"int4 packing needs an even number of input features, got {self.in_features}")
+        grouped = bits == 4 and self.in_features % group_size == 0
+        self.group_size = group_size if grouped else self.in_features
+        weight = linear.weight.detach().float()
+
+        qmax = 127 if bits == 8 else 7
+        groups = weight.view(self.out_features, -1, self.group_size)
+        scale = groups.abs().amax(dim=-1, keepdim=True).clamp(min=1e-8) / qmax
+        q = torch.round(groups / scale).clamp(-qmax - (bits == 4), qmax).to(torch.int8).view(self.out_features, -1)
+        if bits == 4:
+            # Low nibbles hold the first half of the columns, high nibbles the second half
+            q = (q + 8).to(torch.uint8)
+            half = self.in_features // 2
+            q = q[:, :half] | (q[:, half:] << 4)
+        self.register_buffer("qweight", q)
+        self.register_buffer("scale", scale.squeeze(-1))
+        self.bias = None if linear.bias is None else nn.Parameter(linear.bias.detach().float(), requires_grad=False)
+
+    def dequantize(self):
+        q = self.qweight
+        if self.bits == 4:
+            weight = torch.cat([q & 0x0F, q >> 4], dim=-1).float().sub_(8)
+        else:
+            weight = q.float()
+        weight = weight.view(self.out_features, -1, self.group_size).mul_(self.scale.unsqueeze(-1))
+        return weight.view(self.out_features, self.in_features)
+
+    def forward(self, x):
+        bias = None if self.bias is None else self.bias.to(x.dtype)
+        if self.group_size == self.in_features and self.bits == 8:
+            # One scale per output channel: apply it to the output instead of the weight matrix
+            out = F.linear(x, self.qweight.to(x.dtype)) * self.scale[:, 0].to(x.dtype)
+            return out if bias is None else out + bias
+        return F.linear(x, self.dequantize().to(x.dtype), bias)
+
+    def extra_repr(self):
+        return f"in_features={self.in_features}, out_features={self.out_features}, bits={self.bits}"
+
+def conv1d_to_linear(model):
+    """Replace GPT-2 `Conv1D` modules (weight stored as [in, out]) with equivalent nn.Linear layers."""
+    from transformers.pytorch_utils import Conv1D
+
+    for name, module in list(model.named_modules()):
+        for child_name, child in list(module.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = nn.Linear(in_features, out_features, dtype=child.weight.dtype, device=child.weight.device)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(module, child_name, linear)
+    return model
+
+def _quantizable_linears(model):
+    """Yield (parent, name, linear) for every nn.Linear except the (usually tied) output head."""
+    output = model.get_output_embeddings()
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if type(child) is nn.Linear and child is not output:
+                yield module, name, child
+
+def quantize_model(model, precision):
+    """
+    Convert a loaded fp32 model to `precision` in place (where possible) and return it.
+    :param precision: One of PRECISIONS.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}; choose from {', '.join(PRECISIONS)}")
+    if precision == "fp32":
+        return model
+    if precision == "bf16":
+        return model.to(torch.bfloat16)
+
+    conv1d_to_linear(model)
+    if precision == "int8-dynamic":
+        from torch.ao.quantization import quantize_dynamic
+        targets = {name for name, module in model.named_modules()
+                   if type(module) is nn.Linear and module is not model.get_output_embeddings()}
+        return quantize_dynamic(model, targets, dtype=torch.qint8)
+
+    bits = 8 if precision == "int8-weight" else 4
+    for parent, name, linear in _quantizable_linears(model):
+        setattr(parent, name, WeightOnlyLinear(linear, bits))
+    return model
+
+def model_nbytes(model):
+    """Size of the model's serialized weights in bytes (counts packed quantized weights correctly)."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+def quantized_cache_path(model_name, revision, precision, cache_dir=QUANTIZED_CACHE_DIR):
+    """Cache file for one (model, revision, precision), tied to the installed torch/transformers versions."""
+    import transformers
+
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", model_name.strip("/"))
+    versions = f"torch{torch.__version__}-tf{transformers.__version__}"
+    return os.path.join(cache_dir, f"{name}@{revision or 'local'}-{precision}-{versions}.state.pt")
+
+def empty_quantized_model(config, precision):
+    """
+    A model of `config` with the module structure quantize_model produces for `precision`,
+    whose weights are still to be loaded (see load_quantized_state).
+    """
+    from transformers import AutoModelForCausalLM
+
+    if precision == "int8-dynamic":
+        # quantize_dynamic packs real weights, so this skeleton needs (randomly initialized) ones
+        return quantize_model(AutoModelForCausalLM.from_config(config).eval(), precision)
+    from accelerate import init_empty_weights
+    with init_empty_weights():  # Parameters on the meta device; buffers computed in __init__ stay real
+        model = AutoModelForCausalLM.from_config(config)
+    return quantize_model(model.eval(), precision)
+
+def load_quantized_state(model, path):
+    """Load a state dict saved by load_causal_lm into a model from empty_quantized_model."""
+    from accelerate.utils import set_module_tensor_to_device
+
+    state = torch.load(path, weights_only=True)
+    if not any(t.is_meta for t in model.parameters()) and not any(t.is_meta for t in model.buffers()):
+        model.load_state_dict(state)
+        return model
+    for name, tensor in state.items():
+        set_module_tensor_to_device(model, name, "cpu", value=tensor)
+    model.tie_weights()
+    missing = [name for name, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+    if missing:
+        raise ValueError(f"{path} has no weights for {', '.join(missing[:5])}")
+    return model
+
+def load_causal_lm(model_name, precision="fp32", cache_dir=QUANTIZED_CACHE_DIR):
+    """
+    Load `model_name` at `precision`; quantized models are read from / written to `cache_dir`.
+    :return: The model in eval mode.
+    """
+    from transformers import AutoModelForCausalLM
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}; choose from {', '.join(PRECISIONS)}")
+    if precision == "bf16":
+        return AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.bfloat16).eval()
+    if precision not in QUANTIZED_PRECISIONS:
+        return AutoModelForCausalLM.from_pretrained(model_name).eval()
+
+    from transformers import AutoConfig
+    config = AutoConfig.from_pretrained(model_name)
+    revision = getattr(config, "_commit_hash", None)
+    config_file = os.path.join(model_name, "config.json")
+    if revision is None and os.path.exists(config_file):
+        revision = f"{os.path.getmtime(config_file):.0f}"  # Local checkpoint: invalidate when it is re-saved
+    path = quantized_cache_path(model_name, revision, precision, cache_dir) if cache_dir else None
+    if path and os.path.exists(path):
+        print(f"📦 Loading {precision} weights from {path}")
+        try:
+            # Only tensors are unpickled; the modules are rebuilt from the config
+            return load_quantized_state(empty_quantized_model(config, precision), path).eval()
+        except Exception as e:
+            print(f"⚠️ Could not load {path} ({e}); quantizing again")
+
+    model = quantize_model(AutoModelForCausalLM.from_pretrained(model_name).eval(), precision)
+    if path:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        torch.save(model.state_dict(), tmp_path)
+        os.replace(tmp_path, path)
+        print(f"💾 Saved {precision} weights to {path}")
+    return model
+
+def _greedy(model, tokenizer, prompt, max_new_tokens):
+    from prefix_cache import decode
+
+    ids = tokenizer(prompt)["input_ids"]
+    generated, _ = decode(model, torch.tensor([ids]), max_new_tokens=max_new_tokens,
+                          eos_token_id=tokenizer.eos_token_id)
+    return generated
+
+def benchmark_precisions(model_name, prompts, precisions=PRECISIONS, max_new_tokens=32, cache_dir=QUANTIZED_CACHE_DIR):
+    """
+    Compare weight size, load time, greedy tokens/sec and output agreement with fp32 for each precision.
+    Agreement is the share of generated tokens equal to the fp32 token at the same position.
+    :return: List of result dicts, one per precision.
+    """
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    reference = None
+    results = []
+    for precision in ("fp32",) + tuple(p for p in precisions if p != "fp32"):
+        start = time.perf_counter()
+        model = load_causal_lm(model_name, precision, cache_dir)
+        load_time = time.perf_counter() - start
+
+        outputs, tokens = [], 0
+        start = time.perf_counter()
+        with torch.no_grad():
+            for prompt in prompts:
+                outputs.append(_greedy(model, tokenizer, prompt, max_new_tokens))
+                tokens += len(outputs[-1])
+        elapsed = max(time.perf_counter() - start, 1e-9)
+
+        if reference is None:
+            reference = outputs
+        same = sum(a == b for out, ref in zip(outputs, reference) for a, b in zip(out, ref))
+        total = sum(max(len(out), len(ref)) for out, ref in zip(outputs, reference))
+        result = {
+            "precision": precision,
+            "weights_mb": model_nbytes(model) / 1024 ** 2,
+            "load_sec": load_time,
+            "tokens_per_sec": tokens / elapsed,
+            "token_agreement": same / total if total else 1.0,
+            "exact_match": sum(out == ref for out, ref in zip(outputs, reference)) / len(prompts) if prompts else 1.0,
+        }
+        results.append(result)
+        if precision in precisions:
+            print(f"⏱️ {precision:>12}: {result['weights_mb']:8.1f} MB, load {load_time:5.2f} s, "
+                  f"{result['tokens_per_sec']:7.1f} token/s, agreement {result['token_agreement']:.1%}, "
+                  f"exact {result['exact_match']:.1%}")
+        del model
+    return [result for result in results if result["precision"] in precisions]
+
+if __name__ == "__main__":
+    import json
+
+    parser = argparse.ArgumentParser(description="Benchmark reduced-precision CPU inference against fp32.")
+    parser.add_argument("--model", default="gpt2", help="Model name or path")
+    parser.add_argument("--precisions", nargs="+", default=list(PRECISIONS), choices=PRECISIONS)
+    parser.add_argument("--input_file", default="db/questions/cot_questions_clean.json", help="Question file")
+    parser.add_argument("--limit", type=int, default=20, help="Number of questions to use")
+    parser.add_argument("--max_new_tokens", type=int, default=32)
+    parser.add_argument("--cache_dir", default=QUANTIZED_CACHE_DIR, help="Quantized weight cache ('' to disable)")
+    args = parser.parse_args()
+
+    with open(args.input_file, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)][:args.limit]
+    benchmark_precisions(args.model, questions, args.precisions, args.max_new_tokens, args.cache_dir or None)
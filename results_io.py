@@ -0,0 +1,115 @@
+"""
+Streaming JSONL storage for evaluation results: one record per completed
+(question, method), appended as soon as it is generated and read back lazily.
+A record retried after an error is appended again; readers keep the last one.
+"""
+
+import os
+import json
+import time
+from generation_cache import is_error_output
+
+class ResultWriter:
+    """Append-only JSONL writer that fsyncs every `fsync_every` records or `fsync_interval` seconds."""
+
+    def __init__(self, path, fsync_every=50, fsync_interval=5.0):
+        """
+        :param path: JSONL file to append to (created if missing).
+        :param fsync_every: Force records to disk after this many writes.
+        :param fsync_interval: ...or after this many seconds, whichever comes first.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._repair_tail()
+        self._file = open(path, "a", encoding="utf-8")
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _repair_tail(self):
+        """Drop a half-written last line left behind by a crash."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            # Walk back to the last complete line
+            pos = size - 1
+            while pos > 0:
+                step = min(4096, pos)
+                f.seek(pos - step)
+                chunk = f.read(step)
+                newline = chunk.rfind(b"\n")
+                if newline != -1:
+                    f.truncate(pos - step + newline + 1)
+                    return
+                pos -= step
+            f.truncate(0)
+
+    def write(self, record):
+        """Append one record and flush it to the OS."""
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._pending += 1
+        if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """Force everything written so far to disk."""
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def iter_jsonl(path):
+    """Yield the records of a JSONL file one at a time, skipping a truncated last line."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+def completed_keys(path):
+    """
+    Return the (index, method) pairs already answered in a results file.
+    Error answers ("[ERROR]", "[Error: ...]") do not count, so a resumed run retries them.
+    """
+    if not os.path.exists(path):
+        return set()
+    return {(record["index"], record["method"]) for record in iter_jsonl(path)
+            if not is_error_output(record.get("answer"))}
+
+def iter_results(path, key=lambda record: (record["index"], record["method"])):
+    """
+    Yield only the last record per `key` of a results file (a retried answer replaces an earlier error).
+    Reads the file twice instead of holding every record in memory.
+    """
+    last = {}
+    for line_number, record in enumerate(iter_jsonl(path)):
+        last[key(record)] = line_number
+    keep = set(last.values())
+    for line_number, record in enumerate(iter_jsonl(path)):
+        if line_number in keep:
+            yield record
@@ -0,0 +1,381 @@
+"""
+Local retrieval over the PDF corpus, so prompts carry only the few passages
+that matter instead of whole documents.
+
+PDF text (shared with the extract_questions page cache) is split into
+overlapping word windows. Chunks are indexed with BM25 (an inverted index held
+as NumPy arrays) and, optionally, a dense index: feature-hashing vectors by
+default (no model download) or mean-pooled Hugging Face encoder embeddings.
+Queries score only the postings of their terms, and dense search is one
+matrix-vector product plus argpartition, so lookups take milliseconds.
+
+The index is saved to a directory and updated incrementally: PDFs are tracked
+by content hash, so unchanged PDFs are neither re-read nor re-embedded and
+removed or modified PDFs drop their old chunks.
+
+    python retrieval.py build --input_dir data/raw/documents
+    python retrieval.py query "CuO thin film transistor mobility" --k 4
+"""
+
+import os
+import json
+import time
+import zlib
+import argparse
+import numpy as np
+from analyze_problems import extract_keywords
+
+INDEX_DIR = os.getenv("RETRIEVAL_INDEX_DIR", "db/index")
+CHUNK_WORDS = 200
+CHUNK_OVERLAP = 40
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60  # Reciprocal-rank-fusion constant for hybrid search
+
+def chunk_pages(pages, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """
+    Split page texts into overlapping windows of `chunk_words` words.
+    :return: List of (first page number, 1-based, text).
+    """
+    words, page_of = [], []
+    for number, text in enumerate(pages, start=1):
+        page_words = text.split()
+        words.extend(page_words)
+        page_of.extend([number] * len(page_words))
+    step = max(1, chunk_words - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append((page_of[start], " ".join(words[start:start + chunk_words])))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+class HashingEmbedder:
+    """Signed feature hashing of word unigrams and bigrams, L2-normalized; deterministic and offline."""
+    name = "hashing"
+
+    def __init__(self, dim=1024):
+        self.dim = dim
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = extract_keywords(text)
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                h = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+class HFEmbedder:
+    """Mean-pooled hidden states of a local Hugging Face encoder (e.g. sentence-transformers/all-MiniLM-L6-v2)."""
+
+    def __init__(self, model_name, batch_size=32, max_length=256):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+
+        self.name = f"hf:{model_name}"
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def embed(self, texts):
+        torch = self.torch
+        parts = []
+        with torch.no_grad():
+            for start in range(0, len(texts), self.batch_size):
+                encoded = self.tokenizer(texts[start:start + self.batch_size], padding=True, truncation=True,
+                                         max_length=self.max_length, return_tensors="pt")
+                hidden = self.model(**encoded).last_hidden_state
+                mask = encoded["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+                parts.append(torch.nn.functional.normalize(pooled, dim=-1).float().numpy())
+        return np.concatenate(parts) if parts else np.zeros((0, self.model.config.hidden_size), np.float32)
+
+def make_embedder(name):
+    """None/"none" -> no dense index, "hashing" -> HashingEmbedder, "hf:<model>" -> HFEmbedder."""
+    if not name or name == "none":
+        return None
+    if name == "hashing":
+        return HashingEmbedder()
+    if name.startswith("hf:"):
+        return HFEmbedder(name[3:])
+    raise ValueError(f"Unknown embedder {name!r}; use 'none', 'hashing' or 'hf:<model>'")
+
+class BM25:
+    """Okapi BM25 over an inverted index: per term, a sorted slice of chunk ids and term frequencies."""
+
+    def __init__(self, token_lists, k1=BM25_K1, b=BM25_B):
+        self.k1, self.b = k1, b
+        self.doc_len = np.array([len(tokens) for tokens in token_lists], dtype=np.float32)
+        self.avgdl = float(self.doc_len.mean()) if len(self.doc_len) else 0.0
+        postings = {}
+        for doc, tokens in enumerate(token_lists):
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append((doc, tf))
+        self.vocab = {term: i for i, term in enumerate(sorted(postings))}
+        self.indptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        docs, tfs = [], []
+        for term, i in self.vocab.items():
+            entries = postings[term]
+            self.indptr[i + 1] = self.indptr[i] + len(entries)
+            docs.extend(doc for doc, _ in entries)
+            tfs.extend(tf for _, tf in entries)
+        self.docs = np.array(docs, dtype=np.int32)
+        self.tfs = np.array(tfs, dtype=np.float32)
+        n = len(token_lists)
+        df = np.diff(self.indptr).astype(np.float32)
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5))
+
+    def scores(self, query_tokens):
+        scores = np.zeros(len(self.doc_len), dtype=np.float32)
+        if not len(self.doc_len):
+            return scores
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / max(self.avgdl, 1e-9))
+        for token in set(query_tokens):
+            i = self.vocab.get(token)
+            if i is None:
+                continue
+            lo, hi = self.indptr[i], self.indptr[i + 1]
+            docs, tf = self.docs[lo:hi], self.tfs[lo:hi]
+            scores[docs] += self.idf[i] * tf * (self.k1 + 1) / (tf + norm[docs])
+        return scores
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+class RetrievalIndex:
+    """Chunked PDF corpus with a BM25 index and an optional dense index, persisted in `directory`."""
+
+    def __init__(self, directory=INDEX_DIR, embedder="hashing", chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+        """
+        :param embedder: "hashing" (default), "hf:<model>" or "none" for BM25 only.
+        """
+        self.directory = directory
+        self.embedder_name = embedder or "none"
+        self.embedder = None
+        self.chunk_words = chunk_words
+        self.overlap = overlap
+        self.documents = {}  # sha256 -> {"source": file name, "chunks": count}
+        self.chunks = []  # {"doc": sha256, "source", "page", "text"}
+        self.embeddings = None
+        self.bm25 = BM25([])
+
+    # --- persistence ---------------------------------------------------------------------
+
+    @classmethod
+    def load(cls, directory=INDEX_DIR):
+        """Open a saved index (embeddings are memory-mapped)."""
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(directory, meta["embedder"], meta["chunk_words"], meta["overlap"])
+        index.documents = meta["documents"]
+        with open(os.path.join(directory, "chunks.jsonl"), "r", encoding="utf-8") as f:
+            index.chunks = [json.loads(line) for line in f if line.strip()]
+        embeddings_file = os.path.join(directory, "embeddings.npy")
+        if os.path.exists(embeddings_file):
+            index.embeddings = np.load(embeddings_file, mmap_mode="r")
+        index._build_bm25()
+        return index
+
+    @classmethod
+    def open(cls, directory=INDEX_DIR, embedder="hashing", **options):
+        """Load the index in `directory` if it exists, else create an empty one."""
+        if os.path.exists(os.path.join(directory, "meta.json")):
+            return cls.load(directory)
+        return cls(directory, embedder, **options)
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "chunks.jsonl"), "w", encoding="utf-8") as f:
+            for chunk in self.chunks:
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+        embeddings_file = os.path.join(self.directory, "embeddings.npy")
+        if self.embeddings is not None:
+            tmp_path = embeddings_file + ".tmp.npy"
+            np.save(tmp_path, np.asarray(self.embeddings, dtype=np.float32))
+            os.replace(tmp_path, embeddings_file)
+            self.embeddings = np.load(embeddings_file, mmap_mode="r")
+        elif os.path.exists(embeddings_file):
+            os.remove(embeddings_file)
+        meta = {"embedder": self.embedder_name, "chunk_words": self.chunk_words, "overlap": self.overlap,
+                "documents": self.documents}
+        with open(os.path.join(self.directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2, ensure_ascii=False)
+
+    # --- updates -------------------------------------------------------------------------
+
+    def _get_embedder(self):
+        if self.embedder is None:
+            self.embedder = make_embedder(self.embedder_name)
+        return self.embedder
+
+    def _build_bm25(self):
+        self.bm25 = BM25([extract_keywords(chunk["text"]) for chunk in self.chunks])
+
+    def remove_documents(self, digests):
+        """Drop every chunk (and embedding row) of the given documents."""
+        digests = set(digests) & set(self.documents)
+        if not digests:
+            return
+        keep = [i for i, chunk in enumerate(self.chunks) if chunk["doc"] not in digests]
+        self.chunks = [self.chunks[i] for i in keep]
+        if self.embeddings is not None:
+            self.embeddings = np.asarray(self.embeddings)[keep]
+        for digest in digests:
+            del self.documents[digest]
+
+    def add_document(self, digest, source, pages):
+        """Chunk and index one document's page texts (replacing an earlier version with the same hash)."""
+        self.remove_documents([digest])
+        new = [{"doc": digest, "source": source, "page": page, "text": text}
+               for page, text in chunk_pages(pages, self.chunk_words, self.overlap)]
+        embedder = self._get_embedder()
+        if embedder is not None and new:
+            vectors = embedder.embed([chunk["text"] for chunk in new])
+            self.embeddings = vectors if self.embeddings is None or not len(self.chunks) else \
+                np.concatenate([np.asarray(self.embeddings), vectors])
+        self.chunks.extend(new)
+        self.documents[digest] = {"source": source, "chunks": len(new)}
+
+    def update_from_dir(self, input_dir, cache_dir=None, workers=1):
+        """
+        Bring the index in line with the PDFs in `input_dir`: index new or modified PDFs, drop removed ones.
+        Page text comes from the extract_questions cache when available (and is added to it otherwise).
+        :return: {"added": [...], "removed": n, "unchanged": n}
+        """
+        import extract_questions as eq
+
+        cache_dir = cache_dir or eq.CACHE_DIR
+        pdf_files = sorted(f for f in os.listdir(input_dir) if f.endswith(".pdf"))
+        hash_index = eq.load_cache_index(cache_dir)
+        digests = {os.path.join(input_dir, f): eq.pdf_digest(os.path.join(input_dir, f), hash_index) for f in pdf_files}
+        eq.save_cache_index(cache_dir, hash_index)
+
+        stale = set(self.documents) - set(digests.values())
+        self.remove_documents(stale)
+        pending = [path for path, digest in digests.items() if digest not in self.documents]
+
+        pages = {}
+        uncached = []
+        for path in pending:
+            cached = eq.load_cached(cache_dir, digests[path])
+            if cached is not None:
+                pages[path] = cached["pages"]
+            else:
+                uncached.append(path)
+        if uncached:
+            matcher = eq.RuleMatcher()
+            for path, path_pages in eq.read_pdfs(uncached, workers).items():
+                qa = list(eq.extract_qa_from_lines(eq.iter_page_lines(path_pages), matcher))
+                eq.save_cached(cache_dir, digests[path], path_pages, qa, matcher.fingerprint())
+                pages[path] = path_pages
+
+        for path in pending:
+            if path in pages:
+                self.add_document(digests[path], os.path.basename(path), pages[path])
+        if stale or pending:
+            self._build_bm25()
+            self.save()
+        return {"added": [os.path.basename(path) for path in pending if path in pages], "removed": len(stale),
+                "unchanged": len(digests) - len(pending)}
+
+    # --- search --------------------------------------------------------------------------
+
+    def search(self, query, k=4, method="hybrid"):
+        """
+        Return the k most relevant chunks as dicts with "source", "page", "text" and "score".
+        :param method: "bm25", "dense" (needs an embedder) or "hybrid" (reciprocal rank fusion of both).
+        """
+        if not self.chunks:
+            return []
+        dense = self.embeddings is not None and self.embedder_name != "none"
+        if method == "dense" and not dense:
+            raise ValueError("This index has no dense embeddings; rebuild it with --embedder hashing or hf:<model>")
+        lexical = method == "bm25" or not dense
+        if lexical:
+            scores = self.bm25.scores(extract_keywords(query))
+        else:
+            vector = self._get_embedder().embed([query])[0]
+            dense_scores = np.asarray(self.embeddings) @ vector
+            if method == "dense":
+                scores = dense_scores
+            else:
+                # Fuse the two rankings; only the top candidates of each contribute, and only
+                # chunks sharing a keyword with the query (or, densely, some similarity) earn rank credit
+                depth = max(50, 4 * k)
+                bm25_scores = self.bm25.scores(extract_keywords(query))
+                scores = np.zeros(len(self.chunks), dtype=np.float32)
+                for ranked in (bm25_scores, dense_scores):
+                    ranking = [i for i in top_k(ranked, depth) if ranked[i] > 0]
+                    scores[ranking] += 1.0 / (RRF_K + np.arange(1, len(ranking) + 1))
+        # Unrelated chunks score 0 (no shared keyword, or a zero query vector when the hashing
+        # embedder finds no keywords in the query): never return them as context
+        hits = [i for i in top_k(scores, k) if scores[i] > 0]
+        return [{**{key: self.chunks[i][key] for key in ("source", "page", "text")}, "score": float(scores[i])}
+                for i in hits]
+
+def grounded_prompt(index, query, k=4, category="retrieval", key="question", method="hybrid", max_chars=None,
+                    tokenizer=None, max_tokens=None, **kwargs):
+    """
+    Retrieve the k most relevant chunks for `query` and format a prompt around them (see prompts.get_grounded_prompt).
+    :param tokenizer: Return the prompt as token ids of this tokenizer (see PromptCompiler.render_grounded).
+    :param max_tokens: Token budget of the prompt (with `tokenizer`); the context loses its lowest-ranked chunks first.
+    :return: (prompt, chunks)
+    """
+    from prompts import get_grounded_prompt
+
+    chunks = index.search(query, k, method)
+    kwargs.setdefault("question", query)
+    if tokenizer is not None:
+        from prompt_compiler import get_compiler
+        return get_compiler(tokenizer).render_grounded(category, key, chunks, max_tokens, **kwargs), chunks
+    return get_grounded_prompt(category, key, chunks, max_chars=max_chars, **kwargs), chunks
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and query the local retrieval index over the PDF corpus.")
+    parser.add_argument("--index_dir", default=INDEX_DIR, help="Index directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Create or incrementally update the index")
+    build.add_argument("--input_dir", default="data/raw/documents", help="Directory containing the PDF files")
+    build.add_argument("--embedder", default="hashing", help="'hashing', 'hf:<model>' or 'none' (only for a new index)")
+    build.add_argument("--workers", type=int, default=1, help="Processes used to read new PDFs")
+    query = subparsers.add_parser("query", help="Search the index")
+    query.add_argument("query")
+    query.add_argument("--k", type=int, default=4)
+    query.add_argument("--method", choices=["bm25", "dense", "hybrid"], default="hybrid")
+    query.add_argument("--prompt", action="store_true", help="Print the grounded prompt instead of the chunks")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        index = RetrievalIndex.open(args.index_dir, args.embedder)
+        report = index.update_from_dir(args.input_dir, workers=args.workers)
+        print(f"✅ Index {args.index_dir}: {len(index.chunks)} chunks from {len(index.documents)} PDFs "
+              f"(+{len(report['added'])}, -{report['removed']}, {report['unchanged']} unchanged) "
+              f"in {time.perf_counter() - start:.2f} s")
+    else:
+        index = RetrievalIndex.load(args.index_dir)
+        start = time.perf_counter()
+        if args.prompt:
+            prompt, chunks = grounded_prompt(index, args.query, args.k, method=args.method)
+        else:
+            chunks = index.search(args.query, args.k, args.method)
+        elapsed = (time.perf_counter() - start) * 1000
+        if args.prompt:
+            print(prompt)
+        else:
+            for rank, chunk in enumerate(chunks, start=1):
+                print(f"[{rank}] {chunk['source']} p.{chunk['page']} (score {chunk['score']:.3f})\n"
+                      f"    {chunk['text'][:200]}...")
+        print(f"⏱️ {elapsed:.1f} ms")
@@ -0,0 +1,345 @@
+"""
+Batch scoring with the materials classifier in trained_model.pkl (a scikit-learn RandomForestClassifier).
+
+The model was trained on `pd.get_dummies(..., drop_first=True)` features:
+resistivity, bandgap and one-hot columns for material_name / structure
+(CuMnSnO and Cubic are the dropped baselines). `encode_features` rebuilds
+exactly the columns listed in the model's `feature_names_in_`, so unseen or
+baseline categories simply encode as all zeros.
+
+Inputs (CSV or Parquet) are streamed in chunks, scored in parallel processes
+that each load the model once, and written to Parquet with a `prediction`
+column and one `proba_<class>` column per class. Besides sklearn's own
+`predict_proba`, a flattened-forest path (`FlatForest`) stores every tree in
+shared node arrays. It is walked by a numba-compiled, multi-threaded kernel
+when numba is installed, otherwise with vectorized numpy gathers (slower than
+sklearn's Cython for deep trees, so "auto" then picks sklearn).
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+
+MODEL_PATH = "trained_model.pkl"
+CHUNK_SIZE = 100_000
+
+_models = {}
+
+def load_model(path=MODEL_PATH):
+    """Load a pickled model once per process and return the cached instance afterwards."""
+    if path not in _models:
+        import joblib
+        _models[path] = joblib.load(path)
+    return _models[path]
+
+def feature_plan(feature_names):
+    """
+    Split the model's feature names into numeric columns and one-hot (column, value) pairs.
+    :return: List of (source column, category value or None) in feature order.
+    """
+    categorical = ("material_name", "structure")
+    plan = []
+    for name in feature_names:
+        for column in categorical:
+            if name.startswith(column + "_"):
+                plan.append((column, name[len(column) + 1:]))
+                break
+        else:
+            plan.append((name, None))
+    return plan
+
+def encode_features(df, feature_names):
+    """
+    Encode a DataFrame (string or categorical columns) into the float32 matrix the model expects.
+    Equivalent to pd.get_dummies(df, drop_first=True) reindexed to `feature_names`.
+    """
+    X = np.zeros((len(df), len(feature_names)), dtype=np.float32)
+    for j, (column, value) in enumerate(feature_plan(feature_names)):
+        if value is None:
+            X[:, j] = df[column].to_numpy(dtype=np.float32)
+        else:
+            X[:, j] = (df[column] == value).to_numpy()
+    return X
+
+def _forest_proba_kernel(X, roots, feature, threshold, left, right, value, out):
+    """Walk every tree for every row and average the leaf probabilities into `out` (compiled by numba if available)."""
+    n_trees = roots.shape[0]
+    n_classes = value.shape[1]
+    for i in prange(X.shape[0]):
+        for t in range(n_trees):
+            node = roots[t]
+            while left[node] != node:  # Leaves point to themselves
+                if X[i, feature[node]] <= threshold[node]:
+                    node = left[node]
+                else:
+                    node = right[node]
+            for c in range(n_classes):
+                out[i, c] += value[node, c]
+        for c in range(n_classes):
+            out[i, c] /= n_trees
+
+try:
+    import numba
+    prange = numba.prange
+    _compiled_kernel = numba.njit(parallel=True, cache=True, nogil=True)(_forest_proba_kernel)
+except ImportError:  # numba is optional; FlatForest falls back to vectorized numpy
+    prange = range
+    _compiled_kernel = None
+
+class FlatForest:
+    """All trees of a fitted forest concatenated into flat node arrays and evaluated together."""
+
+    def __init__(self, forest):
+        """
+        :param forest: Fitted RandomForestClassifier (or ExtraTreesClassifier).
+        """
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            leaf = tree.children_left == -1
+            node_ids = np.arange(tree.node_count)
+            features.append(np.where(leaf, 0, tree.feature))
+            thresholds.append(np.where(leaf, np.inf, tree.threshold))
+            lefts.append(np.where(leaf, node_ids, tree.children_left) + offset)
+            rights.append(np.where(leaf, node_ids, tree.children_right) + offset)
+            value = tree.value[:, 0, :].astype(np.float64)
+            # Older sklearn versions store class counts, newer ones fractions; normalize either way
+            values.append(value / np.maximum(value.sum(axis=1, keepdims=True), 1e-12))
+            roots.append(offset)
+            offset += tree.node_count
+
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds)
+        self.left = np.concatenate(lefts).astype(np.intp)
+        self.right = np.concatenate(rights).astype(np.intp)
+        self.children = np.stack([self.left, self.right], axis=1).ravel()
+        self.is_leaf = self.left == np.arange(offset)
+        self.value = np.concatenate(values)
+        self.roots = np.array(roots, dtype=np.intp)
+        self.depth = max(estimator.tree_.max_depth for estimator in forest.estimators_)
+        self.classes_ = forest.classes_
+        self.n_features = forest.n_features_in_
+        self.backend = "numba" if _compiled_kernel is not None else "numpy"
+
+    def apply(self, X, steps_per_check=4):
+        """
+        Return the leaf reached in every tree: global node ids, shape (n_trees, n_rows).
+        (tree, row) pairs that reached a leaf are dropped every `steps_per_check` levels.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        flat = X.ravel()
+        n_rows = X.shape[0]
+        leaves = np.repeat(self.roots, n_rows)  # Tree-major
+        active = np.flatnonzero(~self.is_leaf[leaves])
+        nodes = leaves[active]
+        row_offsets = (active % n_rows) * self.n_features
+        while nodes.size:
+            for _ in range(steps_per_check):
+                go_right = flat[row_offsets + self.feature[nodes]] > self.threshold[nodes]
+                nodes = self.children[2 * nodes + go_right]
+            done = self.is_leaf[nodes]
+            leaves[active[done]] = nodes[done]
+            active, nodes, row_offsets = active[~done], nodes[~done], row_offsets[~done]
+        return leaves.reshape(len(self.roots), n_rows)
+
+    def predict_proba(self, X, block_rows=20_000):
+        """Mean class probabilities over all trees (numba kernel if installed, else `block_rows` at a time in numpy)."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        out = np.zeros((X.shape[0], len(self.classes_)))
+        if _compiled_kernel is not None:
+            _compiled_kernel(X, self.roots, self.feature, self.threshold, self.left, self.right, self.value, out)
+            return out
+        for start in range(0, X.shape[0], block_rows):
+            leaves = self.apply(X[start:start + block_rows])
+            out[start:start + block_rows] = self.value[leaves].mean(axis=0)
+        return out
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+class Scorer:
+    """Encodes input rows and scores them with either sklearn or the flattened forest."""
+
+    def __init__(self, model_path=MODEL_PATH, method="auto"):
+        """
+        :param method: "flat" (FlatForest), "sklearn" (the model's own predict_proba)
+                       or "auto" (flat when the numba kernel is available).
+        """
+        if method not in ("auto", "flat", "sklearn"):
+            raise ValueError(f"Unknown scoring method {method!r}")
+        if method == "auto":
+            method = "flat" if _compiled_kernel is not None else "sklearn"
+        self.model = load_model(model_path)
+        self.feature_names = list(self.model.feature_names_in_)
+        self.classes = list(self.model.classes_)
+        self.method = method
+        self.flat = FlatForest(self.model) if method == "flat" else None
+
+    def predict_proba(self, X):
+        if self.flat is not None:
+            return self.flat.predict_proba(X)
+        proba = self.model.predict_proba(X)
+        return proba / proba.sum(axis=1, keepdims=True)
+
+    def score(self, df):
+        """Return a dict of output columns (prediction and proba_<class>) for a DataFrame chunk."""
+        proba = self.predict_proba(encode_features(df, self.feature_names))
+        columns = {"prediction": np.asarray(self.classes)[proba.argmax(axis=1)]}
+        for k, label in enumerate(self.classes):
+            columns[f"proba_{label}"] = proba[:, k].astype(np.float32)
+        return columns
+
+_scorer = None
+
+def _init_worker(model_path, method):
+    global _scorer
+    _scorer = Scorer(model_path, method)
+    _scorer.model.n_jobs = 1  # One core per worker process
+
+def _score_batch(task):
+    batch, keep_columns = task
+    import pyarrow as pa
+
+    df = batch.to_pandas()
+    columns = {name: batch.column(name) for name in keep_columns}
+    columns.update(_scorer.score(df))
+    return pa.table(columns)
+
+def iter_batches(input_file, chunk_size=CHUNK_SIZE):
+    """Yield Arrow record batches of about `chunk_size` rows from a materials CSV or Parquet file."""
+    import pyarrow.parquet as pq
+
+    if input_file.endswith(".parquet"):
+        yield from pq.ParquetFile(input_file, memory_map=True).iter_batches(batch_size=chunk_size)
+        return
+
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    from materials_dataset import find_header
+
+    read_options = pa_csv.ReadOptions(skip_rows=find_header(input_file), block_size=1 << 22)
+    pending, rows = [], 0
+    for batch in pa_csv.open_csv(input_file, read_options=read_options):
+        pending.append(batch)
+        rows += batch.num_rows
+        if rows >= chunk_size:
+            table = pa.Table.from_batches(pending).combine_chunks()
+            yield from table.to_batches(max_chunksize=chunk_size)
+            pending, rows = [], 0
+    if pending:
+        yield from pa.Table.from_batches(pending).combine_chunks().to_batches(max_chunksize=chunk_size)
+
+def score_file(input_file, output_file, model_path=MODEL_PATH, chunk_size=CHUNK_SIZE, workers=None,
+               method="auto", keep_columns=()):
+    """
+    Score every row of a CSV/Parquet file and write predictions and probabilities to Parquet.
+    :param workers: Scoring processes (default: number of CPUs; 1 scores in this process).
+    :param keep_columns: Input columns copied to the output next to the scores.
+    :return: Dict with the number of rows and rows/sec.
+    """
+    import pyarrow.parquet as pq
+
+    workers = workers or os.cpu_count() or 1
+    directory = os.path.dirname(output_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    writer = None
+    rows = 0
+    start = time.perf_counter()
+
+    def write(table):
+        nonlocal writer, rows
+        if writer is None:
+            writer = pq.ParquetWriter(output_file, table.schema)
+        writer.write_table(table)
+        rows += table.num_rows
+
+    try:
+        tasks = ((batch, tuple(keep_columns)) for batch in iter_batches(input_file, chunk_size))
+        if workers == 1:
+            _init_worker(model_path, method)
+            for task in tasks:
+                write(_score_batch(task))
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(model_path, method)) as executor:
+                # Bounded look-ahead keeps memory proportional to workers * chunk_size
+                pending = []
+                for task in tasks:
+                    pending.append(executor.submit(_score_batch, task))
+                    if len(pending) >= 2 * workers:
+                        write(pending.pop(0).result())
+                for future in pending:
+                    write(future.result())
+    finally:
+        if writer is not None:
+            writer.close()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"✅ Scored {rows} rows -> {output_file} ({rows / elapsed:,.0f} rows/s, {workers} workers, {method})")
+    return {"rows": rows, "rows_per_sec": rows / elapsed}
+
+def benchmark(model_path=MODEL_PATH, input_file="data/raw/documents/fake_materials_data_with_labels.csv",
+              rows=1_000_000, repeats=3):
+    """
+    Compare sklearn predict_proba with FlatForest on `rows` encoded rows (the input is tiled as needed).
+    :return: Dict with rows/sec of both paths and the largest probability difference.
+    """
+    import pandas as pd
+    from materials_dataset import find_header
+
+    model = load_model(model_path)
+    df = pd.read_csv(input_file, skiprows=find_header(input_file))
+    df = df.iloc[np.arange(rows) % len(df)]
+    X = encode_features(df, list(model.feature_names_in_))
+    flat = FlatForest(model)
+
+    def best_time(fn):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = fn(X)
+            times.append(time.perf_counter() - start)
+        return min(times), result
+
+    sklearn_time, expected = best_time(model.predict_proba)
+    expected = expected / expected.sum(axis=1, keepdims=True)
+    flat_time, proba = best_time(flat.predict_proba)
+    result = {
+        "rows": rows,
+        "trees": len(model.estimators_),
+        "max_depth": flat.depth,
+        "sklearn_rows_per_sec": rows / sklearn_time,
+        "flat_backend": flat.backend,
+        "flat_rows_per_sec": rows / flat_time,
+        "max_abs_diff": float(np.abs(proba - expected).max()),
+    }
+    print(f"⏱️ sklearn predict_proba: {result['sklearn_rows_per_sec']:,.0f} rows/s | "
+          f"flattened forest ({flat.backend}): {result['flat_rows_per_sec']:,.0f} rows/s "
+          f"({result['trees']} trees, depth {result['max_depth']}, max diff {result['max_abs_diff']:.2e})")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score materials data with trained_model.pkl.")
+    parser.add_argument("input_file", nargs="?", default="data/raw/documents/fake_materials_data.csv",
+                        help="CSV or Parquet file to score")
+    parser.add_argument("--output_file", default="results/material_scores.parquet", help="Parquet output")
+    parser.add_argument("--model", default=MODEL_PATH, help="Pickled classifier")
+    parser.add_argument("--chunk_size", type=int, default=CHUNK_SIZE, help="Rows per scoring task")
+    parser.add_argument("--workers", type=int, default=None, help="Scoring processes (default: number of CPUs)")
+    parser.add_argument("--method", choices=["auto", "flat", "sklearn"], default="auto")
+    parser.add_argument("--keep_columns", nargs="*", default=["material_name", "structure"],
+                        help="Input columns copied to the output")
+    parser.add_argument("--benchmark", type=int, default=None, metavar="ROWS",
+                        help="Only benchmark sklearn vs the flattened forest on ROWS rows")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.model, rows=args.benchmark)
+    else:
+        score_file(args.input_file, args.output_file, args.model, args.chunk_size, args.workers,
+                   args.method, args.keep_columns)
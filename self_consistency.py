@@ -0,0 +1,224 @@
+"""
+Self-consistency CoT with a shared prefill and an adaptive sample count.
+
+Instead of answering a question with one sampled reasoning chain, several
+chains are sampled, the final answer of each is extracted and normalized,
+and the majority answer wins. The prompt is prefilled once: its
+past_key_values are copied into one row per sample and every round decodes
+its chains as a single batch from that shared cache (finished chains are
+dropped from the batch).
+
+Sampling stops as soon as the vote is decided, i.e. the leading answer
+cannot be overtaken by the samples still left out of `max_samples`. Each
+round only draws as many chains as could decide the vote if they all agree
+with the leader, so an easy question costs about half of `max_samples`
+chains and only contested ones use all of them.
+"""
+
+import re
+import copy
+import time
+import argparse
+from collections import Counter
+import torch
+from prefix_cache import _next_token
+from streaming import final_answer, make_condition
+
+# Where the final answer of a chain is stated, most explicit first (the last match in a chain wins)
+ANSWER_PATTERNS = (
+    re.compile(r"final answer\**\s*:\s*(.+)", re.IGNORECASE),
+    re.compile(r"\banswer is\s*:?\s*(.+)", re.IGNORECASE),
+    re.compile(r"\banswer\s*:\s*(.+)", re.IGNORECASE),
+)
+NUMBER_RE = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?", re.IGNORECASE)
+
+def extract_answer(chain):
+    """The final answer stated in a reasoning chain (its last non-empty line if none is marked)."""
+    for pattern in ANSWER_PATTERNS:
+        matches = pattern.findall(chain)
+        if matches:
+            # Keep the first sentence; ". " and not "." so decimals such as 0.1 survive
+            return re.split(r"\.\s", matches[-1].strip())[0].strip()
+    lines = [line.strip() for line in chain.splitlines() if line.strip()]
+    return lines[-1] if lines else ""
+
+def _number_token(match):
+    try:
+        value = format(float(match.group()), "g")
+    except ValueError:
+        return match.group()
+    # clean_text drops punctuation, so spell out the sign and decimal point (0.10, .1 and 0.1 all -> n0p1)
+    return f" n{value.replace('-', 'm').replace('+', '').replace('.', 'p')} "
+
+def normalize_answer(answer):
+    """Voting key of an answer: numbers canonicalized, then lowercased without punctuation (analyze_results.clean_text)."""
+    from analyze_results import clean_text
+    answer = re.sub(r"\s*\.$", "", answer.strip())  # A sentence's closing period is not a decimal point
+    return clean_text(NUMBER_RE.sub(_number_token, answer))
+
+def is_decided(counts, remaining):
+    """True once the leading answer keeps the majority whatever the `remaining` samples say."""
+    ranked = counts.most_common(2)
+    leader = ranked[0][1] if ranked else 0
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    return leader > runner_up + remaining
+
+def samples_to_decide(counts, remaining):
+    """Fewest further samples that decide the vote if they all agree with the current leader."""
+    ranked = counts.most_common(2)
+    leader = ranked[0][1] if ranked else 0
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    # leader + x > runner_up + (remaining - x)
+    return max(1, min(remaining, (runner_up + remaining - leader) // 2 + 1))
+
+def expand_past(past_key_values, n):
+    """Copy a batch-1 cache into `n` identical rows (the prefill itself is left untouched)."""
+    if isinstance(past_key_values, tuple):
+        return tuple(tuple(t.expand(n, *t.shape[1:]).contiguous() for t in layer) for layer in past_key_values)
+    past_key_values = copy.deepcopy(past_key_values)
+    past_key_values.batch_repeat_interleave(n)
+    return past_key_values
+
+def select_rows(past_key_values, rows):
+    """Keep only the cache rows of unfinished chains."""
+    if isinstance(past_key_values, tuple):
+        return tuple(tuple(t[rows] for t in layer) for layer in past_key_values)
+    past_key_values.batch_select_indices(rows)
+    return past_key_values
+
+@torch.no_grad()
+def sample_chains(model, tokenizer, past_key_values, logits, past_length, n, max_new_tokens,
+                  condition=None, temperature=0.7, top_k=50):
+    """
+    Sample `n` continuations in one batch from a prefilled prompt.
+    :param past_key_values: Cache of the prompt (batch 1), e.g. from `model(prompt, use_cache=True)`.
+    :param logits: Next-token logits after the prompt, shape (1, vocab).
+    :param condition: StopCondition ending a chain early (e.g. after its "Final answer:" line).
+    :return: (list of chain texts, tokens generated).
+    """
+    condition = make_condition(condition)
+    eos_token_id = tokenizer.eos_token_id
+    past = expand_past(past_key_values, n)
+    logits = logits.expand(n, -1)
+    attention_mask = torch.ones(n, past_length, dtype=torch.long, device=logits.device)
+    generated = [[] for _ in range(n)]
+    active = list(range(n))  # Chain index of every row still in the batch
+    tokens_generated = 0
+
+    for step in range(max_new_tokens):
+        tokens = _next_token(logits, True, temperature, top_k)
+        keep = []
+        for row, (chain, token) in enumerate(zip(active, tokens[:, 0].tolist())):
+            if token == eos_token_id:
+                continue
+            generated[chain].append(token)
+            tokens_generated += 1
+            if condition and condition.find(tokenizer.decode(generated[chain], skip_special_tokens=True))[0] is not None:
+                continue
+            keep.append(row)
+        if not keep or step == max_new_tokens - 1:
+            break
+        if len(keep) < len(active):
+            index = torch.tensor(keep, device=logits.device)
+            past = select_rows(past, index)
+            tokens, attention_mask = tokens[index], attention_mask[index]
+            active = [active[row] for row in keep]
+        attention_mask = torch.cat([attention_mask, attention_mask.new_ones(len(active), 1)], dim=1)
+        out = model(input_ids=tokens, past_key_values=past, attention_mask=attention_mask, use_cache=True)
+        past, logits = out.past_key_values, out.logits[:, -1, :]
+
+    texts = [tokenizer.decode(ids, skip_special_tokens=True) for ids in generated]
+    return [condition.apply(text) for text in texts], tokens_generated
+
+@torch.no_grad()
+def self_consistency(model, tokenizer, input_ids, max_samples=8, round_size=None, max_new_tokens=128,
+                     temperature=0.7, top_k=50, condition=None, adaptive=True):
+    """
+    Majority-vote answer over sampled CoT chains for one prompt.
+    :param input_ids: Prompt token ids (list of ints).
+    :param max_samples: Chains drawn at most (the fixed N of plain self-consistency).
+    :param round_size: Largest batch sampled per round (default: max_samples).
+    :param condition: StopCondition ending each chain (default: after its "Final answer:" line).
+    :param adaptive: Stop as soon as the vote is decided; False always draws `max_samples` in one round.
+    :return: Dict with the answer, a chain that gave it, the vote counts, samples drawn and saved, and timings.
+    """
+    if condition is None:
+        condition = make_condition(None, final_answer)
+    round_size = round_size or max_samples
+    start = time.perf_counter()
+    prompt = torch.tensor([input_ids], device=model.device)
+    out = model(input_ids=prompt, attention_mask=torch.ones_like(prompt), use_cache=True)  # Shared prefill
+    prefill_time = time.perf_counter() - start
+
+    chains, keys, counts = [], [], Counter()
+    tokens_generated, rounds = 0, 0
+    while len(chains) < max_samples:
+        remaining = max_samples - len(chains)
+        n = min(round_size, samples_to_decide(counts, remaining) if adaptive else remaining)
+        texts, generated = sample_chains(model, tokenizer, out.past_key_values, out.logits[:, -1, :], len(input_ids),
+                                         n, max_new_tokens, condition, temperature, top_k)
+        tokens_generated += generated
+        rounds += 1
+        for text in texts:
+            key = normalize_answer(extract_answer(text))
+            chains.append(text)
+            keys.append(key)
+            if key:  # Chains without an answer abstain
+                counts[key] += 1
+        if adaptive and is_decided(counts, max_samples - len(chains)):
+            break
+
+    winner = counts.most_common(1)[0][0] if counts else ""
+    chain = chains[keys.index(winner)] if winner in keys else chains[0]
+    return {
+        "answer": extract_answer(chain),
+        "chain": chain,
+        "votes": dict(counts),
+        "agreement": counts[winner] / len(chains) if counts else 0.0,
+        "samples": len(chains),
+        "max_samples": max_samples,
+        "samples_saved": max_samples - len(chains),
+        "rounds": rounds,
+        "tokens_generated": tokens_generated,
+        "prefill_tokens_saved": (len(chains) - 1) * len(input_ids),  # vs. one prefill per sample
+        "prefill_sec": prefill_time,
+        "elapsed_sec": time.perf_counter() - start,
+    }
+
+def benchmark(model, tokenizer, prompts, max_samples=8, max_new_tokens=64, seed=0):
+    """Compare adaptive stopping with always drawing `max_samples` chains on the same prompts."""
+    totals = {}
+    for adaptive in (False, True):
+        torch.manual_seed(seed)
+        samples = elapsed = 0
+        for prompt in prompts:
+            result = self_consistency(model, tokenizer, tokenizer(prompt)["input_ids"], max_samples,
+                                      max_new_tokens=max_new_tokens, adaptive=adaptive)
+            samples += result["samples"]
+            elapsed += result["elapsed_sec"]
+        totals["adaptive" if adaptive else "fixed"] = {"samples": samples, "elapsed_sec": elapsed}
+    fixed, adaptive = totals["fixed"], totals["adaptive"]
+    saved = 1 - adaptive["samples"] / fixed["samples"] if fixed["samples"] else 0.0
+    print(f"🗳️ Fixed N={max_samples}: {fixed['samples']} chains in {fixed['elapsed_sec']:.1f}s | "
+          f"adaptive: {adaptive['samples']} chains in {adaptive['elapsed_sec']:.1f}s ({saved:.0%} of samples saved)")
+    return totals
+
+if __name__ == "__main__":
+    import json
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from prompts import get_prompt
+
+    parser = argparse.ArgumentParser(description="Benchmark adaptive self-consistency against a fixed sample count.")
+    parser.add_argument("--model", default="gpt2", help="Model name or path")
+    parser.add_argument("--input_file", default="db/questions/cot_questions_clean.json", help="Question file")
+    parser.add_argument("--samples", type=int, default=8, help="Maximum chains per question")
+    parser.add_argument("--max_new_tokens", type=int, default=64)
+    parser.add_argument("--limit", type=int, default=20, help="Number of questions")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model).eval()
+    with open(args.input_file, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)][:args.limit]
+    benchmark(model, tokenizer, [get_prompt("evaluation", "cot", question=q) for q in questions],
+              args.samples, args.max_new_tokens)
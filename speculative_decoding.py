@@ -0,0 +1,195 @@
+"""
+Speculative (draft-model assisted) decoding.
+
+A small draft model sharing the target's tokenizer proposes `k` tokens one at
+a time; the large target model scores all of them in a single forward pass and
+keeps the longest prefix it agrees with, plus one token of its own. Greedy
+output is identical to plain greedy decoding with the target model; sampled
+output follows the target distribution (rejection sampling as in Leviathan et
+al., 2023), so only the number of expensive target passes changes.
+"""
+
+import time
+import argparse
+import torch
+
+def check_vocab_compatible(tokenizer, draft_tokenizer):
+    """Raise ValueError unless both tokenizers map every token to the same id."""
+    if draft_tokenizer is None or draft_tokenizer is tokenizer:
+        return
+    if tokenizer.get_vocab() != draft_tokenizer.get_vocab():
+        raise ValueError("Draft model tokenizer does not share the target vocabulary; "
+                         "speculative decoding needs identical token ids")
+
+def crop_past(past_key_values, length):
+    """Drop cached positions beyond `length` (tuple caches are sliced, Cache objects cropped in place)."""
+    if past_key_values is None:
+        return None
+    if isinstance(past_key_values, tuple):
+        return tuple(tuple(t[:, :, :length] for t in layer) for layer in past_key_values)
+    current = past_key_values.get_seq_length()
+    if current > length:
+        past_key_values.crop(length - current)  # A negative value removes that many tokens
+    return past_key_values
+
+def _probs(logits, temperature, top_k):
+    logits = logits.float() / max(temperature, 1e-5)
+    if top_k:
+        kth = torch.topk(logits, min(top_k, logits.shape[-1])).values[..., -1, None]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+    return torch.softmax(logits, dim=-1)
+
+def _forward(model, ids, past_key_values, past_length):
+    """Run `ids` on top of a cache covering `past_length` tokens; return (logits [len, vocab], new cache)."""
+    input_ids = torch.tensor([ids], device=model.device)
+    attention_mask = torch.ones(1, past_length + len(ids), dtype=torch.long, device=model.device)
+    out = model(input_ids=input_ids, past_key_values=past_key_values, attention_mask=attention_mask, use_cache=True)
+    return out.logits[0], out.past_key_values
+
+@torch.no_grad()
+def speculative_generate(target_model, draft_model, input_ids, max_new_tokens=32, k=4, eos_token_id=None,
+                         do_sample=False, temperature=1.0, top_k=50):
+    """
+    Generate up to `max_new_tokens` tokens after `input_ids` (a list of ids, batch size 1).
+    :param k: Number of tokens the draft model proposes per target pass.
+    :return: (generated token ids as a list, stats dict with acceptance rate and tokens/sec).
+    """
+    tokens = list(input_ids)
+    prompt_length = len(tokens)
+    vocab = min(target_model.get_output_embeddings().out_features, draft_model.get_output_embeddings().out_features)
+    target_past = draft_past = None
+    target_cached = draft_cached = 0  # Tokens covered by each cache
+    drafted = accepted = target_passes = 0
+    start = time.perf_counter()
+
+    while len(tokens) - prompt_length < max_new_tokens:
+        steps = min(k, max_new_tokens - (len(tokens) - prompt_length))
+
+        # Draft: propose `steps` tokens one at a time
+        draft, draft_probs = [], []
+        pending = tokens[draft_cached:]
+        for _ in range(steps):
+            logits, draft_past = _forward(draft_model, pending, draft_past, draft_cached)
+            draft_cached += len(pending)
+            logits = logits[-1, :vocab]
+            if do_sample:
+                q = _probs(logits, temperature, top_k)
+                token = int(torch.multinomial(q, 1))
+                draft_probs.append(q)
+            else:
+                token = int(logits.argmax())
+            draft.append(token)
+            pending = [token]
+
+        # Target: score the uncached tail plus every draft token in one pass
+        tail = tokens[target_cached:]
+        logits, target_past = _forward(target_model, tail + draft, target_past, target_cached)
+        target_passes += 1
+        logits = logits[len(tail) - 1:, :vocab]  # Row i predicts draft[i]; the last row is the bonus token
+
+        n = 0
+        if do_sample:
+            p = _probs(logits, temperature, top_k)
+            while n < steps:
+                token = draft[n]
+                if torch.rand(()) * draft_probs[n][token] > p[n, token]:
+                    break
+                n += 1
+            if n < steps:
+                residual = torch.clamp(p[n] - draft_probs[n], min=0)
+                total = residual.sum()
+                next_token = int(torch.multinomial(residual / total if total > 0 else p[n], 1))
+            else:
+                next_token = int(torch.multinomial(p[n], 1))
+        else:
+            predicted = logits.argmax(dim=-1).tolist()
+            while n < steps and predicted[n] == draft[n]:
+                n += 1
+            next_token = predicted[n]
+
+        drafted += steps
+        accepted += n
+        new = draft[:n] + [next_token]
+        # Both caches may only cover tokens that were kept; the new token is fed on the next round
+        target_cached = len(tokens) + n
+        draft_cached = min(draft_cached, target_cached)
+        target_past = crop_past(target_past, target_cached)
+        draft_past = crop_past(draft_past, draft_cached)
+        tokens.extend(new)
+
+        if eos_token_id is not None and eos_token_id in new:
+            del tokens[len(tokens) - len(new) + new.index(eos_token_id) + 1:]
+            break
+
+    generated = tokens[prompt_length:prompt_length + max_new_tokens]
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    stats = {
+        "new_tokens": len(generated),
+        "drafted": drafted,
+        "accepted": accepted,
+        "acceptance_rate": accepted / drafted if drafted else 0.0,
+        "target_passes": target_passes,
+        "tokens_per_target_pass": len(generated) / target_passes if target_passes else 0.0,
+        "tokens_per_sec": len(generated) / elapsed,
+        "elapsed": elapsed,
+    }
+    return generated, stats
+
+def benchmark_speculative(target_model, draft_model, tokenizer, prompts, max_new_tokens=32, k=4):
+    """
+    Compare greedy speculative decoding with plain greedy decoding of the target model.
+    :return: Dict with tokens/sec of both paths, the acceptance rate and whether all outputs matched.
+    """
+    from prefix_cache import decode
+
+    plain_time = spec_time = 0.0
+    plain_tokens = spec_tokens = drafted = accepted = 0
+    mismatches = 0
+    for prompt in prompts:
+        ids = tokenizer(prompt)["input_ids"]
+        start = time.perf_counter()
+        expected, _ = decode(target_model, torch.tensor([ids], device=target_model.device),
+                             max_new_tokens=max_new_tokens, eos_token_id=tokenizer.eos_token_id)
+        plain_time += time.perf_counter() - start
+        plain_tokens += len(expected)
+
+        generated, stats = speculative_generate(target_model, draft_model, ids, max_new_tokens, k,
+                                                tokenizer.eos_token_id)
+        spec_time += stats["elapsed"]
+        spec_tokens += stats["new_tokens"]
+        drafted += stats["drafted"]
+        accepted += stats["accepted"]
+        mismatches += generated != expected
+
+    result = {
+        "prompts": len(prompts),
+        "k": k,
+        "plain_tokens_per_sec": plain_tokens / plain_time if plain_time else 0.0,
+        "speculative_tokens_per_sec": spec_tokens / spec_time if spec_time else 0.0,
+        "acceptance_rate": accepted / drafted if drafted else 0.0,
+        "outputs_match": mismatches == 0,
+    }
+    print(f"⏱️ {result['plain_tokens_per_sec']:.1f} -> {result['speculative_tokens_per_sec']:.1f} token/s "
+          f"(k={k}, acceptance {result['acceptance_rate']:.0%}), outputs match: {result['outputs_match']}")
+    return result
+
+if __name__ == "__main__":
+    import json
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    parser = argparse.ArgumentParser(description="Benchmark speculative decoding against plain greedy decoding.")
+    parser.add_argument("--target", required=True, help="Target model name or path")
+    parser.add_argument("--draft", required=True, help="Draft model name or path (same tokenizer)")
+    parser.add_argument("--input_file", default="db/questions/cot_questions_clean.json", help="Question file")
+    parser.add_argument("--k", type=int, default=4, help="Draft tokens per target pass")
+    parser.add_argument("--max_new_tokens", type=int, default=32)
+    parser.add_argument("--limit", type=int, default=20, help="Number of questions to use")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.target)
+    check_vocab_compatible(tokenizer, AutoTokenizer.from_pretrained(args.draft))
+    target = AutoModelForCausalLM.from_pretrained(args.target).eval()
+    draft = AutoModelForCausalLM.from_pretrained(args.draft).to(target.device).eval()
+    with open(args.input_file, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)][:args.limit]
+    benchmark_speculative(target, draft, tokenizer, questions, args.max_new_tokens, args.k)
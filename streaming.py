@@ -0,0 +1,410 @@
+"""
+Streaming generation with early stop.
+
+A stream yields text deltas as the model produces them and ends as soon as a
+stop sequence appears or a stop predicate fires, for example once the
+"Final answer: ..." line of a CoT answer is complete. Generation itself is
+halted: a local model stops at the next decoding step, and a remote one has
+its response closed. Each stream records its time to first token and the
+number of its `max_tokens` that were never generated (`stream.stats`).
+
+    stream = model_manager.stream_text(prompt, "llama", stop_predicate=final_answer)
+    for delta in stream:
+        print(delta, end="", flush=True)
+    print(stream.stats.as_dict())
+
+Stop sequences are excluded from the output (like the OpenAI `stop`
+parameter). A predicate gets the text generated so far and returns None/False
+to continue, True to stop after the whole text, or an index to cut it at.
+"""
+
+import re
+import time
+import threading
+from telemetry import NULL_SPAN
+
+# A complete, non-empty "Final answer: ..." line (ended by a newline)
+FINAL_ANSWER_PATTERN = re.compile(r"^[^\S\n]*\**final answer\**\s*:[^\n]*\S[^\n]*\n", re.IGNORECASE | re.MULTILINE)
+
+def final_answer(text):
+    """Stop predicate: cut after the first complete "Final answer: ..." line."""
+    match = FINAL_ANSWER_PATTERN.search(text)
+    return match.end() - 1 if match else None
+
+class StopCondition:
+    """Stop sequences and/or a stop predicate, checked against the generated text."""
+
+    def __init__(self, stop=None, predicate=None):
+        """
+        :param stop: A stop sequence or a list of them.
+        :param predicate: Callable(text) -> None/False (continue), True (stop) or an index to cut the text at.
+        """
+        if isinstance(stop, str):
+            stop = [stop]
+        self.stop = [sequence for sequence in (stop or []) if sequence]
+        self.predicate = predicate
+        # Characters held back from the stream until they cannot be the start of a stop sequence
+        self.holdback = max((len(sequence) for sequence in self.stop), default=1) - 1
+
+    def __bool__(self):
+        return bool(self.stop or self.predicate)
+
+    def find(self, text):
+        """
+        Where `text` should end and why.
+        :return: (index, "stop" or "predicate"), or (None, None) to keep generating.
+        """
+        cut, reason = None, None
+        for sequence in self.stop:
+            index = text.find(sequence)
+            if index != -1 and (cut is None or index < cut):
+                cut, reason = index, "stop"
+        if self.predicate is not None:
+            result = self.predicate(text)
+            if result is not None and result is not False:
+                end = len(text) if result is True else result
+                if cut is None or end < cut:
+                    cut, reason = end, "predicate"
+        return cut, reason
+
+    def apply(self, text):
+        """`text` cut at the stop condition, if it is met."""
+        cut, _ = self.find(text)
+        return text if cut is None else text[:cut]
+
+    def cache_params(self):
+        """The condition as extra generation-cache key parameters ({} when there is none)."""
+        if not self:
+            return {}
+        predicate = self.predicate
+        name = None if predicate is None else f"{getattr(predicate, '__module__', '')}.{getattr(predicate, '__qualname__', repr(predicate))}"
+        return {"stop": self.stop, "stop_predicate": name}
+
+def make_condition(stop=None, predicate=None):
+    """A StopCondition for `stop`/`predicate` (an existing StopCondition is passed through)."""
+    if isinstance(stop, StopCondition):
+        return stop
+    return StopCondition(stop, predicate)
+
+class StreamStats:
+    """Timing and token accounting of one stream."""
+
+    def __init__(self, max_tokens):
+        self.max_tokens = max_tokens
+        self.start = time.perf_counter()
+        self.ttft = None
+        self.latency = None
+        self.tokens = 0
+        self.stop_reason = None  # "stop", "predicate", "eos", "length", "cancelled" or "error"
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.start
+
+    @property
+    def tokens_saved(self):
+        """Tokens of the `max_tokens` budget not generated because the stop condition ended the stream."""
+        if self.stop_reason not in ("stop", "predicate") or self.max_tokens is None:
+            return 0
+        return max(0, self.max_tokens - self.tokens)
+
+    def as_dict(self):
+        return {"ttft_s": self.ttft, "latency_s": self.latency, "completion_tokens": self.tokens,
+                "max_tokens": self.max_tokens, "tokens_saved": self.tokens_saved, "stop_reason": self.stop_reason}
+
+class _Deltas:
+    """Turns raw text chunks into deltas that never contain (part of) a stop sequence."""
+
+    def __init__(self, condition):
+        self.condition = condition
+        self.text = ""
+        self.sent = 0
+        self.reason = None
+
+    def feed(self, chunk):
+        """Add a chunk; return the delta that is safe to emit (sets `reason` once the condition is met)."""
+        self.text += chunk
+        if self.condition:
+            cut, reason = self.condition.find(self.text)
+            if cut is not None:
+                self.reason = reason
+                self.text = self.text[:cut]
+                return self._emit(cut)
+        return self._emit(len(self.text) - self.condition.holdback)
+
+    def flush(self):
+        return self._emit(len(self.text))
+
+    def _emit(self, end):
+        if end <= self.sent:
+            return ""
+        delta = self.text[self.sent:end]
+        self.sent = end
+        return delta
+
+class _BaseStream:
+    def __init__(self, chunks, condition, stats, span=NULL_SPAN, cancel=None, tokens=None):
+        """
+        :param chunks: (Async) iterator of raw text pieces from the backend.
+        :param stats: StreamStats started when the request was sent.
+        :param span: Telemetry span already started with span.start(); finished when the stream closes.
+        :param cancel: Called when the stream closes, to halt a generation that is still running.
+        :param tokens: Callable(text) returning the number of tokens generated so far.
+        """
+        self._chunks = chunks
+        self._deltas = _Deltas(make_condition(condition))
+        self.stats = stats
+        self.span = span
+        self._cancel = cancel
+        self._tokens = tokens or (lambda text: max(1, len(text) // 4) if text else 0)
+        self._error = None
+        self._closed = False
+
+    @property
+    def text(self):
+        """The text generated so far, cut at the stop condition."""
+        return self._deltas.text
+
+    def _on_chunk(self, chunk):
+        if chunk:
+            self.stats.first_token()
+            self.span.first_token()
+        delta = self._deltas.feed(chunk)
+        return delta, self._deltas.reason is not None
+
+    def _finish(self):
+        if self._cancel is not None:
+            self._cancel()
+        stats = self.stats
+        stats.latency = time.perf_counter() - stats.start
+        stats.tokens = self._tokens(self.text)
+        if self._error is not None:
+            stats.stop_reason = "error"
+        elif self._deltas.reason is not None:
+            stats.stop_reason = self._deltas.reason
+        elif stats.stop_reason is None:
+            stats.stop_reason = "cancelled"
+        self.span.update(completion_tokens=stats.tokens, tokens_saved=stats.tokens_saved, stop_reason=stats.stop_reason)
+        self.span.finish(self._error)
+
+    def _natural_end(self):
+        """Stop reason of a stream that ran out of chunks on its own."""
+        tokens = self._tokens(self.text)
+        return "length" if self.stats.max_tokens is not None and tokens >= self.stats.max_tokens else "eos"
+
+class TextStream(_BaseStream):
+    """
+    Iterator of text deltas that stops at a StopCondition.
+    Use it in a `with` block (or call close()) when the loop may be left early.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._iterator = self._run()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _run(self):
+        try:
+            for chunk in self._chunks:
+                delta, stopped = self._on_chunk(chunk)
+                if delta:
+                    yield delta
+                if stopped:
+                    return
+            delta = self._deltas.flush()
+            self.stats.stop_reason = self._natural_end()
+            if delta:
+                yield delta
+        except Exception as e:
+            self._error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.close()
+
+    def read(self):
+        """Consume the rest of the stream and return the whole text."""
+        for _ in self:
+            pass
+        return self.text
+
+    def close(self):
+        """Halt generation (if still running) and record the stream's stats."""
+        if self._closed:
+            return
+        self._closed = True
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+        self._finish()
+
+class AsyncTextStream(_BaseStream):
+    """Async iterator of text deltas that stops at a StopCondition (see TextStream)."""
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        try:
+            while True:
+                try:
+                    chunk = await self._chunks.__anext__()
+                except StopAsyncIteration:
+                    delta = self._deltas.flush()
+                    self.stats.stop_reason = self._natural_end()
+                    await self.aclose()
+                    if delta:
+                        return delta
+                    raise
+                delta, stopped = self._on_chunk(chunk)
+                if stopped:
+                    await self.aclose()
+                if delta:
+                    return delta
+                if stopped:
+                    raise StopAsyncIteration
+        except StopAsyncIteration:
+            raise
+        except Exception as e:
+            self._error = f"{type(e).__name__}: {e}"
+            await self.aclose()
+            raise
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+        return False
+
+    async def read(self):
+        """Consume the rest of the stream and return the whole text."""
+        async for _ in self:
+            pass
+        return self.text
+
+    async def aclose(self):
+        """Close the backend response (if still open) and record the stream's stats."""
+        if self._closed:
+            return
+        self._closed = True
+        aclose = getattr(self._chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        self._finish()
+
+class StopCriteria:
+    """
+    transformers stopping criterion: ends generate() once every row has met `condition` (or
+    produced EOS), or once `cancel` is set. Also counts decoding steps and reports the first one.
+    """
+
+    def __init__(self, tokenizer, prompt_width, condition=None, cancel=None, on_first_token=None):
+        """
+        :param prompt_width: Width of the (padded) prompt; later positions are generated tokens.
+        """
+        self.tokenizer = tokenizer
+        self.prompt_width = prompt_width
+        self.condition = make_condition(condition)
+        self.cancel = cancel
+        self.on_first_token = on_first_token
+        self.steps = 0
+        self.done = None  # Per row: stop condition met or EOS produced
+        self.matched = 0  # Rows stopped by the condition rather than EOS
+        self.triggered = False  # generate() was ended early by this criterion
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.steps += 1
+        if self.steps == 1 and self.on_first_token is not None:
+            self.on_first_token()
+        if self.cancel is not None and self.cancel.is_set():
+            self.triggered = True
+            return True
+        if not self.condition:
+            return False
+        if self.done is None:
+            self.done = [False] * input_ids.shape[0]
+        eos = self.tokenizer.eos_token_id
+        for row, ids in enumerate(input_ids):
+            if self.done[row]:
+                continue
+            generated = ids[self.prompt_width:].tolist()
+            if eos is not None and eos in generated:
+                self.done[row] = True
+                continue
+            text = self.tokenizer.decode(generated, skip_special_tokens=True)
+            if self.condition.find(text)[0] is not None:
+                self.done[row] = True
+                self.matched += 1
+        self.triggered = self.matched > 0 and all(self.done)
+        return self.triggered
+
+def hf_stream(model, tokenizer, input_ids, max_new_tokens, condition=None, span=NULL_SPAN, **generate_kwargs):
+    """
+    Stream a local transformers model: generate() runs in a thread that feeds a TextIteratorStreamer.
+    :param input_ids: Prompt token ids (list of ints).
+    :param condition: StopCondition (or stop sequences) checked after every decoding step.
+    :param span: Telemetry span, started here and finished when the stream closes.
+    :param generate_kwargs: Extra generate() arguments, e.g. do_sample, temperature, pad_token_id.
+    :return: TextStream of the generated text (without the prompt).
+    """
+    import torch
+    from transformers import StoppingCriteriaList, TextIteratorStreamer
+
+    condition = make_condition(condition)
+    span.start()
+    stats = StreamStats(max_new_tokens)
+    cancel = threading.Event()
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+    def on_first_token():
+        stats.first_token()
+        span.first_token()
+
+    criteria = StopCriteria(tokenizer, len(input_ids), condition, cancel, on_first_token)
+    errors = []
+
+    def run():
+        try:
+            ids = torch.tensor([input_ids], device=model.device)
+            with torch.no_grad():
+                model.generate(ids, attention_mask=torch.ones_like(ids), max_new_tokens=max_new_tokens,
+                               streamer=streamer, stopping_criteria=StoppingCriteriaList([criteria]),
+                               **generate_kwargs)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    def chunks():
+        yield from streamer
+        thread.join()
+        if errors:
+            raise errors[0]
+
+    def stop():
+        cancel.set()
+        thread.join()
+
+    return TextStream(chunks(), condition, stats, span, cancel=stop, tokens=lambda text: criteria.steps)
+
+def condition_from_cli(stop=None, stop_at_final_answer=False):
+    """StopCondition from command-line values: `--stop` strings (with \\n-style escapes) and `--final_answer`."""
+    # backslashreplace keeps non-ASCII stop strings intact through unicode_escape
+    sequences = [value.encode("latin-1", "backslashreplace").decode("unicode_escape") for value in stop or []]
+    return StopCondition(sequences, final_answer if stop_at_final_answer else None)
@@ -0,0 +1,375 @@
+"""
+Per-request inference telemetry for every generation backend.
+
+Each generation call is wrapped in a span that records one structured event:
+backend, model, prompt/completion tokens, latency, time to first token,
+tokens/sec, attempts/retries, peak memory and errors. Events are appended to
+a JSONL file; rolling p50/p95/p99 summaries per backend are kept in memory and
+periodically written as a Prometheus text-format file (for node_exporter's
+textfile collector or any scraper that reads files).
+
+Telemetry is off unless TELEMETRY=1 (or `enable()` is called). When off,
+`track()` returns a shared no-op span, so the instrumented code pays one
+global lookup per request and nothing else.
+
+    TELEMETRY=1 python cli.py generate "..." --model_type llama
+    python telemetry.py results/telemetry/events.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import threading
+import contextvars
+from collections import defaultdict, deque
+
+TELEMETRY_ENABLED = os.getenv("TELEMETRY", "0") == "1"
+TELEMETRY_DIR = os.getenv("TELEMETRY_DIR", "results/telemetry")
+TELEMETRY_WINDOW = int(os.getenv("TELEMETRY_WINDOW", 1000))  # events per backend kept for percentiles
+TELEMETRY_EXPORT_INTERVAL = float(os.getenv("TELEMETRY_EXPORT_INTERVAL", 10))  # seconds between .prom rewrites
+
+QUANTILES = (0.5, 0.95, 0.99)
+# Event field -> (Prometheus summary name, help text)
+SUMMARIES = {
+    "latency_s": ("llm_request_latency_seconds", "End-to-end generation latency"),
+    "ttft_s": ("llm_time_to_first_token_seconds", "Time from request start to the first generated token"),
+    "tokens_per_sec": ("llm_completion_tokens_per_second", "Completion tokens per second of latency"),
+}
+# Event field -> (Prometheus counter name, help text)
+COUNTERS = {
+    "prompt_tokens": ("llm_prompt_tokens_total", "Prompt tokens processed"),
+    "completion_tokens": ("llm_completion_tokens_total", "Completion tokens generated"),
+    "retries": ("llm_retries_total", "Generation attempts beyond the first"),
+    "tokens_saved": ("llm_early_stop_tokens_saved_total", "Tokens of max_tokens never generated thanks to a stop condition"),
+}
+
+def _peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _cuda():
+    """torch.cuda if torch is already imported and a GPU is in use; never imports torch itself."""
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+        return torch.cuda
+    return None
+
+_current = contextvars.ContextVar("telemetry_span", default=None)
+
+class _NullSpan:
+    """Span used when telemetry is disabled: every method is a no-op and it is falsy."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def start(self):
+        return self
+
+    def finish(self, error=None):
+        pass
+
+    def attempt(self):
+        pass
+
+    def first_token(self):
+        pass
+
+    def update(self, **fields):
+        pass
+
+NULL_SPAN = _NullSpan()
+
+class Span:
+    """One generation request; use as a context manager, the event is recorded on exit."""
+
+    def __init__(self, telemetry, backend, model=None, **fields):
+        self.telemetry = telemetry
+        self.fields = {"backend": backend, "model": model, "prompt_tokens": None, "completion_tokens": None,
+                       "error": None, **fields}
+        self.attempts = 0
+        self.ttft = None
+        self._start = None
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        self.finish(f"{exc_type.__name__}: {exc}" if exc is not None else None)
+        return False
+
+    def start(self):
+        """Start timing without making this the current span (for streams that outlive a `with` block)."""
+        cuda = _cuda()
+        if cuda is not None:
+            cuda.reset_peak_memory_stats()
+        self._start = time.perf_counter()
+        return self
+
+    def finish(self, error=None):
+        """Record the event; `error` overrides any error set with update()."""
+        latency = time.perf_counter() - self._start
+        if error is not None:
+            self.fields["error"] = error
+        completion = self.fields["completion_tokens"]
+        cuda = _cuda()
+        event = {
+            "timestamp": time.time(),
+            **self.fields,
+            "latency_s": latency,
+            "ttft_s": self.ttft,
+            "tokens_per_sec": completion / latency if completion and latency > 0 else None,
+            "attempts": max(1, self.attempts),
+            "retries": max(0, self.attempts - 1),
+            "peak_memory_bytes": cuda.max_memory_allocated() if cuda is not None else _peak_rss_bytes(),
+            "memory_source": "cuda" if cuda is not None else "rss",
+        }
+        self.telemetry.record(event)
+
+    def __bool__(self):
+        return True
+
+    def attempt(self):
+        """Count one generation attempt (call at the start of every retried function); clears earlier errors."""
+        self.attempts += 1
+        self.fields["error"] = None
+
+    def first_token(self):
+        """Mark the arrival of the first generated token (only the first call counts)."""
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self._start
+
+    def update(self, **fields):
+        """Set event fields such as prompt_tokens, completion_tokens or error."""
+        self.fields.update(fields)
+
+class FirstTokenStreamer:
+    """Minimal streamer for `model.generate(streamer=...)`: marks the span's first token, nothing else."""
+
+    def __init__(self, span):
+        self.span = span
+        self._calls = 0
+
+    def put(self, value):
+        # generate() passes the prompt ids first, then each new token
+        self._calls += 1
+        if self._calls == 2:
+            self.span.first_token()
+
+    def end(self):
+        pass
+
+def first_token_streamer(span):
+    """A FirstTokenStreamer for `span`, or None when telemetry is disabled (so generate() runs unchanged)."""
+    return FirstTokenStreamer(span) if span else None
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list."""
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+class Telemetry:
+    """Collects span events: JSONL log, rolling percentiles and Prometheus text export."""
+
+    def __init__(self, directory=TELEMETRY_DIR, window=TELEMETRY_WINDOW, export_interval=TELEMETRY_EXPORT_INTERVAL):
+        """
+        :param directory: Where events.jsonl and metrics.prom are written (None = keep in memory only).
+        :param window: Number of recent events per backend used for the p50/p95/p99 summaries.
+        :param export_interval: Minimum seconds between rewrites of metrics.prom.
+        """
+        self.directory = directory
+        self.events_path = os.path.join(directory, "events.jsonl") if directory else None
+        self.metrics_path = os.path.join(directory, "metrics.prom") if directory else None
+        self.window = window
+        self.export_interval = export_interval
+        self._windows = defaultdict(lambda: {field: deque(maxlen=window) for field in SUMMARIES})
+        self._totals = defaultdict(lambda: defaultdict(float))
+        self._peak_memory = {}
+        self._lock = threading.Lock()
+        self._last_export = 0.0
+        self._file = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._file = open(self.events_path, "a", encoding="utf-8")
+
+    def span(self, backend, model=None, **fields):
+        return Span(self, backend, model, **fields)
+
+    def record(self, event):
+        """Add one event to the log and the running summaries."""
+        backend = event["backend"]
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + "\n")
+                self._file.flush()
+            windows = self._windows[backend]
+            totals = self._totals[backend]
+            totals["requests"] += 1
+            totals["errors"] += event.get("error") is not None
+            for field, values in windows.items():
+                if event.get(field) is not None:
+                    values.append(event[field])
+                    totals[f"{field}_sum"] += event[field]
+                    totals[f"{field}_count"] += 1
+            for field in COUNTERS:
+                totals[field] += event.get(field) or 0
+            if event.get("peak_memory_bytes") is not None:
+                self._peak_memory[backend] = max(self._peak_memory.get(backend, 0), event["peak_memory_bytes"])
+            due = self.metrics_path and time.monotonic() - self._last_export >= self.export_interval
+        if due:
+            self.export()
+
+    def summary(self):
+        """
+        Rolling percentiles over the last `window` events of each backend.
+        :return: {backend: {"requests": n, "errors": n, field: {"p50": .., "p95": .., "p99": .., "count": n}}}
+        """
+        with self._lock:
+            result = {}
+            for backend, windows in self._windows.items():
+                totals = self._totals[backend]
+                entry = {"requests": int(totals["requests"]), "errors": int(totals["errors"])}
+                for field, values in windows.items():
+                    if values:
+                        ordered = sorted(values)
+                        entry[field] = {f"p{round(q * 100)}": percentile(ordered, q) for q in QUANTILES}
+                        entry[field]["count"] = len(ordered)
+                result[backend] = entry
+            return result
+
+    def prometheus_text(self):
+        """Render the current counters and rolling summaries in the Prometheus text exposition format."""
+        summary = self.summary()
+        with self._lock:
+            totals = {backend: dict(values) for backend, values in self._totals.items()}
+            peak_memory = dict(self._peak_memory)
+        lines = []
+
+        def header(name, help_text, kind):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        header("llm_requests_total", "Generation requests", "counter")
+        for backend, values in totals.items():
+            lines.append(f'llm_requests_total{{backend="{backend}"}} {values["requests"]:g}')
+        header("llm_request_errors_total", "Generation requests that failed or returned an error", "counter")
+        for backend, values in totals.items():
+            lines.append(f'llm_request_errors_total{{backend="{backend}"}} {values["errors"]:g}')
+        for field, (name, help_text) in COUNTERS.items():
+            header(name, help_text, "counter")
+            for backend, values in totals.items():
+                lines.append(f'{name}{{backend="{backend}"}} {values.get(field, 0):g}')
+        for field, (name, help_text) in SUMMARIES.items():
+            header(name, f"{help_text} (quantiles over the last {self.window} requests)", "summary")
+            for backend, entry in summary.items():
+                if field not in entry:
+                    continue
+                for q in QUANTILES:
+                    value = entry[field][f"p{round(q * 100)}"]
+                    lines.append(f'{name}{{backend="{backend}",quantile="{q}"}} {value:.6g}')
+                lines.append(f'{name}_sum{{backend="{backend}"}} {totals[backend][f"{field}_sum"]:.6g}')
+                lines.append(f'{name}_count{{backend="{backend}"}} {totals[backend][f"{field}_count"]:g}')
+        header("llm_peak_memory_bytes", "Highest peak memory seen during a request (GPU if in use, else RSS)", "gauge")
+        for backend, value in peak_memory.items():
+            lines.append(f'llm_peak_memory_bytes{{backend="{backend}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        """Atomically rewrite metrics.prom."""
+        if not self.metrics_path:
+            return
+        text = self.prometheus_text()
+        tmp_path = self.metrics_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, self.metrics_path)
+        self._last_export = time.monotonic()
+
+    def close(self):
+        """Write the final metrics file and close the event log."""
+        self.export()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+def enable(directory=TELEMETRY_DIR, **options):
+    """Turn telemetry on for this process (like TELEMETRY=1) and return the collector."""
+    global TELEMETRY_ENABLED, _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            _telemetry = Telemetry(directory, **options)
+            atexit.register(_telemetry.close)
+        TELEMETRY_ENABLED = True
+        return _telemetry
+
+def disable():
+    """Stop recording; the collector and its files are kept."""
+    global TELEMETRY_ENABLED
+    TELEMETRY_ENABLED = False
+
+def get_telemetry():
+    """Return the process-wide collector, or None when telemetry is disabled."""
+    if not TELEMETRY_ENABLED:
+        return None
+    return _telemetry or enable()
+
+def track(backend, model=None, **fields):
+    """
+    Span for one generation request, or the no-op NULL_SPAN when telemetry is disabled.
+    :param backend: "llama", "llama-speculative", "gemini", "gemini-async", "hf-pipeline", ...
+    :param fields: Extra event fields, e.g. max_tokens.
+    """
+    if not TELEMETRY_ENABLED:
+        return NULL_SPAN
+    return get_telemetry().span(backend, model, **fields)
+
+def current_span():
+    """The innermost active span in this thread / asyncio task (NULL_SPAN if none)."""
+    return _current.get() or NULL_SPAN
+
+def summarize_file(events_path, window=None):
+    """Recompute per-backend summaries from an events.jsonl file (the last `window` events per backend)."""
+    collector = Telemetry(directory=None, window=window or sys.maxsize)
+    with open(events_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                collector.record(json.loads(line))
+    return collector
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a telemetry events.jsonl file.")
+    parser.add_argument("events_file", nargs="?", default=os.path.join(TELEMETRY_DIR, "events.jsonl"))
+    parser.add_argument("--window", type=int, default=None, help="Only use the last N events per backend")
+    parser.add_argument("--prometheus", action="store_true", help="Print the Prometheus text format instead")
+    args = parser.parse_args()
+
+    collector = summarize_file(args.events_file, args.window)
+    if args.prometheus:
+        print(collector.prometheus_text(), end="")
+    else:
+        for backend, entry in collector.summary().items():
+            print(f"📊 {backend}: {entry['requests']} requests, {entry['errors']} errors")
+            for field in SUMMARIES:
+                if field in entry:
+                    stats = entry[field]
+                    print(f"   {field:<15} p50 {stats['p50']:.4g}  p95 {stats['p95']:.4g}  p99 {stats['p99']:.4g}"
+                          f"  (n={stats['count']})")
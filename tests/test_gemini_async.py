@@ -0,0 +1,67 @@
+"""Async Gemini client against the local stub server (no API key or network needed)."""
+
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import model_manager
+from gemini_stub import GeminiStub
+from model_manager import GeminiRateLimiter, agenerate_batch, agenerate_with_gemini, parse_retry_after
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_parse_retry_after():
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0  # In the past: retry now
+    future = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 < parse_retry_after(future) <= 30
+
+def test_batch_survives_http_date_retry_after():
+    async def scenario():
+        async with GeminiStub(latency=0.01, rate_limit_first=1, retry_after="Wed, 21 Oct 2015 07:28:00 GMT") as stub:
+            prompts = [f"question {i}" for i in range(4)]
+            answers = await agenerate_batch(prompts, rpm=6000, tpm=10_000_000, base_url=stub.base_url)
+            return prompts, answers, stub
+
+    prompts, answers, stub = run(scenario())
+    assert answers == [f"echo: {prompt}" for prompt in prompts]
+    assert stub.rejected == 1
+
+def test_429_throttles_shared_limiter():
+    async def scenario():
+        async with GeminiStub(latency=0.01, rate_limit_first=1, retry_after="0.3") as stub:
+            limiter = GeminiRateLimiter(rpm=6000, tpm=10_000_000)
+            start = time.monotonic()
+            answer = await agenerate_with_gemini("hello", limiter=limiter, base_url=stub.base_url)
+            return answer, time.monotonic() - start, limiter, stub
+
+    answer, elapsed, limiter, stub = run(scenario())
+    assert answer == "echo: hello"
+    assert stub.requests == 2 and stub.rejected == 1
+    assert elapsed >= 0.3  # Waited out Retry-After before retrying
+    assert limiter.requests.rate < limiter.requests.max_rate  # Rate halved, only partly recovered
+
+def test_batch_keeps_prompt_order_under_jitter():
+    async def scenario():
+        async with GeminiStub(latency=0.0, jitter=0.05, rate_limit_first=3, retry_after="0.1") as stub:
+            prompts = [f"question {i}" for i in range(20)]
+            answers = await agenerate_batch(prompts, max_concurrency=8, rpm=6000, tpm=10_000_000,
+                                            base_url=stub.base_url)
+            return prompts, answers, stub
+
+    prompts, answers, stub = run(scenario())
+    assert answers == [f"echo: {prompt}" for prompt in prompts]
+    assert sorted(stub.prompts) == sorted(prompts)
+    assert stub.rejected == 3
+
+def test_stream_against_stub():
+    async def scenario():
+        async with GeminiStub(latency=0.01) as stub:
+            stream = model_manager.astream_with_gemini("one two three", base_url=stub.base_url,
+                                                       limiter=GeminiRateLimiter(rpm=6000, tpm=10_000_000))
+            return await stream.read()
+
+    assert run(scenario()) == "echo: one two three"